@@ -0,0 +1,242 @@
+"""
+In-memory prefix index of games, teams, players and authors, for inline-query autocomplete
+"""
+
+from __future__ import annotations
+
+import bisect
+import enum
+import re
+import threading
+import typing
+from dataclasses import dataclass, field
+
+from entities.game_attrs import GameFormat
+from meta_constants import AUTOCOMPLETE_MAX_RESULTS, AUTOCOMPLETE_MAX_TERMS
+from translations import Language
+
+if typing.TYPE_CHECKING:
+    from db_api import QEngNewsDB
+
+__all__ = [
+    "SuggestionKind", "Suggestion", "AutocompleteIndex",
+    "AUTOCOMPLETE_INDEX",
+]
+
+WORD = re.compile(r"\w+")
+
+
+class SuggestionKind(enum.Enum):
+    """
+    Values are the keys of /subscribe, and narrow the search down when the query starts with one
+    """
+    Game = "game"
+    Team = "team"
+    Player = "player"
+    Author = "author"
+
+
+@dataclass(frozen=True)
+class Suggestion:
+    kind: SuggestionKind
+    domain: str
+    domain_title: str
+    entity_id: int
+    # Teams and players are only known by ID
+    name: typing.Optional[str]
+    # Start time of a game; the latest game of anyone else
+    context: str
+    words: typing.Tuple[str, ...]
+
+    def matches(self, terms: typing.List[str]) -> bool:
+        return all(
+            any(word.startswith(term) for word in self.words)
+            for term in terms
+        )
+
+
+def _words(*texts: typing.Any) -> typing.Tuple[str, ...]:
+    res = tuple(sorted({
+        word
+        for text in texts
+        for word in WORD.findall(str(text).casefold())
+    }))
+    return res
+
+
+@dataclass(frozen=True)
+class _PrefixArray:
+    """
+    Every word of every suggestion, sorted, next to the suggestion it came from
+    """
+    keys: typing.List[str]
+    suggestions: typing.List[Suggestion]
+
+    @classmethod
+    def build(cls, suggestions: typing.List[Suggestion]) -> _PrefixArray:
+        # Ties go to the suggestion that came first, i.e. the most recent one
+        pairs = sorted(
+            (word, i)
+            for i, suggestion in enumerate(suggestions)
+            for word in suggestion.words
+        )
+        return cls([word for word, _ in pairs], [suggestions[i] for _, i in pairs])
+
+    def starting_with(self, prefix: str) -> typing.Iterator[Suggestion]:
+        i = bisect.bisect_left(self.keys, prefix)
+        while i < len(self.keys) and self.keys[i].startswith(prefix):
+            yield self.suggestions[i]
+            i += 1
+
+
+def _domain_suggestions(
+        domain: str, domain_title: str, rows: typing.List[typing.Tuple],
+) -> typing.Dict[SuggestionKind, typing.List[Suggestion]]:
+    """
+    Rows are (ID, NAME, FORMAT, START_TIME, PLAYER_IDS, AUTHORS, AUTHORS_IDS), latest game first
+    """
+    res = {kind: [] for kind in SuggestionKind}
+    # Everyone but games is met in many games; the first one seen is their latest
+    seen = {kind: set() for kind in SuggestionKind}
+    for game_id, name, game_format, start_time, player_ids, authors, authors_ids in rows:
+        name = name or ""
+        res[SuggestionKind.Game].append(Suggestion(
+            SuggestionKind.Game, domain, domain_title, int(game_id), name, str(start_time),
+            _words(name, game_id),
+        ))
+
+        kind = SuggestionKind.Team if game_format == GameFormat.Team.value else SuggestionKind.Player
+        kind_seen = seen[kind]
+        for player_id in (player_ids or "").split(","):
+            if player_id.isdigit() and player_id not in kind_seen:
+                kind_seen.add(player_id)
+                res[kind].append(Suggestion(kind, domain, domain_title, int(player_id), None, name, (player_id,)))
+
+        author_names = authors.split("%") if authors else []
+        author_ids = authors_ids.split("%") if authors_ids else []
+        # Authors scraped from HTML come without IDs, and are of no use for a rule
+        if len(author_names) != len(author_ids):
+            continue
+        kind_seen = seen[SuggestionKind.Author]
+        for author_name, author_id in zip(author_names, author_ids):
+            if author_id.isdigit() and author_id not in kind_seen:
+                kind_seen.add(author_id)
+                res[SuggestionKind.Author].append(Suggestion(
+                    SuggestionKind.Author, domain, domain_title, int(author_id), author_name, name,
+                    _words(author_name, author_id),
+                ))
+    return res
+
+
+@dataclass
+class AutocompleteIndex:
+    """
+    Answers every keystroke from memory. A domain's part of the index is rebuilt as a whole,
+    off the request path, once its games were polled again; the other domains stay as they are.
+    The domains and language of every user are kept next to it, reloaded once the rules changed
+    """
+    # Per domain, per kind
+    _domains: typing.Dict[str, typing.Dict[SuggestionKind, _PrefixArray]] = field(
+        init=False, repr=False, default_factory=dict,
+    )
+    # Last poll time of every domain the index was built from
+    _versions: typing.Dict[str, str] = field(init=False, repr=False, default_factory=dict)
+    _user_domains: typing.Dict[int, typing.List[str]] = field(init=False, repr=False, default_factory=dict)
+    _user_languages: typing.Dict[int, Language] = field(init=False, repr=False, default_factory=dict)
+    # What the users were loaded from
+    _rules_version: typing.Optional[str] = field(init=False, repr=False, default=None)
+    _lock: threading.Lock = field(init=False, repr=False, default_factory=threading.Lock)
+
+    def refresh(self, db: QEngNewsDB) -> typing.List[str]:
+        """
+        Rebuilds the domains polled since the last refresh and forgets the untracked ones,
+        and reloads the users if the rules changed. Returns the domains rebuilt
+        """
+        rules_version = db.get_rules_version()
+        if rules_version != self._rules_version:
+            user_domains, user_languages = db.autocomplete_users()
+            with self._lock:
+                self._user_domains = user_domains
+                self._user_languages = user_languages
+            self._rules_version = rules_version
+        versions = db.get_domain_versions()
+        for domain in set(self._versions).difference(versions):
+            self.drop_domain(domain)
+        rebuilt = []
+        for domain, version in versions.items():
+            if self._versions.get(domain) == version:
+                continue
+            version, domain_title, rows = db.autocomplete_rows(domain)
+            self.replace_domain(domain, version, domain_title, rows)
+            rebuilt.append(domain)
+        return rebuilt
+
+    def replace_domain(
+            self, domain: str, version: typing.Optional[str], domain_title: str, rows: typing.List[typing.Tuple],
+    ) -> None:
+        arrays = {
+            kind: _PrefixArray.build(suggestions)
+            for kind, suggestions in _domain_suggestions(domain, domain_title, rows).items()
+        }
+        with self._lock:
+            self._domains[domain] = arrays
+            self._versions[domain] = version
+        return None
+
+    def drop_domain(self, domain: str) -> None:
+        with self._lock:
+            self._domains.pop(domain, None)
+            self._versions.pop(domain, None)
+        return None
+
+    def user_domains(self, user_id: int) -> typing.List[str]:
+        return self._user_domains.get(user_id, [])
+
+    def user_language(self, user_id: int) -> Language:
+        """
+        English for users who never chose one, like QEngNewsDB.get_user_language
+        """
+        return self._user_languages.get(user_id, Language.English)
+
+    def set_user_language(self, user_id: int, language: Language) -> None:
+        with self._lock:
+            self._user_languages[user_id] = language
+        return None
+
+    def complete(
+            self, text: str, domains: typing.Iterable[str], limit: int = AUTOCOMPLETE_MAX_RESULTS,
+    ) -> typing.List[Suggestion]:
+        """
+        Suggestions from the given domains, in that order, having a word that starts with every word of the text.
+        "team 40" looks for teams only
+        """
+        terms = WORD.findall(text.casefold())[:AUTOCOMPLETE_MAX_TERMS + 1]
+        kinds = list(SuggestionKind)
+        kind_keywords = {kind.value: kind for kind in SuggestionKind}
+        if len(terms) > 1 and terms[0] in kind_keywords:
+            kinds = [kind_keywords[terms.pop(0)]]
+        terms = terms[:AUTOCOMPLETE_MAX_TERMS]
+        if not terms:
+            return []
+        # The longest word has the fewest candidates; the rest only filter them
+        probe = max(terms, key=len)
+
+        res = []
+        seen = set()
+        for domain in dict.fromkeys(domains):
+            arrays = self._domains.get(domain)
+            if arrays is None:
+                continue
+            for kind in kinds:
+                for suggestion in arrays[kind].starting_with(probe):
+                    key = (domain, kind, suggestion.entity_id)
+                    if key in seen or not suggestion.matches(terms):
+                        continue
+                    seen.add(key)
+                    res.append(suggestion)
+                    if len(res) >= limit:
+                        return res
+        return res
+
+
+AUTOCOMPLETE_INDEX = AutocompleteIndex()
@@ -0,0 +1,97 @@
+"""
+Inline-query autocomplete over a large synthetic set of games: the cost of building the index,
+of rebuilding a polled domain, and of answering keystrokes, from the first letter on.
+
+    python benchmarks/bench_autocomplete.py [n_games]
+"""
+
+import itertools
+import os
+import random
+import sys
+import time
+import typing
+
+cur_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(cur_dir, ".."))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+from autocomplete import AutocompleteIndex
+from entities.game_attrs import GameFormat
+
+N_DOMAINS = 200
+N_USER_DOMAINS = 3
+VOCABULARY_SIZE = 50_000
+# Word frequencies follow Zipf's law: w0 is in every other game name, w12345 in a few
+KEYSTROKES = {
+    "one_letter": "w",
+    "common_prefix": "w1",
+    "rare_word": "w12345",
+    "two_words": "w2 w1",
+    "team_id": "team 12",
+    "author": "author a1",
+    "no_match": "nothing",
+}
+
+
+def _domain_rows(rnd: random.Random, n_games: int) -> typing.List[typing.Tuple]:
+    vocabulary = [f"w{i}" for i in range(VOCABULARY_SIZE)]
+    cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(VOCABULARY_SIZE)))
+    rows = []
+    for i in range(n_games):
+        teams = rnd.sample(range(1, 5_000), 10)
+        authors = rnd.sample(range(1, 2_000), 2)
+        rows.append((
+            n_games - i,
+            " ".join(rnd.choices(vocabulary, cum_weights=cum_weights, k=4)),
+            GameFormat.Team.value,
+            "2030-01-01 10:00:00",
+            ",".join(map(str, teams)),
+            "%".join(f"a{a}" for a in authors),
+            "%".join(map(str, authors)),
+        ))
+    return rows
+
+
+def run(n_games: int, n_keystrokes: int = 1_000) -> typing.Dict[str, float]:
+    """
+    Milliseconds per operation
+    """
+    rnd = random.Random(42)
+    domains = [f"https://game{i}.qeng.org" for i in range(N_DOMAINS)]
+    rows = {
+        domain: _domain_rows(rnd, n_games // N_DOMAINS)
+        for domain in domains
+    }
+
+    res = {}
+    index = AutocompleteIndex()
+    start = time.perf_counter()
+    for domain in domains:
+        index.replace_domain(domain, "v1", domain, rows[domain])
+    res["build_all"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    index.replace_domain(domains[0], "v2", domains[0], rows[domains[0]])
+    res["rebuild_domain"] = (time.perf_counter() - start) * 1000
+
+    user_domains = domains[:N_USER_DOMAINS]
+    for case_name, text in KEYSTROKES.items():
+        start = time.perf_counter()
+        for _ in range(n_keystrokes):
+            index.complete(text, user_domains)
+        res[f"keystroke_{case_name}"] = (time.perf_counter() - start) / n_keystrokes * 1000
+    return res
+
+
+def main(n_games: int) -> None:
+    print(f"{n_games} games in {N_DOMAINS} domains")
+    print(f"{'op':<28}{'ms':>10}")
+    for op_name, ms in run(n_games).items():
+        print(f"{op_name:<28}{ms:>10.3f}")
+    return None
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
@@ -0,0 +1,99 @@
+"""
+Description diff over worst-case inputs: long descriptions with no sentence breaks, repetitive text,
+completely rewritten text, and a typical small edit for comparison.
+
+    python benchmarks/bench_diff.py [n_chars]
+"""
+
+import os
+import random
+import sys
+import time
+import typing
+
+cur_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(cur_dir, ".."))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+import description_diff
+from description_diff import html_diffs
+
+
+def _words(rnd: random.Random, n_chars: int, vocabulary: typing.List[str]) -> typing.List[str]:
+    words = []
+    length = 0
+    while length < n_chars:
+        word = rnd.choice(vocabulary)
+        words.append(word)
+        length += len(word) + 1
+    return words
+
+
+def _cases(n_chars: int) -> typing.Dict[str, typing.Tuple[str, str]]:
+    rnd = random.Random(42)
+    vocabulary = [f"word{i}" for i in range(500)]
+    small_vocabulary = ["a", "b", "c", "d"]
+
+    # A single "sentence": the token level diff gets the whole text at once
+    one_sentence = _words(rnd, n_chars, vocabulary)
+    one_sentence_edited = [
+        w if rnd.random() > 0.3 else rnd.choice(vocabulary)
+        for w in one_sentence
+    ]
+    repetitive = _words(rnd, n_chars, small_vocabulary)
+    repetitive_edited = [
+        w if rnd.random() > 0.3 else rnd.choice(small_vocabulary)
+        for w in repetitive
+    ]
+    sentences = [
+        " ".join(_words(rnd, 80, vocabulary)) + "."
+        for _ in range(n_chars // 80)
+    ]
+    small_edit = list(sentences)
+    small_edit[len(small_edit) // 2] = " ".join(_words(rnd, 80, vocabulary)) + "."
+
+    cases = {
+        "one_sentence": (" ".join(one_sentence), " ".join(one_sentence_edited)),
+        "repetitive": (" ".join(repetitive), " ".join(repetitive_edited)),
+        "rewritten": (" ".join(sentences), " ".join(_words(rnd, n_chars, vocabulary))),
+        "small_edit": (" ".join(sentences), " ".join(small_edit)),
+    }
+    return cases
+
+
+def _clear_cache() -> None:
+    cache_clear = getattr(html_diffs, "cache_clear", None)
+    if cache_clear is not None:
+        cache_clear()
+    return None
+
+
+def run(n_chars: int) -> typing.Dict[str, typing.Tuple[float, float]]:
+    """
+    Seconds per diff, cold and memoized, per case
+    """
+    res = {}
+    for case_name, (a, b) in _cases(n_chars).items():
+        _clear_cache()
+        start = time.perf_counter()
+        html_diffs(a, b, "Old", "New")
+        cold = time.perf_counter() - start
+
+        start = time.perf_counter()
+        html_diffs(a, b, "Old", "New")
+        warm = time.perf_counter() - start
+        res[case_name] = cold, warm
+    return res
+
+
+def main(n_chars: int) -> None:
+    print(f"{description_diff.__name__}, {n_chars} chars per description")
+    print(f"{'case':<15}{'cold, s':>10}{'memoized, s':>14}")
+    for case_name, (cold, warm) in run(n_chars).items():
+        print(f"{case_name:<15}{cold:>10.3f}{warm:>14.5f}")
+    return None
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
@@ -0,0 +1,91 @@
+"""
+Reminder scheduling on the heap at growing sizes: the cost of scheduling, of moving a reminder
+whose game moved, of syncing a domain that changed nothing, and of popping what is due.
+
+    python benchmarks/bench_reminders.py [max_reminders]
+"""
+
+import datetime
+import os
+import random
+import sys
+import time
+import typing
+
+cur_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(cur_dir, ".."))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+os.environ.setdefault("API_KEY", "benchmark")
+
+from reminders import Reminder, ReminderScheduler
+from translations import Language
+
+N_DOMAINS = 200
+N_MOVES = 10_000
+
+
+def _reminders(rnd: random.Random, n: int, now: datetime.datetime) -> typing.List[Reminder]:
+    res = [
+        Reminder(
+            i % 50_000, f"https://game{i % N_DOMAINS}.qeng.org", i, f"game {i}",
+            now + datetime.timedelta(seconds=rnd.randrange(3_600, 86_400)), Language.Russian,
+        )
+        for i in range(n)
+    ]
+    return res
+
+
+def run(n: int) -> typing.Dict[str, float]:
+    """
+    Microseconds per reminder
+    """
+    rnd = random.Random(42)
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    reminders = _reminders(rnd, n, now)
+    # Sending is never started; the heap is driven by hand
+    scheduler = ReminderScheduler(executor=None, send=lambda r: None)
+
+    res = {}
+    start = time.perf_counter()
+    for reminder in reminders:
+        scheduler.schedule(reminder)
+    res["schedule"] = (time.perf_counter() - start) / n * 1e6
+
+    moved = [
+        Reminder(r.user_id, r.domain, r.game_id, r.game_name, r.start_time + datetime.timedelta(hours=1), r.language)
+        for r in rnd.sample(reminders, min(N_MOVES, n))
+    ]
+    start = time.perf_counter()
+    for reminder in moved:
+        scheduler.schedule(reminder)
+    res["move"] = (time.perf_counter() - start) / len(moved) * 1e6
+
+    domain = reminders[0].domain
+    domain_reminders = [scheduler._scheduled[r.key] for r in reminders if r.domain == domain]
+    start = time.perf_counter()
+    # noinspection PyProtectedMember
+    scheduler._sync(domain_reminders, [domain])
+    res["sync_domain_unchanged"] = (time.perf_counter() - start) / len(domain_reminders) * 1e6
+
+    start = time.perf_counter()
+    # noinspection PyProtectedMember
+    popped = scheduler._pop_due(time.time() + 2 * 86_400)
+    res["pop_due"] = (time.perf_counter() - start) / len(popped) * 1e6
+    return res
+
+
+def main(max_reminders: int) -> None:
+    sizes = [n for n in (1_000, 10_000, 100_000, 1_000_000) if n <= max_reminders]
+    results = {n: run(n) for n in sizes}
+    ops = list(results[sizes[0]])
+    print("us per reminder")
+    print(f"{'reminders':<12}" + "".join(f"{op:>24}" for op in ops))
+    for n, res in results.items():
+        print(f"{n:<12}" + "".join(f"{res[op]:>24.2f}" for op in ops))
+    return None
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,111 @@
+"""
+Microbenchmarks of the notification rendering hot path: change and game messages, rules,
+and the localization lookups they are built from.
+
+    python benchmarks/bench_rendering.py [n_iterations]
+"""
+
+import datetime
+import os
+import sys
+import time
+import types
+import typing
+
+cur_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(cur_dir, ".."))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+os.environ.setdefault("API_KEY", "benchmark")
+
+from bot_constants import localize_dedent, MenuItem
+from entities import Domain, Rule, Change, GameMode, GameFormat, PassingSequence
+from entities.qeng_domain import QEngGame
+from meta_constants import USER_LANGUAGE_KEY
+from translations import Language
+
+DOMAIN = Domain.from_url("game.qeng.org")
+LANGUAGES = [Language.Russian, Language.English, Language.Ukrainian]
+START = datetime.datetime(2030, 1, 1, 10)
+
+
+def _make_game(game_id: int) -> QEngGame:
+    game = QEngGame(
+        DOMAIN, game_id, f"Game {game_id}",
+        GameMode.Quest, GameFormat.Team, PassingSequence.Linear,
+        START, START + datetime.timedelta(hours=5),
+        [1, 2, 3], "Description of the game. " * 20,
+        ["Author A", "Author B"], [11, 12],
+        None, None, None,
+    )
+    return game
+
+
+def _make_change(game_id: int) -> Change:
+    change = Change(
+        game_new=False, name_changed=True, passing_sequence_changed=True,
+        start_time_changed=True, end_time_changed=True, players_list_changed=True,
+        description_changed=False, new_message=False,
+        old_name=f"Game {game_id}", new_name=f"Renamed game {game_id}",
+        old_passing_sequence=PassingSequence.Linear, new_passing_sequence=PassingSequence.Storm,
+        old_start_time=START, new_start_time=START + datetime.timedelta(days=1, hours=2),
+        old_end_time=START + datetime.timedelta(hours=5), new_end_time=START + datetime.timedelta(days=1, hours=8),
+        old_player_ids=[1, 2], new_player_ids=[1, 2, 3],
+        old_description_truncated=None, new_description_truncated=None,
+        new_message_text=None, new_last_message_id=None,
+        domain=DOMAIN, id=game_id,
+        game_mode=GameMode.Quest, game_format=GameFormat.Team,
+        authors=["Author A"], authors_ids=[11],
+        forum_thread_id=None,
+    )
+    return change
+
+
+def _localize_dedent_op() -> typing.Callable[[int], str]:
+    update = types.SimpleNamespace(message=types.SimpleNamespace(chat_id=1))
+    context = types.SimpleNamespace(chat_data={USER_LANGUAGE_KEY: Language.English.value})
+    return lambda i: localize_dedent(MenuItem.DomainPrompt, update, context)
+
+
+def _workload() -> typing.Dict[str, typing.Callable[[int], typing.Any]]:
+    changes = [_make_change(i) for i in range(100)]
+    games = [_make_game(i) for i in range(100)]
+    rules = [Rule(domain=DOMAIN, team_id=i) for i in range(100)]
+    mode_names = [mode.localized_name(lang) for mode in GameMode for lang in LANGUAGES]
+    ops = {
+        "change_to_str": lambda i: changes[i % 100].to_str(LANGUAGES[i % 3]),
+        "game_to_str": lambda i: games[i % 100].to_str(LANGUAGES[i % 3]),
+        "rule_to_str": lambda i: rules[i % 100].to_str(LANGUAGES[i % 3]),
+        "enum_from_str": lambda i: GameMode.from_str(mode_names[i % len(mode_names)]),
+        "language_from_str": lambda i: Language.from_str(("en", "ru", "uk")[i % 3]),
+        "domain_from_url": lambda i: Domain.from_url("game.qeng.org"),
+        "localize_dedent": _localize_dedent_op(),
+    }
+    return ops
+
+
+def run(n_iterations: int) -> typing.Dict[str, float]:
+    """
+    Microseconds per call, per operation
+    """
+    res = {}
+    for op_name, op in _workload().items():
+        start = time.perf_counter()
+        for i in range(n_iterations):
+            op(i)
+        duration = time.perf_counter() - start
+        res[op_name] = duration / n_iterations * 1e6
+    return res
+
+
+def main(n_iterations: int) -> None:
+    res = run(n_iterations)
+    print(f"{'op':<20}{'us/call':>12}")
+    for op_name, us in res.items():
+        print(f"{op_name:<20}{us:>12.2f}")
+    return None
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
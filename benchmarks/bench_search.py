@@ -0,0 +1,109 @@
+"""
+Full-text game search over a large synthetic DB: the cost of indexing, of a poll that changed
+a few games, and of searches for rare, common and prefix terms.
+
+    python benchmarks/bench_search.py [n_games]
+"""
+
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+import typing
+
+cur_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(cur_dir, ".."))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+os.environ.setdefault("API_KEY", "benchmark")
+
+from db_api import QEngNewsDB
+from entities import Domain, Rule
+from translations import Language
+
+N_DOMAINS = 200
+N_USER_DOMAINS = 3
+VOCABULARY_SIZE = 50_000
+USER_ID = 1
+# Word frequencies follow Zipf's law, like in real descriptions: w0 is in every game, w12345 in a few
+SEARCHES = {
+    "common": "w0",
+    "rare": "w12345",
+    "common_and_rare": "w20 w1000",
+    # A prefix of over a hundred words, itself a common word
+    "prefix": "w100",
+    # The same prefix after a rare word: as words, they are in too few games, so the prefix is expanded
+    "prefix_expanded": "w40000 w100",
+    "no_match": "nothing",
+}
+
+
+def _fill(db: QEngNewsDB, n_games: int) -> typing.List[str]:
+    rnd = random.Random(42)
+    vocabulary = [f"w{i}" for i in range(VOCABULARY_SIZE)]
+    cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(VOCABULARY_SIZE)))
+    domains = [Domain.from_url(f"game{i}.qeng.org").full_url for i in range(N_DOMAINS)]
+    rows = [
+        (
+            domains[i % N_DOMAINS], i,
+            " ".join(rnd.choices(vocabulary, cum_weights=cum_weights, k=4)),
+            "2030-01-01 10:00:00",
+            " ".join(rnd.choices(vocabulary, cum_weights=cum_weights, k=100)),
+        )
+        for i in range(n_games)
+    ]
+    # noinspection PyProtectedMember
+    db._db_conn.executemany(
+        "INSERT INTO DOMAIN_GAMES (DOMAIN, ID, NAME, START_TIME, DESCRIPTION_TRUNCATED) VALUES (?, ?, ?, ?, ?)",
+        rows,
+    )
+    db.commit()
+    return domains
+
+
+def run(n_games: int, n_searches: int = 100) -> typing.Dict[str, float]:
+    """
+    Milliseconds per operation
+    """
+    res = {}
+    with tempfile.TemporaryDirectory() as tmp_dir, QEngNewsDB(os.path.join(tmp_dir, "bench.sqlite")) as db:
+        domains = _fill(db, n_games)
+        db.set_user_language(USER_ID, Language.Russian)
+        for domain in domains[:N_USER_DOMAINS]:
+            db.add_rule(USER_ID, Rule(domain=Domain.from_url(domain)))
+
+        start = time.perf_counter()
+        db.update_search_index(domains)
+        db.commit()
+        res["index_all"] = (time.perf_counter() - start) * 1000
+
+        # noinspection PyProtectedMember
+        db._db_conn.execute(
+            "UPDATE DOMAIN_GAMES SET NAME = NAME || ' renamed' WHERE DOMAIN = ? AND ID < 1000", (domains[0],),
+        )
+        start = time.perf_counter()
+        db.update_search_index(domains[:1])
+        db.commit()
+        res["reindex_domain"] = (time.perf_counter() - start) * 1000
+
+        for case_name, text in SEARCHES.items():
+            start = time.perf_counter()
+            for _ in range(n_searches):
+                db.search_games(USER_ID, text)
+            res[f"search_{case_name}"] = (time.perf_counter() - start) / n_searches * 1000
+    return res
+
+
+def main(n_games: int) -> None:
+    print(f"{n_games} games in {N_DOMAINS} domains")
+    print(f"{'op':<24}{'ms':>10}")
+    for op_name, ms in run(n_games).items():
+        print(f"{op_name:<24}{ms:>10.2f}")
+    return None
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
@@ -0,0 +1,90 @@
+"""
+Import time of every entry point, measured with `python -X importtime`, checked against a budget
+of time on top of `import telegram.ext`, which every entry point needs anyway, measured in the same run.
+Also fails if an entry point loads any of the heavy modules that are meant to be imported lazily.
+
+    python benchmarks/bench_startup.py [n_runs]
+"""
+
+import os
+import subprocess
+import sys
+import typing
+
+cur_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(cur_dir, ".."))
+
+# Milliseconds over the baseline, best of n_runs each. Runs are interleaved, so that load drifting
+# during the benchmark hits the baseline and the entry points alike
+BASELINE_MODULE = "telegram.ext"
+STARTUP_BUDGET_MS = {
+    "bot": 150,
+    "webhook": 150,
+    "update_db": 150,
+    "workers": 150,
+    "report": 150,
+}
+LAZY_MODULES = ("pandas", "numpy", "selenium", "PIL", "bs4", "feedparser")
+
+
+def measure(module: str) -> typing.Tuple[float, typing.Dict[str, float]]:
+    """
+    Total import time of the module and the cumulative time of every module it imported, in ms
+    """
+    env = dict(os.environ)
+    env.setdefault("API_KEY", "benchmark")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=root_dir, env=env, capture_output=True, text=True, check=True,
+    )
+    imported = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        imported[name.strip()] = int(cumulative) / 1000
+    return imported[module], imported
+
+
+def run(n_runs: int) -> typing.Tuple[float, typing.Dict[str, typing.Tuple[float, typing.List[str]]]]:
+    """
+    Best import time of the baseline, and best import time and the eagerly loaded lazy modules, per entry point
+    """
+    modules = [BASELINE_MODULE, *STARTUP_BUDGET_MS]
+    rounds = [{module: measure(module) for module in modules} for _ in range(n_runs)]
+    baseline = min(timings[BASELINE_MODULE][0] for timings in rounds)
+    res = {}
+    for module in STARTUP_BUDGET_MS:
+        timings = [round_timings[module] for round_timings in rounds]
+        best = min(total for total, _ in timings)
+        loaded = sorted({
+            name
+            for _, imported in timings
+            for name in imported
+            if name.split(".")[0] in LAZY_MODULES
+        })
+        res[module] = best, loaded
+    return baseline, res
+
+
+def main(n_runs: int) -> int:
+    baseline, res = run(n_runs)
+    failed = False
+    print(f"{BASELINE_MODULE} (baseline): {baseline:.0f} ms")
+    print(f"{'entry point':<12}{'ms':>8}{'over':>8}{'budget':>8}  eagerly loaded")
+    for module, (best, loaded) in res.items():
+        budget = STARTUP_BUDGET_MS[module]
+        is_ok = best - baseline <= budget and not loaded
+        failed = failed or not is_ok
+        top_level = sorted({name.split(".")[0] for name in loaded})
+        print(
+            f"{module:<12}{best:>8.0f}{best - baseline:>8.0f}{budget:>8}  "
+            f"{', '.join(top_level) or '-'}{'' if is_ok else '  FAIL'}"
+        )
+    return int(failed)
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5))
@@ -0,0 +1,83 @@
+"""
+Runs the same user-storage workload against every UserStore implementation.
+
+    python benchmarks/bench_storage.py [n_users]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import typing
+
+cur_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(cur_dir, ".."))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+from db_api import QEngNewsDB
+from entities import Domain, Rule
+from storage import UserStore, InMemoryUserStore
+from translations import Language
+
+DOMAINS = [
+    Domain.from_url(url)
+    for url in ("game.qeng.org", "quest.qeng.org", "demo.qeng.org")
+]
+
+
+def _make_stores(tmp_dir: str) -> typing.Dict[str, typing.Tuple[UserStore, typing.Callable[[], None]]]:
+    db = QEngNewsDB(os.path.join(tmp_dir, "bench.sqlite"))
+    stores = {
+        "sqlite": (db.store, db.commit),
+        "memory": (InMemoryUserStore(), lambda: None),
+    }
+    return stores
+
+
+def _workload() -> typing.Dict[str, typing.Callable[[UserStore, int], typing.Any]]:
+    languages = list(Language)
+    ops = {
+        "set_language": lambda store, u: store.set_language(u, languages[u % len(languages)]),
+        "add_rule": lambda store, u: store.add_rule(u, Rule(domain=DOMAINS[u % len(DOMAINS)], team_id=u)),
+        "track_domain": lambda store, u: store.track_domain(DOMAINS[u % len(DOMAINS)].full_url),
+        "set_stopped": lambda store, u: store.set_stopped(u, u % 2 == 0),
+        "set_digest": lambda store, u: store.set_digest(u, u % 3 == 0),
+        "get_language": lambda store, u: store.get_language(u),
+        "is_stopped": lambda store, u: store.is_stopped(u),
+        "count_rules": lambda store, u: store.count_rules(u),
+        "get_rules": lambda store, u: store.get_rules(u),
+        "get_domains": lambda store, u: store.get_domains(u),
+        "delete_rule": lambda store, u: store.delete_rule(u, Rule(domain=DOMAINS[u % len(DOMAINS)], team_id=u).rule_id),
+    }
+    return ops
+
+
+def run(n_users: int) -> typing.Dict[str, typing.Dict[str, float]]:
+    """
+    Operations per second, per operation and store
+    """
+    res = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for store_name, (store, commit) in _make_stores(tmp_dir).items():
+            for op_name, op in _workload().items():
+                start = time.perf_counter()
+                for user_id in range(n_users):
+                    op(store, user_id)
+                commit()
+                duration = time.perf_counter() - start
+                res.setdefault(op_name, {})[store_name] = n_users / duration
+    return res
+
+
+def main(n_users: int) -> None:
+    res = run(n_users)
+    store_names = list(next(iter(res.values())))
+    print(f"{'op/s':<15}" + "".join(f"{name:>12}" for name in store_names))
+    for op_name, by_store in res.items():
+        print(f"{op_name:<15}" + "".join(f"{by_store[name]:>12.0f}" for name in store_names))
+    return None
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000)
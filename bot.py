@@ -3,13 +3,16 @@ Bot main code
 """
 
 import textwrap
+import html
 import os
 import sys
 import functools
 
 import typing
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
-from telegram.ext import Updater, CommandHandler, CallbackContext, MessageHandler, Filters, ConversationHandler
+from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineQueryResultArticle, \
+    InputTextMessageContent
+from telegram.ext import Updater, CommandHandler, CallbackContext, MessageHandler, Filters, ConversationHandler, \
+    InlineQueryHandler
 
 import meta_constants
 
@@ -17,12 +20,24 @@ cur_dir = os.path.dirname(__file__)
 if cur_dir not in sys.path:
     sys.path.append(cur_dir)
 
-from bot_secrets import API_KEY
+from bot_secrets import API_KEY, WEBHOOK_URL, WEBHOOK_SECRET, SHARED_BOT_STATE, SEND_REMINDERS
 from version import __version__
-from db_api import QEngNewsDB
+from db_api import QEngNewsDB, QUERY_PROFILER
+from db_executor import DB_EXECUTOR
+from domain_warmup import DOMAIN_WARMER
+from query_profiler import REPORT_SORT_KEYS
+from message_packer import split_html_safe, pack_messages
+from webhook import run_webhook
+from persistence import SQLitePersistence
+from autocomplete import AUTOCOMPLETE_INDEX, SuggestionKind, Suggestion
+from reminders import ReminderScheduler
+from update_db import send_reminder
 from meta_constants import DB_LOCATION, USER_LANGUAGE_KEY, MAIN_MENU_COMMAND, \
-    GAME_RULE_DOMAIN_KEY, RULE_ID_LENGTH, InvalidDomainError, DEFAULT_DAYS_IN_FUTURE
+    GAME_RULE_DOMAIN_KEY, RULE_ID_LENGTH, InvalidDomainError, DomainLookupTimeoutError, DEFAULT_DAYS_IN_FUTURE, \
+    QUERY_REPORT_TOP_N, BOT_WORKERS, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, \
+    AUTOCOMPLETE_REFRESH_SECONDS, AUTOCOMPLETE_CACHE_SECONDS, REMINDER_SYNC_SECONDS
 from translations import Language
+from description_diff import DiffMode
 from bot_constants import State, MENU_LOCALIZATION, MenuItem, localize, handle_choice,\
     kb_from_menu_items, localize_dedent, find_user_lang, games_desc_adaptive, localize_dedent_no_newline_replacing
 from bot_constants import h as h_full
@@ -31,8 +46,8 @@ from bot_constants import h as h_full
 # noinspection PyUnusedLocal
 def prompt_language(update: Update, context: CallbackContext) -> int:
 
-    with QEngNewsDB(DB_LOCATION) as db:
-        db.start_user_updates(update.message.chat_id)
+    chat_id = update.message.chat_id
+    DB_EXECUTOR.run(lambda db: db.start_user_updates(chat_id))
 
     msg = "Hello! Which language do you want me to speak?"
     kb = [
@@ -53,8 +68,9 @@ def store_user_lang(update: Update, context: CallbackContext) -> int:
     lang = update.message.text
     lang = Language.from_full_name(lang)
     context.chat_data[USER_LANGUAGE_KEY] = lang.value
-    with QEngNewsDB(DB_LOCATION) as db:
-        db.set_user_language(update.message.chat_id, lang)
+    chat_id = update.message.chat_id
+    DB_EXECUTOR.run(lambda db: db.set_user_language(chat_id, lang))
+    AUTOCOMPLETE_INDEX.set_user_language(chat_id, lang)
     lang_set_msg = MENU_LOCALIZATION[MenuItem.LangSet][lang]
     lang_set_msg = lang_set_msg.format(lang.full_name)
     update.message.reply_text(lang_set_msg)
@@ -96,8 +112,8 @@ def settings_choice_done(update: Update, context: CallbackContext) -> int:
 
 
 def add_rule_promt(update: Update, context: CallbackContext) -> int:
-    with QEngNewsDB(DB_LOCATION) as db:
-        is_ok_to_add = db.is_user_within_rule_limits(update.message.chat_id)
+    chat_id = update.message.chat_id
+    is_ok_to_add = DB_EXECUTOR.run(lambda db: db.is_user_within_rule_limits(chat_id))
     if not is_ok_to_add:
         msg = localize_dedent(MenuItem.RuleLimitReached, update, context)
         update.message.reply_text(msg)
@@ -149,8 +165,7 @@ def _find_rules(
     add_href: bool = False, force_no_href: bool = False,
 ) -> typing.List[str]:
     chat_id = update.message.chat_id
-    with QEngNewsDB(DB_LOCATION) as db:
-        rules = db.get_user_rules(chat_id)
+    rules = DB_EXECUTOR.run(lambda db: db.get_user_rules(chat_id))
     lang = find_user_lang(update, context)
     rules = [
         r.to_str(lang, add_href=add_href, force_no_href=force_no_href)
@@ -192,14 +207,18 @@ def add_domain_get_domain(update: Update, context: CallbackContext) -> int:
     chat_id = update.message.chat_id
     domain = update.message.text
 
-    with QEngNewsDB(DB_LOCATION) as db:
-        # TODO: add domain validation logic
-        try:
-            succ, rule = db.add_domain_to_user_outer(chat_id, domain)
-        except InvalidDomainError:
-            msg = localize(MenuItem.DomainInvalid, update, context)
-            update.message.reply_text(msg)
-            return settings_prompt(update, context)
+    # TODO: add domain validation logic
+    try:
+        succ, rule = DB_EXECUTOR.run(lambda db: db.add_domain_to_user_outer(chat_id, domain))
+    except DomainLookupTimeoutError:
+        msg = localize(MenuItem.DomainLookupTimeout, update, context)
+        update.message.reply_text(msg)
+        return settings_prompt(update, context)
+    except InvalidDomainError:
+        msg = localize(MenuItem.DomainInvalid, update, context)
+        update.message.reply_text(msg)
+        return settings_prompt(update, context)
+    DOMAIN_WARMER.request(rule.domain)
 
     item = MenuItem.RuleAdded if succ else MenuItem.RuleNotAdded
     msg = localize(item, update, context)
@@ -222,19 +241,22 @@ def wait_rule_to_delete(update: Update, context: CallbackContext) -> int:
         msg = localize(MenuItem.RuleIDInvalid, update, context)
         update.message.reply_text(msg)
         return settings_prompt(update, context)
-    with QEngNewsDB(DB_LOCATION) as db:
-        # TODO: add domain validation logic
-        rule = db.get_user_rule_by_id(chat_id, rule_id)
-        user_lang = find_user_lang(update, context)
+    # TODO: add domain validation logic
+    rule = DB_EXECUTOR.run(lambda db: db.get_user_rule_by_id(chat_id, rule_id))
+    user_lang = find_user_lang(update, context)
 
-        if rule_text != rule.to_str(user_lang, add_href=False, force_no_href=True):
-            msg = localize(MenuItem.RuleIDInvalid, update, context)
-            update.message.reply_text(msg)
-            return settings_prompt(update, context)
+    if rule_text != rule.to_str(user_lang, add_href=False, force_no_href=True):
+        msg = localize(MenuItem.RuleIDInvalid, update, context)
+        update.message.reply_text(msg)
+        return settings_prompt(update, context)
 
+    def _delete(db: QEngNewsDB) -> None:
         db.delete_user_rule_by_id(chat_id, rule_id)
         db.prune_rule_descriptions()
         db.prune_domain_query_status()
+        return None
+
+    DB_EXECUTOR.run(_delete)
     msg = localize(MenuItem.RuleDeleted, update, context)
     msg = msg.format(rule.to_str(user_lang), disable_web_page_preview=True)
     update.message.reply_text(msg, disable_web_page_preview=True, parse_mode='HTML')
@@ -253,8 +275,7 @@ def add_granular_rule(
     msg = localize(MenuItem.DomainChoicePrompt, update, context)
     chat_id = update.message.chat_id
 
-    with QEngNewsDB(DB_LOCATION) as db:
-        domains = db.get_user_domains(chat_id)
+    domains = DB_EXECUTOR.run(lambda db: db.get_user_domains(chat_id))
 
     another_domain = localize(MenuItem.AnotherDomain, update, context)
     kb = [
@@ -284,17 +305,24 @@ def accept_domain_granular_rule(
 ) -> int:
     domain = update.message.text
 
-    with QEngNewsDB(DB_LOCATION) as db:
-        try:
-            db.track_domain_outer(domain)
-        except InvalidDomainError:
-            msg = localize(MenuItem.DomainInvalid, update, context)
-            update.message.reply_text(msg)
-            return settings_prompt(update, context)
+    try:
+        domain_inst = DB_EXECUTOR.run(lambda db: db.track_domain_outer(domain))
+    except DomainLookupTimeoutError:
+        msg = localize(MenuItem.DomainLookupTimeout, update, context)
+        update.message.reply_text(msg)
+        return settings_prompt(update, context)
+    except InvalidDomainError:
+        msg = localize(MenuItem.DomainInvalid, update, context)
+        update.message.reply_text(msg)
+        return settings_prompt(update, context)
+    DOMAIN_WARMER.request(domain_inst)
 
-    context.chat_data[GAME_RULE_DOMAIN_KEY] = domain
+    # Normalized, so that inline queries can look the domain up while the ID is awaited
+    context.chat_data[GAME_RULE_DOMAIN_KEY] = domain_inst.full_url
     msg = localize_dedent(prompt, update, context)
     update.message.reply_text(msg, disable_web_page_preview=True, reply_markup=ReplyKeyboardRemove())
+    msg = localize(MenuItem.AutocompleteHint, update, context).format(context.bot.username)
+    update.message.reply_text(msg)
     return state
 
 
@@ -319,9 +347,9 @@ def add_granular_rule_get_id(
         update.message.reply_text(msg)
         return add_rule_promt(update, context)
 
-    with QEngNewsDB(DB_LOCATION) as db:
-        kwargs = {key: game_id}
-        succ, rule = db.add_mixed_rule_outer(chat_id, domain, **kwargs)
+    kwargs = {key: game_id}
+    succ, rule = DB_EXECUTOR.run(lambda db: db.add_mixed_rule_outer(chat_id, domain, **kwargs))
+    DOMAIN_WARMER.request(rule.domain)
 
     item = MenuItem.RuleAdded if succ else MenuItem.RuleNotAdded
     msg = localize(item, update, context)
@@ -338,8 +366,7 @@ def get_subscribed_games(update: Update, context: CallbackContext) -> int:
     msg = localize(MenuItem.GamesInFutureWarning, update, context)
     update.message.reply_text(msg)
 
-    with QEngNewsDB(DB_LOCATION) as db:
-        games = db.get_all_user_games(chat_id, DEFAULT_DAYS_IN_FUTURE)
+    games = DB_EXECUTOR.run(lambda db: db.get_all_user_games(chat_id, DEFAULT_DAYS_IN_FUTURE), slow=True)
 
     lang = find_user_lang(update, context)
     msgs = games_desc_adaptive(games, lang)
@@ -368,8 +395,8 @@ def error_handler(update: Update, context: CallbackContext) -> None:
 # noinspection PyUnusedLocal
 def info(update: Update, context: CallbackContext) -> None:
     msg = localize(MenuItem.Info, update, context)
-    with QEngNewsDB(DB_LOCATION) as db:
-        updates_on = db.get_updates_on_off(update.message.chat_id)
+    chat_id = update.message.chat_id
+    updates_on = DB_EXECUTOR.run(lambda db: db.get_updates_on_off(chat_id))
 
     st = "UpdatesOn" if updates_on else "UpdatesOff"
     it = getattr(MenuItem, st)
@@ -385,24 +412,239 @@ def info(update: Update, context: CallbackContext) -> None:
 # noinspection PyUnusedLocal
 def stop(update: Update, context: CallbackContext) -> None:
     chat_id = update.message.chat_id
-    with QEngNewsDB(DB_LOCATION) as db:
-        db.stop_user_updates(chat_id)
+    DB_EXECUTOR.run(lambda db: db.stop_user_updates(chat_id))
     msg = localize(MenuItem.BotStopped, update, context)
     update.message.reply_text(msg)
     return None
 
 
+# noinspection PyUnusedLocal
+def digest(update: Update, context: CallbackContext) -> None:
+    chat_id = update.message.chat_id
+
+    def _toggle(db: QEngNewsDB) -> bool:
+        is_digest_ = not db.get_user_digest(chat_id)
+        db.set_user_digest(chat_id, is_digest_)
+        return is_digest_
+
+    is_digest = DB_EXECUTOR.run(_toggle)
+    item = MenuItem.DigestOn if is_digest else MenuItem.DigestOff
+    msg = localize(item, update, context)
+    update.message.reply_text(msg)
+    return None
+
+
+# noinspection PyUnusedLocal
+def diff_mode(update: Update, context: CallbackContext) -> None:
+    chat_id = update.message.chat_id
+
+    def _toggle(db: QEngNewsDB) -> DiffMode:
+        current = db.get_user_diff_mode(chat_id)
+        diff_mode_ = DiffMode.Picture if current is DiffMode.Text else DiffMode.Text
+        db.set_user_diff_mode(chat_id, diff_mode_)
+        return diff_mode_
+
+    new_mode = DB_EXECUTOR.run(_toggle)
+    item = MenuItem.DiffModeText if new_mode is DiffMode.Text else MenuItem.DiffModePicture
+    msg = localize(item, update, context)
+    update.message.reply_text(msg)
+    return None
+
+
+BULK_RULE_ATTRIBUTES = {
+    "team": "team_id",
+    "player": "player_id",
+    "game": "game_id",
+    "author": "author_id",
+    "ignore": "game_ignore_id",
+}
+
+
+def _parse_bulk_rules(
+        args: typing.List[str],
+) -> typing.Tuple[typing.List[typing.Tuple[str, typing.Dict[str, int]]], typing.List[str]]:
+    """
+    "d1 team=1 game=2 d2" -> [(d1, {team_id: 1}), (d1, {game_id: 2}), (d2, {})], plus the tokens not understood
+    """
+    specs, invalid = [], []
+    domain, has_ids = None, False
+    for arg in " ".join(args).replace(",", " ").split():
+        key, sep, value = arg.partition("=")
+        if not sep:
+            if domain is not None and not has_ids:
+                specs.append((domain, {}))
+            domain, has_ids = arg, False
+            continue
+        attr = BULK_RULE_ATTRIBUTES.get(key.lower())
+        if domain is None or attr is None or not value.isdigit():
+            invalid.append(arg)
+            continue
+        specs.append((domain, {attr: int(value)}))
+        has_ids = True
+    if domain is not None and not has_ids:
+        specs.append((domain, {}))
+    return specs, invalid
+
+
+def _reply_parts(update: Update, parts: typing.List[str]) -> None:
+    for msg in pack_messages(parts, joiner="\n\n"):
+        update.message.reply_text(msg, disable_web_page_preview=True, parse_mode="HTML")
+    return None
+
+
+def subscribe(update: Update, context: CallbackContext) -> None:
+    chat_id = update.message.chat_id
+    specs, invalid = _parse_bulk_rules(context.args)
+    if not specs and not invalid:
+        msg = localize_dedent_no_newline_replacing(MenuItem.BulkSubscribeUsage, update, context)
+        update.message.reply_text(msg)
+        return None
+
+    res = DB_EXECUTOR.run(lambda db: db.add_rules_bulk(chat_id, specs))
+    if res.is_over_limit:
+        msg = localize_dedent(MenuItem.RuleLimitReached, update, context)
+        update.message.reply_text(msg)
+        return None
+
+    for domain in {rule.domain.full_url: rule.domain for rule in res.added}.values():
+        DOMAIN_WARMER.request(domain)
+
+    lang = find_user_lang(update, context)
+    parts = []
+    for item, rules in ((MenuItem.BulkRulesAdded, res.added), (MenuItem.BulkRulesExisting, res.existing)):
+        if rules:
+            rules_txt = "\n".join(rule.to_str(lang) for rule in rules)
+            parts.append(localize(item, update, context).format(rules_txt))
+    invalid += res.invalid
+    if invalid:
+        parts.append(localize(MenuItem.BulkRulesInvalid, update, context).format(html.escape(", ".join(invalid))))
+    if res.timed_out:
+        timed_out_txt = html.escape(", ".join(res.timed_out))
+        parts.append(localize(MenuItem.BulkRulesLookupTimeout, update, context).format(timed_out_txt))
+    _reply_parts(update, parts)
+    return None
+
+
+def unsubscribe(update: Update, context: CallbackContext) -> None:
+    chat_id = update.message.chat_id
+    rule_ids = [
+        arg.strip("[],")
+        for arg in context.args
+    ]
+    if not rule_ids:
+        msg = localize_dedent_no_newline_replacing(MenuItem.BulkUnsubscribeUsage, update, context)
+        update.message.reply_text(msg)
+        return None
+
+    rules = DB_EXECUTOR.run(lambda db: db.delete_rules_bulk(chat_id, rule_ids))
+    if not rules:
+        msg = localize(MenuItem.BulkRulesNoneDeleted, update, context)
+        update.message.reply_text(msg)
+        return None
+
+    lang = find_user_lang(update, context)
+    rules_txt = "\n".join(rule.to_str(lang) for rule in rules)
+    _reply_parts(update, [localize(MenuItem.BulkRulesDeleted, update, context).format(rules_txt)])
+    return None
+
+
+def search(update: Update, context: CallbackContext) -> None:
+    chat_id = update.message.chat_id
+    text = " ".join(context.args)
+    if not text.strip():
+        msg = localize_dedent_no_newline_replacing(MenuItem.SearchUsage, update, context)
+        update.message.reply_text(msg)
+        return None
+
+    hits = DB_EXECUTOR.run(lambda db: db.search_games(chat_id, text))
+    if not hits:
+        msg = localize(MenuItem.SearchNoResults, update, context).format(html.escape(text))
+        update.message.reply_text(msg, parse_mode="HTML")
+        return None
+
+    _reply_parts(update, [hit.to_str() for hit in hits])
+    return None
+
+
+AUTOCOMPLETE_KIND_ITEMS = {
+    SuggestionKind.Game: MenuItem.AutocompleteGame,
+    SuggestionKind.Team: MenuItem.AutocompleteTeam,
+    SuggestionKind.Player: MenuItem.AutocompletePlayer,
+    SuggestionKind.Author: MenuItem.AutocompleteAuthor,
+}
+
+
+def _autocomplete_result(i: int, suggestion: Suggestion, lang: Language) -> InlineQueryResultArticle:
+    kind_name = MENU_LOCALIZATION[AUTOCOMPLETE_KIND_ITEMS[suggestion.kind]][lang]
+    kind_id = f"{kind_name} {suggestion.entity_id}"
+    details = [kind_id, suggestion.domain_title, suggestion.context]
+    res = InlineQueryResultArticle(
+        id=str(i),
+        title=suggestion.name or kind_id,
+        description=" · ".join(pt for pt in details if pt),
+        # The bare ID is what the conversation waits for after a granular rule was chosen
+        input_message_content=InputTextMessageContent(str(suggestion.entity_id)),
+    )
+    return res
+
+
+def autocomplete(update: Update, context: CallbackContext) -> None:
+    """
+    Answered from AUTOCOMPLETE_INDEX alone; the language comes from chat data, or from the index too
+    """
+    query = update.inline_query
+    user_id = query.from_user.id
+    # Inline queries come without a chat; the private chat with the bot has the user's ID
+    chat_data = context.dispatcher.chat_data.get(user_id, {})
+    # The domain of the granular rule being added goes first; it may not be among the user's yet
+    domains = [chat_data[GAME_RULE_DOMAIN_KEY]] if GAME_RULE_DOMAIN_KEY in chat_data else []
+    domains += AUTOCOMPLETE_INDEX.user_domains(user_id)
+
+    if USER_LANGUAGE_KEY in chat_data:
+        lang = Language(chat_data[USER_LANGUAGE_KEY])
+    else:
+        lang = AUTOCOMPLETE_INDEX.user_language(user_id)
+
+    suggestions = AUTOCOMPLETE_INDEX.complete(query.query, domains)
+    results = [
+        _autocomplete_result(i, suggestion, lang)
+        for i, suggestion in enumerate(suggestions)
+    ]
+    query.answer(results, cache_time=AUTOCOMPLETE_CACHE_SECONDS, is_personal=True)
+    return None
+
+
+# noinspection PyUnusedLocal
+def refresh_autocomplete(context: CallbackContext) -> None:
+    DB_EXECUTOR.run(AUTOCOMPLETE_INDEX.refresh, slow=True)
+    return None
+
+
+def refresh_reminders(context: CallbackContext) -> None:
+    scheduler: ReminderScheduler = context.job.context
+    DB_EXECUTOR.run(scheduler.refresh, slow=True)
+    return None
+
+
 # noinspection PyUnusedLocal
 def status_check(update: Update, context: CallbackContext) -> None:
     chat_id = update.message.chat_id
     if chat_id != meta_constants.ADMIN_ID:
         msg = localize(MenuItem.BotStatusReportNotAllowed, update, context)
     else:
-        with QEngNewsDB(DB_LOCATION) as db:
-            res = db.count_updates()
+        res = DB_EXECUTOR.run(lambda db: db.count_updates(), slow=True)
         msg = localize(MenuItem.BotStatusReportAllowed, update, context)
         msg = msg.format(*res)
     update.message.reply_text(msg)
+
+    if chat_id == meta_constants.ADMIN_ID and QUERY_PROFILER is not None:
+        sort_key = context.args[0] if context.args else "total_time"
+        if sort_key not in REPORT_SORT_KEYS:
+            sort_key = "total_time"
+        report = QUERY_PROFILER.report(QUERY_REPORT_TOP_N, sort_key)
+        report = localize(MenuItem.QueryProfileReport, update, context).format(report)
+        for pt in split_html_safe(report):
+            update.message.reply_text(pt)
     return None
 
 
@@ -421,10 +663,15 @@ def dont_understand(update: Update, context: CallbackContext) -> None:
 
 
 DEFAULT_COMMAND_HANDLERS = [
-    CommandHandler("help", help_),
-    CommandHandler("info", info),
-    CommandHandler("stop", stop),
-    CommandHandler("status", status_check),
+    CommandHandler("help", help_, run_async=True),
+    CommandHandler("info", info, run_async=True),
+    CommandHandler("stop", stop, run_async=True),
+    CommandHandler("digest", digest, run_async=True),
+    CommandHandler("diffmode", diff_mode, run_async=True),
+    CommandHandler("subscribe", subscribe, run_async=True),
+    CommandHandler("unsubscribe", unsubscribe, run_async=True),
+    CommandHandler("search", search, run_async=True),
+    CommandHandler("status", status_check, run_async=True),
 ]
 
 h = functools.partial(
@@ -500,19 +747,22 @@ for name, pr, cdn, wdn, wid, rd in GRANULAR_RULES:
 
 
 def main():
-    updater = Updater(API_KEY, workers=4)
+    persistence = SQLitePersistence(DB_LOCATION, shared=SHARED_BOT_STATE)
+    updater = Updater(API_KEY, workers=BOT_WORKERS, persistence=persistence)
 
     conv_handler = ConversationHandler(
         entry_points=[
-            CommandHandler(MAIN_MENU_COMMAND, settings_prompt),
-            CommandHandler('start', prompt_language)
+            CommandHandler(MAIN_MENU_COMMAND, settings_prompt, run_async=True),
+            CommandHandler('start', prompt_language, run_async=True)
         ],
 
         states=STATE_TO_HANDLERS,
 
-        fallbacks=[MessageHandler(Filters.text, settings_end)],
+        fallbacks=[MessageHandler(Filters.text, settings_end, run_async=True)],
         per_chat=True,
         per_user=False,
+        name="main",
+        persistent=True,
     )
 
     updater.dispatcher.add_handler(conv_handler)
@@ -520,13 +770,28 @@ def main():
     for c in DEFAULT_COMMAND_HANDLERS:
         updater.dispatcher.add_handler(c)
 
-    updater.dispatcher.add_handler(MessageHandler(Filters.all, dont_understand))
+    updater.dispatcher.add_handler(InlineQueryHandler(autocomplete, run_async=True))
+    updater.dispatcher.add_handler(MessageHandler(Filters.all, dont_understand, run_async=True))
 
     updater.dispatcher.add_error_handler(error_handler)
 
+    updater.job_queue.run_repeating(refresh_autocomplete, AUTOCOMPLETE_REFRESH_SECONDS, first=0)
+
+    reminder_scheduler = ReminderScheduler(DB_EXECUTOR, functools.partial(send_reminder, bot=updater.bot))
+    if SEND_REMINDERS:
+        reminder_scheduler.start()
+        updater.job_queue.run_repeating(refresh_reminders, REMINDER_SYNC_SECONDS, first=0, context=reminder_scheduler)
+
+    if WEBHOOK_URL:
+        assert WEBHOOK_SECRET, "WEBHOOK_SECRET must be set in webhook mode"
+        run_webhook(updater, WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+        reminder_scheduler.stop()
+        return None
+
     updater.start_polling()
 
     updater.idle()
+    reminder_scheduler.stop()
     return None
 
 
@@ -6,16 +6,15 @@ from __future__ import annotations
 
 import enum
 import typing
-import textwrap
 
 from telegram import Update
 from telegram.ext import CommandHandler, CallbackContext, MessageHandler, Filters
 
 from translations import Language
-from meta_constants import USER_LANGUAGE_KEY, DB_LOCATION, GAME_JOINER, \
-    MAX_MESSAGE_LENGTH_TELEGRAM
-from db_api import QEngNewsDB
-from translations import MENU_LOCALIZATION, MenuItem
+from meta_constants import USER_LANGUAGE_KEY
+from message_packer import pack_messages
+from db_executor import DB_EXECUTOR
+from translations import MENU_LOCALIZATION, MenuItem, LOCALIZATION_INDEX
 
 if typing.TYPE_CHECKING:
     from entities import BaseGame
@@ -68,8 +67,7 @@ def find_user_lang(update: Update, context: CallbackContext) -> Language:
         lang = context.chat_data[USER_LANGUAGE_KEY]
         lang = Language(lang)
     else:
-        with QEngNewsDB(DB_LOCATION) as db:
-            lang = db.get_user_language(chat_id)
+        lang = DB_EXECUTOR.run(lambda db: db.get_user_language(chat_id))
         context.chat_data[USER_LANGUAGE_KEY] = lang.value
     return lang
 
@@ -81,14 +79,14 @@ def localize(item: MenuItem, update: Update, context: CallbackContext) -> str:
 
 
 def localize_dedent(item: MenuItem, update: Update, context: CallbackContext):
-    msg = localize(item, update, context)
-    msg = textwrap.dedent(msg).replace("\n", "")
+    lang = find_user_lang(update, context)
+    msg = LOCALIZATION_INDEX.dedented[item][lang]
     return msg
 
 
 def localize_dedent_no_newline_replacing(item: MenuItem, update: Update, context: CallbackContext):
-    msg = localize(item, update, context)
-    msg = textwrap.dedent(msg)
+    lang = find_user_lang(update, context)
+    msg = LOCALIZATION_INDEX.dedented_keep_newlines[item][lang]
     return msg
 
 
@@ -148,14 +146,15 @@ def h(
 ) -> typing.List[
     typing.Union[MessageHandler, CommandHandler]
 ]:
+    # Handlers run on the dispatcher's worker pool, so that a slow one doesn't hold up the others
     res = [
-        MessageHandler(Filters.text & ~Filters.command, callback=func),
+        MessageHandler(Filters.text & ~Filters.command, callback=func, run_async=True),
     ]
     if menu_func is not None:
-        res.append(CommandHandler("menu", callback=menu_func))
+        res.append(CommandHandler("menu", callback=menu_func, run_async=True))
 
     if cancel_func is not None:
-        res.append(CommandHandler("cancel", callback=cancel_func))
+        res.append(CommandHandler("cancel", callback=cancel_func, run_async=True))
 
     default_command_handlers = default_command_handlers or []
     res.extend(default_command_handlers)
@@ -163,34 +162,12 @@ def h(
     return res
 
 
-def split_game_desc(game: BaseGame, language: Language):
-    desc = game.to_str(language)
-    pts = []
-    for x in range(0, len(desc), MAX_MESSAGE_LENGTH_TELEGRAM):
-        pt = desc[x:x + MAX_MESSAGE_LENGTH_TELEGRAM]
-        pts.append(pt)
-    return pts
-
-
 def games_desc_adaptive(
         games: typing.List[BaseGame],
         language: Language,
 ) -> typing.List[str]:
-    games_chunks = []
-    games_current_chunk = []
-    for game in games:
-        pt = game.to_str(language)
-        games_current_chunk.append(pt)
-        games_current_chunk_str = GAME_JOINER.join(games_current_chunk)
-        total_length = len(games_current_chunk_str)
-        if total_length >= MAX_MESSAGE_LENGTH_TELEGRAM:
-            games_current_chunk.pop()
-            if len(games_current_chunk) == 0:
-                games_chunks.extend(split_game_desc(game, language))
-            else:
-                games_chunks.append(GAME_JOINER.join(games_current_chunk))
-            games_current_chunk = []
-
-    if games_current_chunk:
-        games_chunks.append(GAME_JOINER.join(games_current_chunk))
-    return games_chunks
+    res = list(pack_messages(
+        game.to_str(language)
+        for game in games
+    ))
+    return res
@@ -1,4 +1,11 @@
 import os
 
 API_KEY = os.environ["API_KEY"]
-SEND_ONLY_TO_ADMIN = os.environ.get("SEND_ONLY_TO_ADMIN", 'false') == 'true'
\ No newline at end of file
+SEND_ONLY_TO_ADMIN = os.environ.get("SEND_ONLY_TO_ADMIN", 'false') == 'true'
+PROFILE_QUERIES = os.environ.get("PROFILE_QUERIES", 'false') == 'true'
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+SHARED_BOT_STATE = os.environ.get("SHARED_BOT_STATE", 'false') == 'true'
+# How description changes are shown to users who never chose: "picture" or "text"
+DEFAULT_DIFF_MODE = os.environ.get("DEFAULT_DIFF_MODE", "picture")
+SEND_REMINDERS = os.environ.get("SEND_REMINDERS", 'true') == 'true'
@@ -4,24 +4,38 @@ DB API for the bot
 
 from __future__ import annotations
 
+import contextlib
 import time
-from sqlite3 import connect, Connection
+import html
+import re
+from sqlite3 import connect, Connection, Cursor
 from dataclasses import dataclass, field
 import typing
 import os
 import datetime
 from sqlite3 import IntegrityError
 
-import pandas as pd
+from lazy_imports import lazy_module
 
 from entities import Domain, BaseGame, Rule, GameFormat, Update
 from translations import Language
 from meta_constants import PERCENTAGE_CHANGE_TO_TRIGGER, MAX_DESCRIPTION_LENGTH, MAX_LAST_MESSAGE_LENGTH,\
-    InvalidDomainError, MAX_USER_RULES_ALLOWED, UPDATE_FREQUENCY_SECONDS, MIN_HOURS_GAME_CHANGE_NOTIFY
-from bot_secrets import SEND_ONLY_TO_ADMIN
+    InvalidDomainError, MAX_USER_RULES_ALLOWED, UPDATE_FREQUENCY_SECONDS, MIN_HOURS_GAME_CHANGE_NOTIFY, \
+    DomainLookupTimeoutError, SLOW_QUERY_THRESHOLD_SECONDS, SEARCH_MAX_RESULTS, SEARCH_MAX_TERMS, \
+    SEARCH_SNIPPET_WORDS, SEARCH_MIN_PREFIX_LENGTH
+from bot_secrets import SEND_ONLY_TO_ADMIN, PROFILE_QUERIES, DEFAULT_DIFF_MODE
+from description_diff import DiffMode
+from dns_cache import DNS_CACHE
+from metrics import timed, METRICS
+from query_profiler import QueryProfiler
+from user_cache import USER_PROFILE_CACHE
+from storage import UserStore, UserPreferences, SQLiteUserStore
+
+pd = lazy_module("pandas")
 
 __all__ = [
-    "QEngNewsDB",
+    "QEngNewsDB", "BulkRulesResult", "SearchHit",
+    "QUERY_PROFILER",
 ]
 
 ADMIN_ID = 476001386
@@ -30,17 +44,201 @@ TIME_TO_SECONDS_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 N_SIGMA = 1
 
+T = typing.TypeVar("T")
+
+# For users who never chose how to see description changes
+DEFAULT_USER_DIFF_MODE = DiffMode(DEFAULT_DIFF_MODE)
+
+GAMES_FETCHED = METRICS.counter("qeng_games_fetched_total", "Games fetched from domains")
+
+QUERY_PROFILER = QueryProfiler(SLOW_QUERY_THRESHOLD_SECONDS) if PROFILE_QUERIES else None
+
+SEARCH_TERM = re.compile(r"\w+")
+# Around matched words in search snippets; replaced with tags once the snippet is escaped
+SNIPPET_OPEN, SNIPPET_CLOSE = "\x02", "\x03"
+
+# Databases whose schema has already been brought up to date by this process
+MIGRATED_DB_LOCATIONS: typing.Set[str] = set()
+
+
+@dataclass
+class BulkRulesResult:
+    added: typing.List[Rule] = field(default_factory=list)
+    existing: typing.List[Rule] = field(default_factory=list)
+    invalid: typing.List[str] = field(default_factory=list)
+    # Domains whose host wasn't resolved in time; they may well be valid
+    timed_out: typing.List[str] = field(default_factory=list)
+    is_over_limit: bool = False
+
+
+@dataclass
+class SearchHit:
+    domain: Domain
+    game_id: int
+    name: str
+    start_time: str
+    # Telegram HTML, matched words in bold
+    snippet: str
+
+    def to_str(self) -> str:
+        game_cls = self.domain.upper_level_domain.game_class
+        # noinspection PyProtectedMember
+        url = game_cls._game_details_full_url(self.domain, self.game_id)
+        pts = [
+            f"<b>{html.escape(self.name)}</b> (id <a href='{url}' target='_blank'>{self.game_id}</a>, "
+            f"{self.domain.pretty_name}, {self.start_time})",
+            self.snippet,
+        ]
+        res = "\n".join(pt for pt in pts if pt)
+        return res
+
 
 @dataclass
 class QEngNewsDB:
     db_location: str
-    _db_conn: Connection = field(init=False, default=None)
+    _conn: typing.Optional[Connection] = field(init=False, default=None)
+    # Where user preferences and rules live; the bot DB itself unless given
+    store: typing.Optional[UserStore] = field(default=None, repr=False)
 
     def __post_init__(self):
-        db_exists = os.path.exists(self.db_location)
-        self._db_conn = connect(self.db_location)
-        if not db_exists:
-            self.create_tables()
+        if self.store is None:
+            self.store = SQLiteUserStore(self)
+
+    @property
+    def _db_conn(self) -> Connection:
+        # Connected lazily, so that requests served from the user cache don't touch the DB at all
+        if self._conn is None:
+            db_exists = os.path.exists(self.db_location)
+            self._conn = connect(self.db_location)
+            if not db_exists:
+                self.create_tables()
+            if self.db_location not in MIGRATED_DB_LOCATIONS:
+                self.migrate()
+                MIGRATED_DB_LOCATIONS.add(self.db_location)
+            # Host lookups are cached in the DB in use, which now has the table for them
+            DNS_CACHE.bind(self.db_location)
+        return self._conn
+
+    def migrate(self) -> None:
+        """
+        Creates the tables added after the initial schema, so that existing databases pick them up
+        """
+        self.query("""
+                CREATE TABLE IF NOT EXISTS USER_DIGEST
+                (
+                USER_ID int,
+                IS_DIGEST int,
+                PRIMARY KEY (USER_ID)
+                )
+                """, raise_on_error=False)
+
+        self.query("""
+                CREATE TABLE IF NOT EXISTS BOT_CONVERSATION
+                (
+                NAME varchar(100),
+                CONV_KEY varchar(100),
+                STATE int,
+                PRIMARY KEY (NAME, CONV_KEY)
+                )
+                """, raise_on_error=False)
+
+        self.query("""
+                CREATE TABLE IF NOT EXISTS BOT_CHAT_DATA
+                (
+                CHAT_ID int,
+                DATA text,
+                PRIMARY KEY (CHAT_ID)
+                )
+                """, raise_on_error=False)
+
+        self.query("""
+                CREATE TABLE IF NOT EXISTS JOB_QUEUE
+                (
+                JOB_ID INTEGER PRIMARY KEY AUTOINCREMENT,
+                KIND varchar(20),
+                DEDUP_KEY varchar(200),
+                PAYLOAD text,
+                STATUS varchar(10),
+                ATTEMPTS int,
+                GENERATION int,
+                LEASE_TOKEN varchar(32),
+                LEASE_UNTIL float,
+                AVAILABLE_AT float,
+                UPDATED_AT float,
+                LAST_ERROR text,
+                UNIQUE (DEDUP_KEY)
+                )
+                """, raise_on_error=False)
+
+        self.query("""
+                CREATE INDEX IF NOT EXISTS JOB_QUEUE_KIND_STATUS
+                ON JOB_QUEUE (KIND, STATUS, AVAILABLE_AT)
+                """, raise_on_error=False)
+
+        self.query("""
+                CREATE TABLE IF NOT EXISTS DOMAIN_WARMUP
+                (
+                DOMAIN varchar(100),
+                REQUESTED_AT TIMESTAMP_NTZ,
+                PRIMARY KEY (DOMAIN)
+                )
+                """, raise_on_error=False)
+
+        self.query("""
+                CREATE TABLE IF NOT EXISTS USER_DIFF_MODE
+                (
+                USER_ID int,
+                DIFF_MODE varchar(10),
+                PRIMARY KEY (USER_ID)
+                )
+                """, raise_on_error=False)
+
+        # Full-text index of game names and descriptions. FTS rowids are DOC_IDs, which stay put
+        # while DOMAIN_GAMES rows are deleted and inserted again on every merge
+        self.query("""
+                CREATE TABLE IF NOT EXISTS GAME_SEARCH_DOCS
+                (
+                DOC_ID INTEGER PRIMARY KEY AUTOINCREMENT,
+                DOMAIN varchar(100),
+                GAME_ID int,
+                UNIQUE (DOMAIN, GAME_ID)
+                )
+                """, raise_on_error=False)
+
+        # DOMAIN_KEY is the domain as a single token, so that limiting a search to some domains
+        # is an intersection of doclists inside the index, instead of a lookup per match
+        self.query("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS GAMES_FTS
+                USING fts5(
+                NAME, DESCRIPTION, DOMAIN_KEY,
+                tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+                )
+                """, raise_on_error=False)
+
+        # Reminders already sent, per start time, so that a game moved later is reminded of again
+        self.query("""
+                CREATE TABLE IF NOT EXISTS REMINDER_STATUS
+                (
+                USER_ID int,
+                DOMAIN varchar(100),
+                GAME_ID int,
+                START_TIME TIMESTAMP_NTZ,
+                SENT_AT TIMESTAMP_NTZ,
+                PRIMARY KEY (USER_ID, DOMAIN, GAME_ID, START_TIME)
+                )
+                """, raise_on_error=False)
+
+        self.query("""
+                CREATE TABLE IF NOT EXISTS DNS_CACHE
+                (
+                HOST varchar(100),
+                IPS text,
+                EXPIRES_AT float,
+                PRIMARY KEY (HOST)
+                )
+                """, raise_on_error=False)
+
+        return None
 
     def create_tables(self) -> None:
         self.query("""
@@ -225,6 +423,82 @@ class QEngNewsDB:
             params: typing.Iterable[typing.Any] = None,
             safe: bool = False,
             raise_on_error: bool = True
+    ) -> typing.Optional[pd.DataFrame]:
+        if QUERY_PROFILER is not None:
+            return self._profiled_query(query_text, params, safe, raise_on_error)
+        return self._query(query_text, params, safe, raise_on_error)
+
+    def _profiled_query(
+            self,
+            query_text: str,
+            params: typing.Iterable[typing.Any],
+            safe: bool,
+            raise_on_error: bool,
+    ) -> typing.Optional[pd.DataFrame]:
+        return self._profiled(lambda: self._query(query_text, params, safe, raise_on_error), query_text, params)
+
+    def _profiled(self, run: typing.Callable[[], T], query_text: str, params: typing.Any) -> T:
+        start = time.perf_counter()
+        res = None
+        try:
+            res = run()
+        finally:
+            duration = time.perf_counter() - start
+            # Checked for a list first, so that profiling plain rows doesn't import pandas
+            is_rows = isinstance(res, list) or isinstance(res, pd.DataFrame)
+            n_rows = len(res) if is_rows else getattr(res, "rowcount", 0)
+            stats = QUERY_PROFILER.record(query_text, params, duration, n_rows)
+            if QUERY_PROFILER.is_slow(duration) and QUERY_PROFILER.needs_plan(stats):
+                stats.plan = self.explain_query_plan(query_text, params)
+        return res
+
+    def query_rows(self, query_text: str, params: typing.Any = None) -> typing.List[typing.Tuple]:
+        """
+        Like query, but returns plain tuples, for the queries that don't need a DataFrame
+        """
+        if QUERY_PROFILER is None:
+            return self._db_conn.execute(query_text, params or ()).fetchall()
+        return self._profiled(lambda: self._db_conn.execute(query_text, params or ()).fetchall(), query_text, params)
+
+    def execute_many(self, query_text: str, seq_of_params: typing.Iterable[typing.Any]) -> Cursor:
+        """
+        Runs a write statement once per parameter set, like sqlite3's executemany, through the query profiler
+        """
+        seq_of_params = list(seq_of_params)
+        if QUERY_PROFILER is None or not seq_of_params:
+            return self._db_conn.executemany(query_text, seq_of_params)
+        # Profiled as one call, under the shape of a single parameter set, whatever the batch size
+        return self._profiled(
+            lambda: self._db_conn.executemany(query_text, seq_of_params), query_text, seq_of_params[0],
+        )
+
+    @contextlib.contextmanager
+    def transaction(self) -> typing.Iterator[None]:
+        """
+        Commits the statements run within it together, or rolls all of them back
+        """
+        with self._db_conn:
+            yield
+        return None
+
+    def explain_query_plan(self, query_text: str, params: typing.Iterable[typing.Any] = None) -> str:
+        # noinspection PyBroadException
+        try:
+            rows = self._db_conn.execute(f"EXPLAIN QUERY PLAN {query_text}", params or ()).fetchall()
+        except Exception as e:
+            return f"<unavailable: {e}>"
+        res = "\n".join(
+            str(row[-1])
+            for row in rows
+        )
+        return res
+
+    def _query(
+            self,
+            query_text: str,
+            params: typing.Iterable[typing.Any],
+            safe: bool,
+            raise_on_error: bool,
     ) -> typing.Optional[pd.DataFrame]:
         try:
             if not safe:
@@ -241,29 +515,15 @@ class QEngNewsDB:
         return res
 
     def add_rule(self, tg_id: int, rule: Rule) -> bool:
-        df = pd.DataFrame([rule.to_json()])
-        # res = "Rule added"
-        try:
-            df.to_sql("RULE_DESCRIPTION", self._db_conn, if_exists="append", index=False)
-        except IntegrityError:
-            pass
-            # res = "Rule already exists"
-
-        df = pd.DataFrame([{
-            "USER_ID": tg_id,
-            "RULE_ID": rule.rule_id,
-            "RULE_ADDED_DATE": datetime.datetime.utcnow(),
-        }])
-        res = True
-        try:
-            df.to_sql("USER_SUBSCRIPTION", self._db_conn, if_exists="append", index=False)
-        except IntegrityError:
-            res = False
+        res = self.store.add_rule(tg_id, rule)
+        USER_PROFILE_CACHE.invalidate(tg_id, "n_rules", "domains")
         return res
 
     def add_domain_to_user_outer(self, tg_id: int, domain: str) -> typing.Tuple[bool, Rule]:
         try:
             domain_inst = Domain.from_url(domain)
+        except DomainLookupTimeoutError:
+            raise
         except Exception:
             raise InvalidDomainError(domain)
         self.track_domain_outer(domain)
@@ -274,6 +534,8 @@ class QEngNewsDB:
     def add_mixed_rule_outer(self, tg_id: int, domain: str, **kwargs) -> typing.Tuple[bool, Rule]:
         try:
             domain_inst = Domain.from_url(domain)
+        except DomainLookupTimeoutError:
+            raise
         except Exception:
             raise InvalidDomainError(domain)
         self.track_domain_outer(domain)
@@ -281,89 +543,127 @@ class QEngNewsDB:
         succ = self.add_rule(tg_id, rule)
         return succ, rule
 
-    def is_domain_tracked(self, domain: Domain) -> bool:
-        domain_normalized_url = domain.full_url
-        res = self.query(
-            """
-            SELECT DOMAIN
-            FROM DOMAIN_QUERY_STATUS
-            WHERE 1=1
-            AND DOMAIN = :domain
-            """,
-            {"domain": domain_normalized_url}
-        )
+    def add_rules_bulk(
+            self,
+            tg_id: int,
+            rule_specs: typing.List[typing.Tuple[str, typing.Dict[str, int]]],
+    ) -> BulkRulesResult:
+        """
+        Subscribes the user to many rules, given as (domain, rule attributes) pairs, in one transaction.
+        Invalid domains are reported back, and nothing is added if the rules don't fit into the user's limit.
+        New domains are registered for a warm-up, instead of being fetched right away
+        """
+        res = BulkRulesResult()
+        rules = {}
+        for domain, kwargs in rule_specs:
+            try:
+                domain_inst = Domain.from_url(domain)
+            except DomainLookupTimeoutError:
+                res.timed_out.append(domain)
+                continue
+            except Exception:
+                res.invalid.append(domain)
+                continue
+            rule = Rule(domain=domain_inst, **kwargs)
+            rules.setdefault(rule.rule_id, rule)
+
+        existing_ids = {rule.rule_id for rule in self.store.get_rules(tg_id)}
+        res.existing = [rule for rule_id, rule in rules.items() if rule_id in existing_ids]
+        new_rules = [rule for rule_id, rule in rules.items() if rule_id not in existing_ids]
+        if not self._fits_rule_limit(len(existing_ids) + len(new_rules)):
+            res.is_over_limit = True
+            return res
+
+        for domain_url in {rule.domain.full_url for rule in new_rules}:
+            self.store.track_domain(domain_url, needs_warmup=True)
+        added = self.store.add_rules(tg_id, new_rules)
+        res.added = [rule for rule, is_added in zip(new_rules, added) if is_added]
+        USER_PROFILE_CACHE.invalidate(tg_id, "n_rules", "domains")
+        return res
 
-        if res is None or res.empty:
-            return False
+    def delete_rules_bulk(self, tg_id: int, rule_ids: typing.List[str]) -> typing.List[Rule]:
+        """
+        Unsubscribes the user from the rules they have among the given ones, in one transaction
+        """
+        rule_ids = set(rule_ids)
+        rules = [
+            rule
+            for rule in self.store.get_rules(tg_id)
+            if rule.rule_id in rule_ids
+        ]
+        self.store.delete_rules(tg_id, [rule.rule_id for rule in rules])
+        USER_PROFILE_CACHE.invalidate(tg_id, "n_rules", "domains")
+        if rules:
+            self.prune_rule_descriptions()
+            self.prune_domain_query_status()
+        return rules
 
+    def warm_up_domain(self, domain: Domain) -> bool:
+        """
+        Loads the games of a newly tracked domain in bulk, without notifying anyone about them,
+        and lets the poller take it from there. Returns False if the domain needed no warm-up
+        """
+        if domain.full_url not in self.store.get_domains_to_warm_up():
+            return False
+        with timed("domain_warmup"):
+            games = domain.get_games()
+        GAMES_FETCHED.inc(len(games), domain=domain.full_url)
+        self.query("DELETE FROM DOMAIN_GAMES WHERE DOMAIN = ?", (domain.full_url,), safe=True)
+        self.games_to_db(games)
+        self.update_search_index([domain.full_url])
+        self.store.mark_domain_warmed_up(domain.full_url)
+        self.commit()
         return True
 
-    def track_domain(self, domain: Domain) -> bool:
-        domain_normalized_url = domain.full_url
-        row = pd.DataFrame([{
-            "DOMAIN": domain_normalized_url,
-            "LAST_QUERY_TIME": datetime.datetime.utcnow().replace(microsecond=0),
-        }])
-        res = True
-        try:
-            row.to_sql("DOMAIN_QUERY_STATUS", self._db_conn, if_exists="append", index=False)
-        except IntegrityError:
-            res = False
+    def warm_up_domains(self) -> typing.List[Domain]:
+        """
+        Warms up every pending domain. A domain that fails is left pending for the next run,
+        without holding up the other ones
+        """
+        res = []
+        for domain_url in self.store.get_domains_to_warm_up():
+            # noinspection PyBroadException
+            try:
+                domain = Domain.from_url(domain_url)
+                if self.warm_up_domain(domain):
+                    res.append(domain)
+            except Exception as e:
+                self.rollback()
+                print("ERROR", f"warm-up of {domain_url} failed", repr(e), sep="\n")
+        return res
 
-        games = domain.get_games()
-        for game in games:
-            self.game_to_db(game)
+    def is_domain_tracked(self, domain: Domain) -> bool:
+        return self.store.is_domain_tracked(domain.full_url)
 
-        return res
+    def track_domain(self, domain: Domain) -> bool:
+        """
+        Registers the domain only; its games are loaded by a warm-up, see warm_up_domain
+        """
+        return self.store.track_domain(domain.full_url, needs_warmup=True)
 
-    def track_domain_outer(self, domain: str) -> None:
+    def track_domain_outer(self, domain: str) -> Domain:
         try:
             domain = Domain.from_url(domain)
+        except DomainLookupTimeoutError:
+            raise
         except Exception:
             raise InvalidDomainError(domain)
         is_tracked = self.is_domain_tracked(domain)
         if not is_tracked:
             self.track_domain(domain)
-        return None
+        return domain
 
     def get_user_domains(self, tg_id: int) -> typing.List[str]:
-        res = self.query(
-            """
-            SELECT 
-            DOMAIN
-            FROM USER_SUBSCRIPTION as us
-            INNER JOIN RULE_DESCRIPTION as rd
-            ON (us.RULE_ID = rd.RULE_ID)
-            WHERE USER_ID = :tg_id
-            GROUP BY 1
-            """,
-            {"tg_id": tg_id}
-        )
-
-        domains = res["DOMAIN"].tolist()
+        cached = USER_PROFILE_CACHE.get(tg_id, "domains")
+        if cached is not None:
+            return list(cached)
+        domains = self.store.get_domains(tg_id)
+        USER_PROFILE_CACHE.set(tg_id, domains=tuple(domains))
 
         return domains
 
     def get_user_rules(self, tg_id: int) -> typing.List[Rule]:
-        res = self.query(
-            """
-            SELECT 
-            rd.*
-            FROM USER_SUBSCRIPTION as us
-            INNER JOIN RULE_DESCRIPTION as rd
-            ON (us.RULE_ID = rd.RULE_ID)
-            WHERE USER_ID = :tg_id
-            ORDER BY us.RULE_ADDED_DATE
-            """,
-            {"tg_id": tg_id}
-        )
-        rules = []
-        for _, row in res.iterrows():
-            # noinspection PyTypeChecker
-            rule = Rule.from_json(row.to_dict())
-            rules.append(rule)
-
-        return rules
+        return self.store.get_rules(tg_id)
 
     def game_to_db(
             self,
@@ -423,27 +723,20 @@ class QEngNewsDB:
         return games
 
     def set_user_language(self, tg_id: int, language: Language) -> None:
-        row = pd.DataFrame([
-            {"USER_ID": tg_id, "LANGUAGE": language.value},
-        ])
-
-        try:
-            row.to_sql("USER_LANGUAGE", self._db_conn, if_exists="append", index=False)
-        except IntegrityError:
-            query = "UPDATE USER_LANGUAGE SET LANGUAGE = :language WHERE USER_ID = :user_id"
-            res = self.query(query, {"user_id": tg_id, "language": language.value}, raise_on_error=False)
-            assert res is None, res["Exception_text"].iloc[0]
+        self.store.set_language(tg_id, language)
+        USER_PROFILE_CACHE.set(tg_id, language=language)
         return None
 
     def get_user_language(self, tg_id: int) -> Language:
-        query = "SELECT LANGUAGE FROM USER_LANGUAGE WHERE USER_ID = :user_id"
-        res = self.query(query, {"user_id": tg_id})
-        if res.empty:
+        cached = USER_PROFILE_CACHE.get(tg_id, "language")
+        if cached is not None:
+            return cached
+        lang = self.store.get_language(tg_id)
+        if lang is None:
             lang = Language.English
             self.set_user_language(tg_id, lang)
         else:
-            lang = res["LANGUAGE"].iloc[0]
-            lang = Language(lang)
+            USER_PROFILE_CACHE.set(tg_id, language=lang)
 
         return lang
 
@@ -464,17 +757,24 @@ class QEngNewsDB:
         ]
         return games
 
-    def get_all_user_games(self, tg_id: int, n_days_in_future: int = None) -> typing.List[BaseGame]:
+    @staticmethod
+    def _matched_games_query(users_condition: str, games_condition: str) -> str:
+        """
+        CTEs ending in games_matched_not_ignored: the games matched by the rules of the users minus the games
+        they ignore, one row per user and game. Conditions are on USER_SUBSCRIPTION and DOMAIN_GAMES, by alias
+        """
         query = f"""
         with user_rules as (
             SELECT
-            RULE_ID
-            FROM USER_SUBSCRIPTION
+            us.USER_ID,
+            us.RULE_ID
+            FROM USER_SUBSCRIPTION as us
             WHERE 1=1
-            AND USER_ID = :user_id
+            AND {users_condition}
         ),
         rules_desc as (
             SELECT 
+            ur.USER_ID,
             rd.*
             FROM user_rules as ur
             INNER JOIN RULE_DESCRIPTION_V as rd
@@ -483,7 +783,8 @@ class QEngNewsDB:
         games_matched as (
             SELECT 
             dg.*,
-            ROW_NUMBER() OVER (PARTITION BY dg.DOMAIN, dg.ID ORDER BY RANDOM()) as rn
+            rd.USER_ID,
+            ROW_NUMBER() OVER (PARTITION BY rd.USER_ID, dg.DOMAIN, dg.ID ORDER BY RANDOM()) as rn
             FROM rules_desc as rd
             INNER JOIN DOMAIN_GAMES as dg
             ON 
@@ -514,6 +815,8 @@ class QEngNewsDB:
                     )
                 )
             )
+            WHERE 1=1
+            AND {games_condition}
         ),
         user_ignore_rules as (
             SELECT 
@@ -529,18 +832,25 @@ class QEngNewsDB:
             LEFT JOIN user_ignore_rules as gi
             ON (
                 1=1
+                AND gm.USER_ID = gi.USER_ID
                 AND gm.DOMAIN = gi.DOMAIN
                 AND gm.ID = gi.GAME_IGNORE_ID
             )
             WHERE 1=1
             AND gi.DOMAIN IS NULL
+            AND gm.rn = 1
         )
+        """
+        return query
+
+    def get_all_user_games(self, tg_id: int, n_days_in_future: int = None) -> typing.List[BaseGame]:
+        query = self._matched_games_query(
+            "us.USER_ID = :user_id",
+            "dg.START_TIME <= :end_date AND dg.START_TIME >= :start_date",
+        )
+        query += """
         SELECT *
         FROM games_matched_not_ignored
-        WHERE 1=1
-        AND rn = 1
-        AND START_TIME <= :end_date
-        AND START_TIME >= :start_date
         ORDER BY START_TIME
         """
         now_ = datetime.datetime.utcnow()
@@ -563,20 +873,164 @@ class QEngNewsDB:
         ]
         return games
 
+    def upcoming_reminders(
+            self,
+            start_date: datetime.datetime,
+            end_date: datetime.datetime,
+            domains: typing.Optional[typing.List[str]] = None,
+    ) -> typing.List[typing.Tuple]:
+        """
+        (USER_ID, DOMAIN, ID, NAME, START_TIME, LANGUAGE) of the games starting within the dates, for everyone
+        subscribed to them, as in get_all_user_games. Stopped users and reminders already sent are left out
+        """
+        games_condition = "dg.START_TIME > :start_date AND dg.START_TIME <= :end_date"
+        params = {
+            "start_date": start_date.strftime(TIME_TO_SECONDS_FORMAT),
+            "end_date": end_date.strftime(TIME_TO_SECONDS_FORMAT),
+        }
+        if domains is not None:
+            domain_params = {f"domain_{i}": domain for i, domain in enumerate(domains)}
+            games_condition += f" AND dg.DOMAIN IN ({', '.join(f':{k}' for k in domain_params) or 'NULL'})"
+            params.update(domain_params)
+        query = self._matched_games_query("1=1", games_condition)
+        query += f"""
+        SELECT
+        g.USER_ID, g.DOMAIN, g.ID, g.NAME, g.START_TIME,
+        IFNULL(ul.LANGUAGE, {Language.English.value}) as LANGUAGE
+        FROM games_matched_not_ignored as g
+        LEFT JOIN USER_LANGUAGE as ul
+        ON (ul.USER_ID = g.USER_ID)
+        LEFT JOIN USER_STOP as st
+        ON (st.USER_ID = g.USER_ID)
+        LEFT JOIN REMINDER_STATUS as rs
+        ON (
+            1=1
+            AND rs.USER_ID = g.USER_ID
+            AND rs.DOMAIN = g.DOMAIN
+            AND rs.GAME_ID = g.ID
+            AND rs.START_TIME = g.START_TIME
+        )
+        WHERE 1=1
+        AND IFNULL(st.IS_STOPPED, 0) = 0
+        AND rs.USER_ID IS NULL
+        """
+        rows = self.query_rows(query, params)
+        return rows
+
+    def get_rules_version(self) -> str:
+        """
+        Changes whenever a rule is added or deleted, or a user stops or resumes updates
+        """
+        query = """
+        SELECT
+        (SELECT COUNT(*) || '.' || TOTAL(USER_ID) || '.' || IFNULL(MAX(RULE_ADDED_DATE), '') FROM USER_SUBSCRIPTION)
+        || '.' ||
+        (SELECT COUNT(*) || '.' || TOTAL(USER_ID) FROM USER_STOP WHERE IS_STOPPED = 1)
+        """
+        res = self.query_rows(query)[0][0]
+        return res
+
+    def claim_reminder(self, user_id: int, domain: str, game_id: int, start_time: datetime.datetime) -> bool:
+        """
+        Marks the reminder as sent; False if it already was, by this process or another one,
+        or if the user has stopped updates since
+        """
+        query = """
+        INSERT INTO REMINDER_STATUS (USER_ID, DOMAIN, GAME_ID, START_TIME, SENT_AT)
+        SELECT :user_id, :domain, :game_id, :start_time, CURRENT_TIMESTAMP
+        WHERE NOT EXISTS (SELECT 1 FROM USER_STOP WHERE USER_ID = :user_id AND IS_STOPPED = 1)
+        ON CONFLICT (USER_ID, DOMAIN, GAME_ID, START_TIME) DO NOTHING
+        """
+        params = {
+            "user_id": user_id, "domain": domain, "game_id": game_id,
+            "start_time": start_time.strftime(TIME_TO_SECONDS_FORMAT),
+        }
+        cur = self.query(query, params, safe=True)
+        self.commit()
+        return cur.rowcount == 1
+
+    def release_reminder(self, user_id: int, domain: str, game_id: int, start_time: datetime.datetime) -> None:
+        """
+        Takes back the claim of a reminder that failed to send, so that it can be claimed again
+        """
+        query = """
+        DELETE FROM REMINDER_STATUS
+        WHERE 1=1
+        AND USER_ID = :user_id
+        AND DOMAIN = :domain
+        AND GAME_ID = :game_id
+        AND START_TIME = :start_time
+        """
+        params = {
+            "user_id": user_id, "domain": domain, "game_id": game_id,
+            "start_time": start_time.strftime(TIME_TO_SECONDS_FORMAT),
+        }
+        self.query(query, params, safe=True)
+        self.commit()
+        return None
+
+    def prune_reminder_status(self, before: datetime.datetime) -> None:
+        self.query(
+            "DELETE FROM REMINDER_STATUS WHERE START_TIME < ?",
+            (before.strftime(TIME_TO_SECONDS_FORMAT),),
+            safe=True,
+        )
+        self.commit()
+        return None
+
     def stop_user_updates(self, tg_id: int) -> None:
-        df = pd.DataFrame([{"USER_ID": tg_id, "IS_STOPPED": 1}])
-        try:
-            df.to_sql("USER_STOP", self._db_conn, if_exists="append", index=False)
-        except IntegrityError:
-            upd_query = """
-            UPDATE USER_STOP
-            SET IS_STOPPED = 1
-            WHERE 1=1
-            AND USER_ID = :tg_id
-            """
-            self.query(upd_query, {"tg_id": tg_id}, raise_on_error=False)
+        self.store.set_stopped(tg_id, True)
+        USER_PROFILE_CACHE.set(tg_id, updates_on=False)
+        return None
+
+    def set_user_preferences(self, prefs: typing.Iterable[UserPreferences]) -> None:
+        """
+        Applies preference changes of many users in one transaction
+        """
+        prefs = list(prefs)
+        self.store.set_preferences(prefs)
+        for p in prefs:
+            if p.language is not None:
+                USER_PROFILE_CACHE.set(p.tg_id, language=p.language)
+            if p.is_stopped is not None:
+                USER_PROFILE_CACHE.set(p.tg_id, updates_on=not p.is_stopped)
+            if p.is_digest is not None:
+                USER_PROFILE_CACHE.set(p.tg_id, is_digest=p.is_digest)
+            if p.diff_mode is not None:
+                USER_PROFILE_CACHE.set(p.tg_id, diff_mode=p.diff_mode)
+        return None
+
+    def set_user_digest(self, tg_id: int, is_digest: bool) -> None:
+        self.store.set_digest(tg_id, is_digest)
+        USER_PROFILE_CACHE.set(tg_id, is_digest=is_digest)
+        return None
+
+    def get_user_digest(self, tg_id: int) -> bool:
+        cached = USER_PROFILE_CACHE.get(tg_id, "is_digest")
+        if cached is not None:
+            return cached
+        is_digest = self.store.get_digest(tg_id)
+        USER_PROFILE_CACHE.set(tg_id, is_digest=is_digest)
+
+        return is_digest
+
+    def set_user_diff_mode(self, tg_id: int, diff_mode: DiffMode) -> None:
+        self.store.set_diff_mode(tg_id, diff_mode)
+        USER_PROFILE_CACHE.set(tg_id, diff_mode=diff_mode)
         return None
 
+    def get_user_diff_mode(self, tg_id: int) -> DiffMode:
+        """
+        The user's own choice, or the global default if they never made one
+        """
+        cached = USER_PROFILE_CACHE.get(tg_id, "diff_mode")
+        if cached is not None:
+            return cached
+        diff_mode = self.store.get_diff_mode(tg_id) or DEFAULT_USER_DIFF_MODE
+        USER_PROFILE_CACHE.set(tg_id, diff_mode=diff_mode)
+
+        return diff_mode
+
     def count_updates(self) -> typing.Tuple[int, int]:
         cnt_query = """
             SELECT 
@@ -593,26 +1047,16 @@ class QEngNewsDB:
         return res
 
     def start_user_updates(self, tg_id: int) -> None:
-        upd_query = """
-            DELETE FROM USER_STOP
-            WHERE 1=1
-            AND USER_ID = :tg_id
-        """
-        self.query(upd_query, {"tg_id": tg_id}, raise_on_error=False)
+        self.store.set_stopped(tg_id, False)
+        USER_PROFILE_CACHE.set(tg_id, updates_on=True)
         return None
 
     def get_updates_on_off(self, tg_id: int) -> bool:
-        query = """
-            SELECT IS_STOPPED
-            FROM USER_STOP
-            WHERE 1=1
-            AND USER_ID = :tg_id
-        """
-        res = self.query(query, {"tg_id": tg_id})
-        if res.empty:
-            updates_on = True
-        else:
-            updates_on = not res.iloc[0]["IS_STOPPED"]
+        cached = USER_PROFILE_CACHE.get(tg_id, "updates_on")
+        if cached is not None:
+            return cached
+        updates_on = not self.store.is_stopped(tg_id)
+        USER_PROFILE_CACHE.set(tg_id, updates_on=updates_on)
 
         return updates_on
 
@@ -637,11 +1081,203 @@ class QEngNewsDB:
         self.games_to_db(games, "DOMAIN_GAMES_TEMP", "replace")
         return None
 
+    def game_rows_to_temp_table(
+            self,
+            rows: typing.List[typing.Dict[str, typing.Any]],
+    ) -> None:
+        """
+        Same as games_to_temp_table, for games already serialized with BaseGame.to_json
+        """
+        df = pd.DataFrame(rows)
+        if not df.empty:
+            df.to_sql("DOMAIN_GAMES_TEMP", self._db_conn, if_exists="replace", index=False)
+        return None
+
     def commit_update(self) -> None:
+        domains = self.query("SELECT DISTINCT DOMAIN FROM DOMAIN_GAMES_TEMP", raise_on_error=False)
         self.merge_into_truth_db()
+        if domains is not None and "DOMAIN" in domains.columns:
+            with timed("search_index"):
+                self.update_search_index(domains["DOMAIN"].tolist())
         self.set_update_time()
         return None
 
+    def update_search_index(self, domains: typing.List[str]) -> None:
+        """
+        Brings the search index of the domains in line with DOMAIN_GAMES. Only games that are new, gone,
+        or whose name or description changed are written, so a poll that changed nothing costs a few reads.
+        A domain indexed before the index existed is picked up in full on its first poll
+        """
+        stale_query = """
+        SELECT d.DOC_ID
+        FROM GAME_SEARCH_DOCS as d
+        LEFT JOIN DOMAIN_GAMES as g
+        ON (g.DOMAIN = d.DOMAIN AND g.ID = d.GAME_ID)
+        LEFT JOIN GAMES_FTS as f
+        ON (f.rowid = d.DOC_ID)
+        WHERE 1=1
+        AND d.DOMAIN = :domain
+        AND (
+            1=0
+            OR g.ID IS NULL
+            OR f.rowid IS NULL
+            OR g.NAME IS NOT f.NAME
+            OR IFNULL(g.DESCRIPTION_TRUNCATED, '') IS NOT f.DESCRIPTION
+        )
+        """
+        new_docs_query = """
+        INSERT INTO GAME_SEARCH_DOCS (DOMAIN, GAME_ID)
+        SELECT g.DOMAIN, g.ID
+        FROM DOMAIN_GAMES as g
+        LEFT JOIN GAME_SEARCH_DOCS as d
+        ON (g.DOMAIN = d.DOMAIN AND g.ID = d.GAME_ID)
+        WHERE 1=1
+        AND g.DOMAIN = :domain
+        AND d.DOC_ID IS NULL
+        """
+        index_query = """
+        INSERT INTO GAMES_FTS (rowid, NAME, DESCRIPTION, DOMAIN_KEY)
+        SELECT d.DOC_ID, g.NAME, IFNULL(g.DESCRIPTION_TRUNCATED, ''), lower(hex(g.DOMAIN))
+        FROM GAME_SEARCH_DOCS as d
+        INNER JOIN DOMAIN_GAMES as g
+        ON (g.DOMAIN = d.DOMAIN AND g.ID = d.GAME_ID)
+        LEFT JOIN GAMES_FTS as f
+        ON (f.rowid = d.DOC_ID)
+        WHERE 1=1
+        AND d.DOMAIN = :domain
+        AND f.rowid IS NULL
+        """
+        for domain in domains:
+            params = {"domain": domain}
+            stale = self.query_rows(stale_query, params)
+            self.execute_many("DELETE FROM GAMES_FTS WHERE rowid = ?", stale)
+            self.execute_many("DELETE FROM GAME_SEARCH_DOCS WHERE DOC_ID = ?", stale)
+            self.query(new_docs_query, params, safe=True)
+            self.query(index_query, params, safe=True)
+        return None
+
+    def search_games(
+            self, tg_id: int, text: str, limit: int = SEARCH_MAX_RESULTS,
+    ) -> typing.List[SearchHit]:
+        """
+        Best matches for the text among the games of the user's domains. Every word of the text
+        has to be found; the last one, which may still be being typed, as a word or the beginning of one.
+        The words are looked up as they are first, and the prefix, which FTS5 expands into every word
+        of the index starting with it, only if that found too few games.
+        At 200k games (benchmarks/bench_search.py) searches take under 5 ms, except that expansion:
+        a prefix of a hundred words, past the 2 and 3 letters GAMES_FTS indexes, takes about 10 ms,
+        at the edge of the sub-10 ms target
+        """
+        terms = SEARCH_TERM.findall(text.lower())[:SEARCH_MAX_TERMS]
+        domains = self.get_user_domains(tg_id)
+        if not terms or not domains:
+            return []
+        domains_match = " OR ".join(f'"{domain.encode().hex()}"' for domain in domains)
+        # Games found by name go first, then those found by description, recently indexed first in each.
+        # Unlike bm25, which reads the whole index for every term, this only reads the user's domains
+        terms_matches = [" ".join(f'"{term}"' for term in terms)]
+        if len(terms[-1]) >= SEARCH_MIN_PREFIX_LENGTH:
+            terms_matches.append(f"{terms_matches[0]}*")
+        tiers = []
+        for terms_match in terms_matches:
+            tiers += [
+                f"{{NAME}} : ({terms_match}) AND DOMAIN_KEY : ({domains_match})",
+                f"{{NAME DESCRIPTION}} : ({terms_match}) AND DOMAIN_KEY : ({domains_match}) "
+                f"NOT {{NAME}} : ({terms_match})",
+            ]
+        # Cut to the limit by FTS5 itself, so snippets are only made for the rows returned
+        query = f"""
+        WITH top_docs as (
+            SELECT
+            rowid as DOC_ID,
+            snippet(GAMES_FTS, 1, :open, :close, '…', {SEARCH_SNIPPET_WORDS}) as SNIPPET
+            FROM GAMES_FTS
+            WHERE GAMES_FTS MATCH :match
+            ORDER BY rowid DESC
+            LIMIT :limit
+        )
+        SELECT d.DOMAIN, d.GAME_ID, g.NAME, g.START_TIME, t.SNIPPET
+        FROM top_docs as t
+        INNER JOIN GAME_SEARCH_DOCS as d
+        ON (d.DOC_ID = t.DOC_ID)
+        INNER JOIN DOMAIN_GAMES as g
+        ON (g.DOMAIN = d.DOMAIN AND g.ID = d.GAME_ID)
+        ORDER BY t.DOC_ID DESC
+        """
+        rows = {}
+        for match in tiers:
+            # Prefix tiers find the exact matches again, hence the full limit and the dedup
+            params = {"open": SNIPPET_OPEN, "close": SNIPPET_CLOSE, "match": match, "limit": limit}
+            for row in self.query_rows(query, params):
+                rows.setdefault(row[:2], row)
+            if len(rows) >= limit:
+                break
+        res = [
+            SearchHit(
+                Domain.from_url(domain), int(game_id), name, str(start_time),
+                html.escape(snippet).replace(SNIPPET_OPEN, "<b>").replace(SNIPPET_CLOSE, "</b>"),
+            )
+            for domain, game_id, name, start_time, snippet in list(rows.values())[:limit]
+        ]
+        return res
+
+    def get_domain_versions(self) -> typing.Dict[str, str]:
+        """
+        Last poll time of every tracked domain; it changes with every commit_update and warm-up of the domain
+        """
+        rows = self.query_rows("SELECT DOMAIN, LAST_QUERY_TIME FROM DOMAIN_QUERY_STATUS")
+        res = {domain: str(version) for domain, version in rows}
+        return res
+
+    def autocomplete_rows(
+            self, domain: str,
+    ) -> typing.Tuple[typing.Optional[str], str, typing.List[typing.Tuple]]:
+        """
+        Last poll time, pretty name and games of the domain, latest game first, see AutocompleteIndex.
+        Read with a single statement, so the games are never newer than the poll time returned
+        """
+        query = """
+        SELECT
+        dqs.LAST_QUERY_TIME,
+        g.ID, g.NAME, g.FORMAT, g.START_TIME, g.PLAYER_IDS, g.AUTHORS, g.AUTHORS_IDS
+        FROM DOMAIN_QUERY_STATUS as dqs
+        LEFT JOIN DOMAIN_GAMES as g
+        ON (g.DOMAIN = dqs.DOMAIN)
+        WHERE 1=1
+        AND dqs.DOMAIN = :domain
+        ORDER BY g.START_TIME DESC, g.ID DESC
+        """
+        rows = self.query_rows(query, {"domain": domain})
+        version = str(rows[0][0]) if rows else None
+        games = [row[1:] for row in rows if row[1] is not None]
+        # noinspection PyBroadException
+        try:
+            domain_title = Domain.from_url(domain).pretty_name
+        except Exception:
+            domain_title = domain
+        return version, domain_title, games
+
+    def autocomplete_users(self) -> typing.Tuple[typing.Dict[int, typing.List[str]], typing.Dict[int, Language]]:
+        """
+        Domains and language of every user, see AutocompleteIndex
+        """
+        domains_query = """
+        SELECT
+        us.USER_ID, rd.DOMAIN
+        FROM USER_SUBSCRIPTION as us
+        INNER JOIN RULE_DESCRIPTION as rd
+        ON (us.RULE_ID = rd.RULE_ID)
+        GROUP BY 1, 2
+        """
+        domains = {}
+        for user_id, domain in self.query_rows(domains_query):
+            domains.setdefault(int(user_id), []).append(domain)
+        languages = {
+            int(user_id): Language(language)
+            for user_id, language in self.query_rows("SELECT USER_ID, LANGUAGE FROM USER_LANGUAGE")
+        }
+        return domains, languages
+
     def merge_into_truth_db(self) -> None:
         delete_query = f"""
         DELETE FROM DOMAIN_GAMES
@@ -673,6 +1309,7 @@ class QEngNewsDB:
         FROM DOMAIN_QUERY_STATUS
         WHERE 1=1
         AND (julianday(CURRENT_TIMESTAMP) - julianday(LAST_QUERY_TIME)) * 86400.0 > :delta
+        AND DOMAIN NOT IN (SELECT DOMAIN FROM DOMAIN_WARMUP)
         """
         res = self.query(query, {"delta": delta}, raise_on_error=False)
         domains = res["DOMAIN"].tolist()
@@ -813,50 +1450,41 @@ class QEngNewsDB:
             )
             WHERE iu.USER_ID IS NULL
         )
-        SELECT a.*, b.LANGUAGE
+        SELECT 
+        a.*, b.LANGUAGE, IFNULL(c.IS_DIGEST, 0) as IS_DIGEST,
+        IFNULL(d.DIFF_MODE, '{DEFAULT_USER_DIFF_MODE.value}') as DIFF_MODE
         FROM updates_filtered as a
         INNER JOIN USER_LANGUAGE as b
         ON (a.USER_ID = b.USER_ID)
+        LEFT JOIN USER_DIGEST as c
+        ON (a.USER_ID = c.USER_ID)
+        LEFT JOIN USER_DIFF_MODE as d
+        ON (a.USER_ID = d.USER_ID)
         """
         users_to_notify_df = self.query(query)
 
         return users_to_notify_df
 
+    @staticmethod
+    def _fits_rule_limit(n_rules: int) -> bool:
+        """
+        Whether a user may have that many rules; the single and the bulk subscriptions both check it
+        """
+        return n_rules <= MAX_USER_RULES_ALLOWED
+
     def is_user_within_rule_limits(self, tg_id: int) -> bool:
-        query = """
-        SELECT COUNT(*) as N_RULES
-        FROM USER_SUBSCRIPTION
-        WHERE 1=1
-        AND USER_ID = :user_id
         """
-        cnt_rules = self.query(query, {"user_id": tg_id})
-        n_rules = cnt_rules["N_RULES"].iloc[0]
-        is_ok = n_rules <= MAX_USER_RULES_ALLOWED
+        Whether the user may add one more rule
+        """
+        n_rules = USER_PROFILE_CACHE.get(tg_id, "n_rules")
+        if n_rules is None:
+            n_rules = self.store.count_rules(tg_id)
+            USER_PROFILE_CACHE.set(tg_id, n_rules=n_rules)
+        is_ok = self._fits_rule_limit(n_rules + 1)
         return is_ok
 
     def get_user_rule_by_id(self, tg_id: int, rule_id: str) -> typing.Optional[Rule]:
-        query = """
-        SELECT *
-        FROM USER_SUBSCRIPTION 
-        INNER JOIN RULE_DESCRIPTION
-        USING (RULE_ID)
-        WHERE 1=1
-        AND USER_ID = :user_id
-        AND RULE_ID = :rule_id
-        """
-        rule_df = self.query(
-            query, {
-                "user_id": tg_id,
-                "rule_id": rule_id,
-            },
-            raise_on_error=False
-        )
-        if rule_df is not None and "Exception_text" not in rule_df.columns:
-            res = Rule.from_json(rule_df.iloc[0].to_dict())
-        else:
-            res = None
-
-        return res
+        return self.store.get_rule(tg_id, rule_id)
 
     def get_updates(
             self: QEngNewsDB,
@@ -872,21 +1500,21 @@ class QEngNewsDB:
 
             for domain in domains_due:
                 new_games_pt = domain.get_games()
+                GAMES_FETCHED.inc(len(new_games_pt), domain=domain.full_url)
                 new_games.extend(new_games_pt)
                 time.sleep(1)
                 if SEND_ONLY_TO_ADMIN:
                     break
 
-            self.games_to_temp_table(new_games)
-            users_to_notify = self.users_to_notify()
+            with timed("staging_insert"):
+                self.games_to_temp_table(new_games)
+            with timed("notify_query"):
+                users_to_notify = self.users_to_notify()
         else:
             users_to_notify = pd.DataFrame()
 
-        # noinspection PyTypeChecker
-        notifs = [
-            Update.from_row(row)
-            for _, row in users_to_notify.iterrows()
-        ]
+        with timed("materialize"):
+            notifs = Update.from_frame(users_to_notify)
 
         return notifs
 
@@ -901,22 +1529,9 @@ class QEngNewsDB:
         return None
 
     def delete_user_rule_by_id(self, tg_id: int, rule_id: str) -> None:
-        query = """
-        DELETE FROM USER_SUBSCRIPTION 
-        WHERE 1=1
-        AND USER_ID = :user_id
-        AND RULE_ID = :rule_id
-        """
-        res = self.query(
-            query, {
-                "user_id": tg_id,
-                "rule_id": rule_id,
-            },
-            raise_on_error=False
-        )
-
-        assert res is None, res["Exception_text"].iloc[0]
-        return res
+        self.store.delete_rule(tg_id, rule_id)
+        USER_PROFILE_CACHE.invalidate(tg_id, "n_rules", "domains")
+        return None
 
     def prune_rule_descriptions(self) -> None:
         query = """
@@ -966,13 +1581,33 @@ class QEngNewsDB:
         assert res is None, res["Exception_text"].iloc[0]
         return res
 
+    def ensure_schema(self) -> None:
+        """
+        Creates and migrates the DB right away instead of on the first query
+        """
+        _ = self._db_conn
+        return None
+
+    def commit(self) -> None:
+        if self._conn is not None:
+            self._conn.commit()
+        return None
+
+    def rollback(self) -> None:
+        if self._conn is not None:
+            self._conn.rollback()
+        return None
+
     def close_connection(self) -> None:
+        if self._conn is None:
+            return None
         # noinspection PyBroadException
         try:
             self.query("COMMIT", safe=False)
         except Exception:
             pass
-        self._db_conn.close()
+        self._conn.close()
+        self._conn = None
         return None
 
     def __enter__(self):
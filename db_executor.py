@@ -0,0 +1,72 @@
+"""
+Bounded executor for the bot's DB work, each worker thread owning its own connection
+"""
+
+from __future__ import annotations
+
+import threading
+import typing
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from db_api import QEngNewsDB
+from meta_constants import DB_LOCATION, DB_FAST_WORKERS, DB_SLOW_WORKERS
+
+__all__ = [
+    "DBExecutor",
+    "DB_EXECUTOR",
+]
+
+T = typing.TypeVar("T")
+
+
+@dataclass
+class DBExecutor:
+    """
+    Runs DB calls on two bounded lanes: cheap point lookups go to the fast lane, and heavy queries
+    (e.g. matching all user's games) go to the slow one, so that they can't starve each other
+    """
+    db_location: str
+    fast_workers: int
+    slow_workers: int
+    _fast: ThreadPoolExecutor = field(init=False, repr=False)
+    _slow: ThreadPoolExecutor = field(init=False, repr=False)
+    _local: threading.local = field(init=False, repr=False, default_factory=threading.local)
+
+    def __post_init__(self):
+        self._fast = ThreadPoolExecutor(self.fast_workers, thread_name_prefix="db-fast")
+        self._slow = ThreadPoolExecutor(self.slow_workers, thread_name_prefix="db-slow")
+
+    def _db(self) -> QEngNewsDB:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = QEngNewsDB(self.db_location)
+            self._local.db = db
+        return db
+
+    def _call(self, func: typing.Callable[[QEngNewsDB], T]) -> T:
+        db = self._db()
+        try:
+            res = func(db)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        return res
+
+    def submit(self, func: typing.Callable[[QEngNewsDB], T], slow: bool = False) -> Future:
+        pool = self._slow if slow else self._fast
+        fut = pool.submit(self._call, func)
+        return fut
+
+    def run(self, func: typing.Callable[[QEngNewsDB], T], slow: bool = False, timeout: float = None) -> T:
+        res = self.submit(func, slow).result(timeout)
+        return res
+
+    def shutdown(self) -> None:
+        self._fast.shutdown(wait=True)
+        self._slow.shutdown(wait=True)
+        return None
+
+
+DB_EXECUTOR = DBExecutor(DB_LOCATION, DB_FAST_WORKERS, DB_SLOW_WORKERS)
@@ -1,16 +1,36 @@
 from __future__ import annotations
 
-from typing import List, Callable, Tuple, Union
+from typing import List, Callable, Tuple, Optional
 import re
-import difflib
 import html
+import time
+import bisect
+import enum
+import functools
+from collections import Counter
+from dataclasses import dataclass, field
 from itertools import zip_longest
 import typing
 
+from meta_constants import DIFF_MAX_STEPS, DIFF_TIME_BUDGET_SECONDS, DIFF_CACHE_MAX_SIZE, \
+    DIFF_TEXT_CONTEXT_WORDS, DIFF_TEXT_MAX_LENGTH
+
 Token = str
 TokenList = List[Token]
+Opcode = Tuple[str, int, int, int, int]
+# Ranges shorter than this go straight to Myers; longer ones are first cut at unique common tokens
+PATIENCE_MIN_LENGTH = 64
 whitespace = re.compile(r'\s+')
 end_sentence = re.compile(r'[.!?\n]\s+')
+ELLIPSIS = '…'
+
+
+class DiffMode(enum.Enum):
+    '''How a user is shown a change of a game description'''
+    # A screenshot of the side-by-side HTML diff, sent as a photo
+    Picture = "picture"
+    # Telegram HTML inside the change message itself
+    Text = "text"
 
 
 def tokenize(s: str) -> TokenList:
@@ -49,10 +69,213 @@ def mark_span(text: TokenList) -> TokenList:
     return text
 
 
-def align_seqs(a: TokenList, b: TokenList, fill: Token = '') -> Tuple[TokenList, TokenList]:
+class DiffBudgetExceeded(Exception):
+    pass
+
+
+@dataclass
+class DiffBudget:
+    '''Work allowed for one diff, shared by all of its sequence comparisons'''
+    max_steps: int = DIFF_MAX_STEPS
+    time_budget_seconds: float = DIFF_TIME_BUDGET_SECONDS
+    steps: int = 0
+    deadline: float = field(init=False)
+
+    def __post_init__(self):
+        self.deadline = time.monotonic() + self.time_budget_seconds
+
+    def spend(self, steps: int) -> None:
+        self.steps += steps
+        if self.steps > self.max_steps or time.monotonic() > self.deadline:
+            raise DiffBudgetExceeded(f"{self.steps} steps")
+        return None
+
+
+def _bisect(a: TokenList, b: TokenList, a_lo: int, a_hi: int, b_lo: int, b_hi: int,
+            budget: DiffBudget) -> Optional[Tuple[int, int]]:
+    '''Myers' middle snake, searched from both ends in linear space
+
+    Returns the point to split both ranges at, as in diff-match-patch's diff_bisect
+    '''
+    n, m = a_hi - a_lo, b_hi - b_lo
+    max_d = (n + m + 1) // 2
+    v_offset = max_d
+    v_length = 2 * max_d + 2
+    v1 = [-1] * v_length
+    v2 = [-1] * v_length
+    v1[v_offset + 1] = 0
+    v2[v_offset + 1] = 0
+    delta = n - m
+    # Paths overlap going forward if the delta is odd, backward otherwise
+    front = delta % 2 != 0
+    k1start = k1end = k2start = k2end = 0
+    for d in range(max_d):
+        budget.spend(2 * (d + 1))
+        for k1 in range(-d + k1start, d + 1 - k1end, 2):
+            k1_offset = v_offset + k1
+            if k1 == -d or (k1 != d and v1[k1_offset - 1] < v1[k1_offset + 1]):
+                x1 = v1[k1_offset + 1]
+            else:
+                x1 = v1[k1_offset - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[a_lo + x1] == b[b_lo + y1]:
+                x1 += 1
+                y1 += 1
+            v1[k1_offset] = x1
+            if x1 > n:
+                k1end += 2
+            elif y1 > m:
+                k1start += 2
+            elif front:
+                k2_offset = v_offset + delta - k1
+                if 0 <= k2_offset < v_length and v2[k2_offset] != -1 and x1 >= n - v2[k2_offset]:
+                    return a_lo + x1, b_lo + y1
+
+        for k2 in range(-d + k2start, d + 1 - k2end, 2):
+            k2_offset = v_offset + k2
+            if k2 == -d or (k2 != d and v2[k2_offset - 1] < v2[k2_offset + 1]):
+                x2 = v2[k2_offset + 1]
+            else:
+                x2 = v2[k2_offset - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and a[a_hi - x2 - 1] == b[b_hi - y2 - 1]:
+                x2 += 1
+                y2 += 1
+            v2[k2_offset] = x2
+            if x2 > n:
+                k2end += 2
+            elif y2 > m:
+                k2start += 2
+            elif not front:
+                k1_offset = v_offset + delta - k2
+                if 0 <= k1_offset < v_length and v1[k1_offset] != -1:
+                    x1 = v1[k1_offset]
+                    y1 = v_offset + x1 - k1_offset
+                    if x1 >= n - x2:
+                        return a_lo + x1, b_lo + y1
+    return None
+
+
+def _patience_anchors(a: TokenList, b: TokenList, a_lo: int, a_hi: int, b_lo: int, b_hi: int,
+                      budget: DiffBudget) -> List[Tuple[int, int]]:
+    '''Positions of the tokens that occur once in both ranges, longest run in the same order in both'''
+    budget.spend(a_hi - a_lo + b_hi - b_lo)
+    counts_a = Counter(a[a_lo:a_hi])
+    counts_b = Counter(b[b_lo:b_hi])
+    pos_b = {
+        b[j]: j
+        for j in range(b_lo, b_hi)
+        if counts_b[b[j]] == 1 and counts_a[b[j]] == 1
+    }
+    pairs = [(i, pos_b[a[i]]) for i in range(a_lo, a_hi) if a[i] in pos_b]
+
+    # Longest increasing subsequence of b positions, by patience sorting
+    tails = []
+    tail_idx = []
+    prev = [-1] * len(pairs)
+    for idx, (_, j) in enumerate(pairs):
+        k = bisect.bisect_left(tails, j)
+        if k == len(tails):
+            tails.append(j)
+            tail_idx.append(idx)
+        else:
+            tails[k] = j
+            tail_idx[k] = idx
+        prev[idx] = tail_idx[k - 1] if k else -1
+    res = []
+    idx = tail_idx[-1] if tail_idx else -1
+    while idx != -1:
+        res.append(pairs[idx])
+        idx = prev[idx]
+    res.reverse()
+    return res
+
+
+def _matching_blocks(a: TokenList, b: TokenList, a_lo: int, a_hi: int, b_lo: int, b_hi: int,
+                     budget: DiffBudget, out: List[Tuple[int, int, int]]) -> None:
+    '''Appends the (a start, b start, length) blocks of an edit script, in order
+
+    Long ranges are cut at unique common tokens first (patience diff), which keeps the edit distance
+    Myers has to go through small for real texts; the script is then short, though not always the shortest
+    '''
+    prefix = 0
+    while a_lo + prefix < a_hi and b_lo + prefix < b_hi and a[a_lo + prefix] == b[b_lo + prefix]:
+        prefix += 1
+    if prefix:
+        out.append((a_lo, b_lo, prefix))
+    a_lo, b_lo = a_lo + prefix, b_lo + prefix
+
+    suffix = 0
+    while a_lo < a_hi - suffix and b_lo < b_hi - suffix and a[a_hi - suffix - 1] == b[b_hi - suffix - 1]:
+        suffix += 1
+    a_mid, b_mid = a_hi - suffix, b_hi - suffix
+
+    anchors = []
+    if a_lo < a_mid and b_lo < b_mid and max(a_mid - a_lo, b_mid - b_lo) >= PATIENCE_MIN_LENGTH:
+        anchors = _patience_anchors(a, b, a_lo, a_mid, b_lo, b_mid, budget)
+    if anchors:
+        prev_a, prev_b = a_lo, b_lo
+        for x, y in anchors:
+            _matching_blocks(a, b, prev_a, x, prev_b, y, budget, out)
+            out.append((x, y, 1))
+            prev_a, prev_b = x + 1, y + 1
+        _matching_blocks(a, b, prev_a, a_mid, prev_b, b_mid, budget, out)
+    elif a_lo < a_mid and b_lo < b_mid:
+        split = _bisect(a, b, a_lo, a_mid, b_lo, b_mid, budget)
+        if split is not None and split not in ((a_lo, b_lo), (a_mid, b_mid)):
+            x, y = split
+            _matching_blocks(a, b, a_lo, x, b_lo, y, budget, out)
+            _matching_blocks(a, b, x, a_mid, y, b_mid, budget, out)
+
+    if suffix:
+        out.append((a_mid, b_mid, suffix))
+    return None
+
+
+def diff_opcodes(a: TokenList, b: TokenList, budget: DiffBudget = None) -> List[Opcode]:
+    '''Same format as difflib.SequenceMatcher.get_opcodes, from a linear-space Myers diff
+
+    Raises DiffBudgetExceeded if the sequences are too different to diff within the budget
+    '''
+    budget = budget or DiffBudget()
+    blocks = []
+    _matching_blocks(a, b, 0, len(a), 0, len(b), budget, blocks)
+    blocks.append((len(a), len(b), 0))
+
+    res = []
+    i = j = 0
+    for a0, b0, size in blocks:
+        if i < a0 or j < b0:
+            tag = 'replace' if i < a0 and j < b0 else 'delete' if i < a0 else 'insert'
+            res.append((tag, i, a0, j, b0))
+        if size:
+            if res and res[-1][0] == 'equal':
+                _, prev_a0, _, prev_b0, _ = res.pop()
+                res.append(('equal', prev_a0, a0 + size, prev_b0, b0 + size))
+            else:
+                res.append(('equal', a0, a0 + size, b0, b0 + size))
+        i, j = a0 + size, b0 + size
+    return res
+
+
+def coarse_opcodes(a: TokenList, b: TokenList) -> List[Opcode]:
+    '''Fallback when over budget: all of a is replaced by all of b'''
+    if a == b:
+        return [('equal', 0, len(a), 0, len(b))] if a else []
+    return [('replace', 0, len(a), 0, len(b))]
+
+
+def budgeted_opcodes(a: TokenList, b: TokenList, budget: DiffBudget) -> List[Opcode]:
+    try:
+        return diff_opcodes(a, b, budget)
+    except DiffBudgetExceeded:
+        return coarse_opcodes(a, b)
+
+
+def align_seqs(a: TokenList, b: TokenList, fill: Token = '',
+               budget: DiffBudget = None) -> Tuple[TokenList, TokenList]:
     out_a, out_b = [], []
-    seqmatcher = difflib.SequenceMatcher(a=a, b=b, autojunk=False)
-    for tag, a0, a1, b0, b1 in seqmatcher.get_opcodes():
+    for tag, a0, a1, b0, b1 in budgeted_opcodes(a, b, budget or DiffBudget()):
         delta = (a1 - a0) - (b1 - b0)
         out_a += a[a0:a1] + [fill] * max(-delta, 0)
         out_b += b[b0:b1] + [fill] * max(delta, 0)
@@ -63,14 +286,13 @@ def align_seqs(a: TokenList, b: TokenList, fill: Token = '') -> Tuple[TokenList,
 def markup_diff(a: TokenList, b: TokenList,
                 mark: Callable[[TokenList], TokenList] = mark_span,
                 default_mark: Callable[[TokenList], TokenList] = lambda x: x,
-                isjunk: Union[None, Callable[[Token], bool]] = None) -> Tuple[TokenList, TokenList]:
+                budget: DiffBudget = None) -> Tuple[TokenList, TokenList]:
     """Returns a and b with any differences processed by mark
 
-    Junk is ignored by the differ
+    Over budget, the whole of a differing pair is marked
     """
-    seqmatcher = difflib.SequenceMatcher(isjunk=isjunk, a=a, b=b, autojunk=False)
     out_a, out_b = [], []
-    for tag, a0, a1, b0, b1 in seqmatcher.get_opcodes():
+    for tag, a0, a1, b0, b1 in budgeted_opcodes(a, b, budget or DiffBudget()):
         markup = default_mark if tag == 'equal' else mark
         out_a += markup(a[a0:a1])
         out_b += markup(b[b0:b1])
@@ -84,27 +306,91 @@ def html_sidebyside(
         a_name: str = None, b_name: str = None
 ):
     # Set the panel display
-    out = '<div style="display: grid;grid-template-columns: 1fr 1fr;grid-gap: 1px;" id="main">'
+    out = ['<div style="display: grid;grid-template-columns: 1fr 1fr;grid-gap: 1px;" id="main">']
     if a_name and b_name:
-        out += f"<div><b>{a_name}</b></div><div><b>{b_name}</b></div>"
+        out.append(f"<div><b>{a_name}</b></div><div><b>{b_name}</b></div>")
     # There's some CSS in Jupyter notebooks that makes the first pair unalign. This is a workaround
-    # out += '<p></p><p></p>'
+    # out.append('<p></p><p></p>')
     for left, right in zip_longest(a, b, fillvalue=''):
-        out += f'<div>{left}</div>'
-        out += f'<div>{right}</div>'
-    out += '</div>'
-    return out
+        out.append(f'<div>{left}</div><div>{right}</div>')
+    out.append('</div>')
+    return ''.join(out)
 
 
+@functools.lru_cache(maxsize=DIFF_CACHE_MAX_SIZE)
 def html_diffs(a: str, b: str, a_name: str = None, b_name: str = None):
+    """Side-by-side HTML diff of two descriptions, sentence by sentence, then word by word
+
+    Takes at most DIFF_TIME_BUDGET_SECONDS: past that, what is left is compared whole.
+    Memoized, as every user subscribed to a game gets the same diff
+    """
     a = html.escape(a)
     b = html.escape(b)
+    budget = DiffBudget()
 
     out_a, out_b = [], []
-    for sent_a, sent_b in zip(*align_seqs(sentencize(a), sentencize(b))):
-        mark_a, mark_b = markup_diff(tokenize(sent_a), tokenize(sent_b))
+    for sent_a, sent_b in zip(*align_seqs(sentencize(a), sentencize(b), budget=budget)):
+        mark_a, mark_b = markup_diff(tokenize(sent_a), tokenize(sent_b), budget=budget)
         out_a.append(untokenize(mark_a))
         out_b.append(untokenize(mark_b))
 
     diff_html = html_sidebyside(out_a, out_b, a_name, b_name)
     return diff_html
+
+
+def _clip_tokens(ts: TokenList, max_length: int) -> str:
+    '''Leading tokens of ts, joined, that fit into max_length characters'''
+    length = 0
+    for n, t in enumerate(ts):
+        length += len(t) + 1
+        if length > max_length:
+            return untokenize(ts[:n] + [ELLIPSIS])
+    return untokenize(ts)
+
+
+def _context(ts: TokenList, context_words: int, is_first: bool, is_last: bool) -> str:
+    '''Unchanged tokens, cut down to context_words next to the edits around them'''
+    head = [] if is_first else ts[:context_words]
+    tail = [] if is_last or not context_words else ts[-context_words:]
+    if len(head) + len(tail) >= len(ts):
+        return untokenize(ts)
+    return untokenize(head + [ELLIPSIS] + tail)
+
+
+@functools.lru_cache(maxsize=DIFF_CACHE_MAX_SIZE)
+def telegram_diff(a: str, b: str, context_words: int = DIFF_TEXT_CONTEXT_WORDS,
+                  max_length: int = DIFF_TEXT_MAX_LENGTH) -> str:
+    """Word by word diff of two descriptions as Telegram HTML: removed words struck out, added ones
+    in bold and underlined, with context_words of unchanged text around every edit
+
+    Cut at an edit boundary to about max_length characters, so that tags are always closed.
+    Memoized for the same reason as html_diffs
+    """
+    a = html.escape(a.strip(), quote=False)
+    b = html.escape(b.strip(), quote=False)
+    if a == b:
+        return ''
+    ta = tokenize(a) if a else []
+    tb = tokenize(b) if b else []
+    opcodes = budgeted_opcodes(ta, tb, DiffBudget())
+
+    pieces = []
+    last = len(opcodes) - 1
+    for n, (tag, a0, a1, b0, b1) in enumerate(opcodes):
+        if tag == 'equal':
+            pieces.append(_context(ta[a0:a1], context_words, n == 0, n == last))
+            continue
+        if a0 < a1:
+            pieces.append(f'<s>{_clip_tokens(ta[a0:a1], max_length // 2)}</s>')
+        if b0 < b1:
+            pieces.append(f'<b><u>{_clip_tokens(tb[b0:b1], max_length // 2)}</u></b>')
+
+    out = []
+    length = 0
+    for piece in pieces:
+        length += len(piece) + 1
+        if length > max_length and out:
+            out.append(ELLIPSIS)
+            break
+        out.append(piece)
+    return untokenize(out)
@@ -0,0 +1,114 @@
+"""
+Splitting description diff screenshots into pages Telegram accepts as photos, encoded compactly
+"""
+
+from __future__ import annotations
+
+import typing
+from io import BytesIO
+
+from lazy_imports import lazy_module
+from meta_constants import DIFF_PAGE_MAX_HEIGHT, DIFF_PAGE_MAX_BYTES, DIFF_PAGE_COLORS, \
+    TELEGRAM_PHOTO_MAX_SIDES, TELEGRAM_PHOTO_MAX_ASPECT_RATIO, TELEGRAM_MEDIA_GROUP_MAX_SIZE
+
+Image = lazy_module("PIL.Image")
+
+__all__ = [
+    "diff_pages", "media_groups",
+]
+
+# How far up from the page limit to look for a blank row to cut at, as a share of the page
+CUT_SEARCH_SHARE = 0.25
+
+
+def _page_height(width: int, max_height: int) -> int:
+    """
+    Tallest page of this width within both our own limit and Telegram's photo limits
+    """
+    res = min(
+        max_height,
+        TELEGRAM_PHOTO_MAX_SIDES - width,
+        int(width * TELEGRAM_PHOTO_MAX_ASPECT_RATIO),
+    )
+    return max(res, 1)
+
+
+def _is_blank_row(gray: Image.Image, y: int) -> bool:
+    lo, hi = gray.crop((0, y, gray.width, y + 1)).getextrema()
+    return lo == hi
+
+
+def _cut_at(gray: Image.Image, top: int, page_height: int) -> int:
+    """
+    Bottom of the page starting at top: the lowest blank row close to the limit, so that no line
+    of text is cut in half, or the limit itself if there is none
+    """
+    limit = top + page_height
+    if limit >= gray.height:
+        return gray.height
+    lowest = max(top + 1, limit - int(page_height * CUT_SEARCH_SHARE))
+    for y in range(limit, lowest - 1, -1):
+        if _is_blank_row(gray, y):
+            return y
+    return limit
+
+
+def _encode(page: Image.Image) -> bytes:
+    """
+    Palette PNG: the diff is a handful of flat colours, so it loses nothing visible, and comes out
+    over ten times smaller than the screenshot. Zlib's extra optimization pass buys too little to pay for
+    """
+    quantized = page.convert("RGB").quantize(colors=DIFF_PAGE_COLORS, method=Image.Quantize.FASTOCTREE)
+    buf = BytesIO()
+    quantized.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _encode_within_limits(page: Image.Image, gray: Image.Image) -> typing.List[bytes]:
+    """
+    The page encoded, or halved until every part fits into the byte limit. Halves are cut
+    at a blank row too, with the grayscale copy of the page
+    """
+    encoded = _encode(page)
+    if len(encoded) <= DIFF_PAGE_MAX_BYTES or page.height < 2:
+        return [encoded]
+    cut = _cut_at(gray, 0, page.height // 2)
+    res = []
+    for top, bottom in ((0, cut), (cut, page.height)):
+        box = (0, top, page.width, bottom)
+        res.extend(_encode_within_limits(page.crop(box), gray.crop(box)))
+    return res
+
+
+def diff_pages(image: Image.Image, max_height: int = DIFF_PAGE_MAX_HEIGHT) -> typing.List[bytes]:
+    """
+    The screenshot cut top to bottom into encoded pages, each one within Telegram's limits for a photo
+    """
+    page_height = _page_height(image.width, max_height)
+    gray = image.convert("L")
+    res = []
+    top = 0
+    while top < image.height:
+        bottom = _cut_at(gray, top, page_height)
+        box = (0, top, image.width, bottom)
+        res.extend(_encode_within_limits(image.crop(box), gray.crop(box)))
+        top = bottom
+    return res
+
+
+def media_groups(pages: typing.List[bytes]) -> typing.List[typing.List[bytes]]:
+    """
+    Pages split into as few media groups as possible, of even sizes, so that none is left with a single
+    page when there are more than fit into one group. A single page is sent on its own
+    """
+    if not pages:
+        return []
+    n_groups = -(-len(pages) // TELEGRAM_MEDIA_GROUP_MAX_SIZE)
+    size, extra = divmod(len(pages), n_groups)
+    res = []
+    start = 0
+    for i in range(n_groups):
+        end = start + size + (1 if i < extra else 0)
+        res.append(pages[start:end])
+        start = end
+    return res
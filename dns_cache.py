@@ -0,0 +1,205 @@
+"""
+Two-tier cache of host name lookups: in-process LRU in front of the DNS_CACHE table of the bot DB
+"""
+
+from __future__ import annotations
+
+import json
+import socket
+import sqlite3
+import threading
+import time
+import typing
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+
+from meta_constants import DNS_CACHE_TTL_SECONDS, DNS_NEGATIVE_TTL_SECONDS, \
+    DNS_REFRESH_AHEAD_SECONDS, DNS_CACHE_MAX_SIZE, DNS_RESOLVER_WORKERS
+from metrics import METRICS
+
+__all__ = [
+    "DNSEntry", "DNSCache", "DNSLookupTimeoutError",
+    "DNS_CACHE",
+]
+
+DNS_CACHE_LOOKUPS = METRICS.counter("qeng_dns_cache_lookups_total", "Host name lookups by cache outcome")
+
+
+class DNSLookupTimeoutError(TimeoutError):
+    """
+    The host was not resolved within the timeout; unlike a failed lookup, that says nothing about the host
+    """
+    pass
+
+
+@dataclass(frozen=True)
+class DNSEntry:
+    """
+    IPs of a host; none means the lookup failed
+    """
+    ips: typing.FrozenSet[str]
+    # Wall clock, as entries are shared between processes through the DB
+    expires_at: float
+
+    @property
+    def is_negative(self) -> bool:
+        return not self.ips
+
+
+@dataclass
+class DNSCache:
+    """
+    Failed lookups are cached too, for a shorter time. A known host is always answered from the cache:
+    close to expiry (or past it) its entry is refreshed in the background, and served meanwhile.
+    Only a host that was never resolved, or whose lookup last failed, waits for the resolver,
+    and never longer than the given timeout.
+    The DB tier is the DB that QEngNewsDB last connected to in this process, see bind
+    """
+    db_location: typing.Optional[str] = None
+    ttl_seconds: float = DNS_CACHE_TTL_SECONDS
+    negative_ttl_seconds: float = DNS_NEGATIVE_TTL_SECONDS
+    refresh_ahead_seconds: float = DNS_REFRESH_AHEAD_SECONDS
+    max_size: int = DNS_CACHE_MAX_SIZE
+    workers: int = DNS_RESOLVER_WORKERS
+    _entries: typing.OrderedDict[str, DNSEntry] = field(init=False, repr=False, default_factory=OrderedDict)
+    _inflight: typing.Dict[str, Future] = field(init=False, repr=False, default_factory=dict)
+    _lock: threading.RLock = field(init=False, repr=False, default_factory=threading.RLock)
+    # Kept apart from _lock, so that a busy DB never holds up the in-process tier
+    _db_lock: threading.Lock = field(init=False, repr=False, default_factory=threading.Lock)
+    _executor: typing.Optional[ThreadPoolExecutor] = field(init=False, repr=False, default=None)
+    _conn: typing.Optional[sqlite3.Connection] = field(init=False, repr=False, default=None)
+
+    def bind(self, db_location: str) -> None:
+        """
+        Makes the DB tier the DNS_CACHE table of the DB, which has to exist by then
+        """
+        with self._db_lock:
+            if db_location == self.db_location:
+                return None
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self.db_location = db_location
+        return None
+
+    @property
+    def conn(self) -> typing.Optional[sqlite3.Connection]:
+        """
+        None until a DB is bound. Only used under _db_lock
+        """
+        if self._conn is None and self.db_location is not None:
+            self._conn = sqlite3.connect(self.db_location, timeout=30, isolation_level=None, check_same_thread=False)
+        return self._conn
+
+    def resolve(self, host: str, timeout: typing.Optional[float] = None) -> typing.FrozenSet[str]:
+        """
+        IPs of the host, or an empty set if it can't be resolved.
+        Raises DNSLookupTimeoutError if the host is yet to be resolved, and that takes longer than the timeout
+        """
+        host = host.lower()
+        entry = self._get(host)
+        now = time.time()
+        if entry is not None and not (entry.is_negative and entry.expires_at <= now):
+            refresh_at = entry.expires_at - (0 if entry.is_negative else self.refresh_ahead_seconds)
+            if refresh_at <= now:
+                self.prefetch(host)
+                DNS_CACHE_LOOKUPS.inc(result="stale")
+            else:
+                DNS_CACHE_LOOKUPS.inc(result="hit")
+            return entry.ips
+
+        fut = self.prefetch(host)
+        try:
+            entry = fut.result(timeout)
+        except FutureTimeoutError:
+            DNS_CACHE_LOOKUPS.inc(result="timeout")
+            raise DNSLookupTimeoutError(host)
+        DNS_CACHE_LOOKUPS.inc(result="miss")
+        return entry.ips
+
+    def prefetch(self, host: str) -> Future:
+        """
+        Resolves the host in the background; a lookup already in progress is reused
+        """
+        host = host.lower()
+        with self._lock:
+            fut = self._inflight.get(host)
+            if fut is None:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="dns")
+                fut = self._executor.submit(self._lookup, host)
+                self._inflight[host] = fut
+        return fut
+
+    def _get(self, host: str) -> typing.Optional[DNSEntry]:
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry is not None:
+                self._entries.move_to_end(host)
+                return entry
+        entry = self._load(host)
+        if entry is not None:
+            self._remember(host, entry)
+        return entry
+
+    def _remember(self, host: str, entry: DNSEntry) -> None:
+        with self._lock:
+            self._entries[host] = entry
+            self._entries.move_to_end(host)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return None
+
+    def _lookup(self, host: str) -> DNSEntry:
+        try:
+            try:
+                ais = socket.getaddrinfo(host, 0, 0, 0, 0)
+                entry = DNSEntry(frozenset(ai[-1][0] for ai in ais), time.time() + self.ttl_seconds)
+            except (OSError, UnicodeError):
+                entry = DNSEntry(frozenset(), time.time() + self.negative_ttl_seconds)
+            self._remember(host, entry)
+        finally:
+            with self._lock:
+                self._inflight.pop(host, None)
+        self._store(host, entry)
+        return entry
+
+    def _load(self, host: str) -> typing.Optional[DNSEntry]:
+        try:
+            with self._db_lock:
+                conn = self.conn
+                if conn is None:
+                    return None
+                row = conn.execute("SELECT IPS, EXPIRES_AT FROM DNS_CACHE WHERE HOST = ?", (host,)).fetchone()
+        except sqlite3.Error:
+            # The in-process tier still works without the DB
+            return None
+        if row is None:
+            return None
+        return DNSEntry(frozenset(json.loads(row[0])), row[1])
+
+    def _store(self, host: str, entry: DNSEntry) -> None:
+        query = """
+        INSERT INTO DNS_CACHE (HOST, IPS, EXPIRES_AT) VALUES (?, ?, ?)
+        ON CONFLICT (HOST) DO UPDATE SET IPS = excluded.IPS, EXPIRES_AT = excluded.EXPIRES_AT
+        """
+        try:
+            with self._db_lock:
+                conn = self.conn
+                if conn is not None:
+                    conn.execute(query, (host, json.dumps(sorted(entry.ips)), entry.expires_at))
+        except sqlite3.Error:
+            pass
+        return None
+
+    def clear(self) -> None:
+        """
+        Forgets the in-process tier only
+        """
+        with self._lock:
+            self._entries.clear()
+        return None
+
+
+DNS_CACHE = DNSCache()
@@ -0,0 +1,60 @@
+"""
+Background warm-up of newly tracked domains, off the bot's DB lanes
+"""
+
+from __future__ import annotations
+
+import threading
+import typing
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+from db_executor import DBExecutor
+from entities import Domain
+from meta_constants import DB_LOCATION, DOMAIN_WARMUP_WORKERS
+
+__all__ = [
+    "DomainWarmer",
+    "DOMAIN_WARMER",
+]
+
+
+@dataclass
+class DomainWarmer:
+    """
+    Loads the games of newly tracked domains on its own executor, so that a handler that registers
+    a domain doesn't wait for it to be scraped. A warm-up that fails leaves the domain pending,
+    and the next schedule run picks it up again
+    """
+    executor: DBExecutor
+    _pending: typing.Set[str] = field(init=False, repr=False, default_factory=set)
+    _lock: threading.Lock = field(init=False, repr=False, default_factory=threading.Lock)
+
+    def request(self, domain: Domain) -> typing.Optional[Future]:
+        """
+        Queues the warm-up, unless the domain is already queued
+        """
+        domain_url = domain.full_url
+        with self._lock:
+            if domain_url in self._pending:
+                return None
+            self._pending.add(domain_url)
+
+        fut = self.executor.submit(lambda db: db.warm_up_domain(domain))
+        fut.add_done_callback(lambda f: self._done(domain_url, f))
+        return fut
+
+    def _done(self, domain_url: str, fut: Future) -> None:
+        with self._lock:
+            self._pending.discard(domain_url)
+        exc = fut.exception()
+        if exc is not None:
+            print("ERROR", f"warm-up of {domain_url} failed", repr(exc), sep="\n")
+        return None
+
+    def shutdown(self) -> None:
+        self.executor.shutdown()
+        return None
+
+
+DOMAIN_WARMER = DomainWarmer(DBExecutor(DB_LOCATION, DOMAIN_WARMUP_WORKERS, 1))
@@ -1,10 +1,19 @@
-from entities.feed import Forum
-from entities.game_attrs import PassingSequence, GameMode, GameFormat
-from entities.domain import Domain
-from entities.rule import Rule
-from entities.game import BaseGame
-from entities.change import Change, ChangeType
-from entities.update import Update
+"""
+Entities are imported on first use (PEP 562), so that e.g. the bot doesn't load the screenshot machinery
+of entities.update until it needs an Update
+"""
+
+import importlib
+import typing
+
+if typing.TYPE_CHECKING:
+    from entities.feed import Forum
+    from entities.game_attrs import PassingSequence, GameMode, GameFormat
+    from entities.domain import Domain
+    from entities.rule import Rule
+    from entities.game import BaseGame
+    from entities.change import Change, ChangeType, RenderCache
+    from entities.update import Update
 
 __all__ = [
     "Forum",
@@ -12,7 +21,32 @@ __all__ = [
     "Domain",
     'Rule',
     "BaseGame",
-    "Change", "ChangeType",
+    "Change", "ChangeType", "RenderCache",
     "Update",
 ]
 
+_NAME_TO_MODULE = {
+    "Forum": "entities.feed",
+    "GameMode": "entities.game_attrs",
+    "GameFormat": "entities.game_attrs",
+    "PassingSequence": "entities.game_attrs",
+    "Domain": "entities.domain",
+    "Rule": "entities.rule",
+    "BaseGame": "entities.game",
+    "Change": "entities.change",
+    "ChangeType": "entities.change",
+    "RenderCache": "entities.change",
+    "Update": "entities.update",
+}
+
+
+def __getattr__(name: str):
+    if name not in _NAME_TO_MODULE:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_NAME_TO_MODULE[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> typing.List[str]:
+    return sorted(set(globals()) | set(__all__))
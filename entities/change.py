@@ -5,26 +5,36 @@
 from __future__ import annotations
 
 import datetime
+import hashlib
 import itertools
-from dataclasses import dataclass, fields, Field
+from dataclasses import dataclass, fields, Field, field
 import enum
 import typing
+from types import MappingProxyType
 
-import pandas as pd
-# noinspection PyProtectedMember
-from bs4 import BeautifulSoup
+from lazy_imports import lazy_module
 
 from translations import Language, MenuItem, MENU_LOCALIZATION
+from description_diff import DiffMode, telegram_diff
 from entities.game_attrs import PassingSequence, GameFormat, GameMode
 from entities.domain import Domain
 from entities.game import BaseGame
 from entities.rule import RuleType
+from metrics import METRICS
+
+pd = lazy_module("pandas")
+bs4 = lazy_module("bs4")
 
 
 __all__ = [
     "Change", "ChangeType",
+    "RenderCache",
 ]
 
+RENDER_CACHE_LOOKUPS = METRICS.counter("qeng_render_cache_lookups_total", "Change message render cache lookups")
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
 TIME_UNITS = [
     (MenuItem.TUYears, 365 * 24 * 60 * 60),
     (MenuItem.TUMonths, 30 * 24 * 60 * 60),
@@ -46,27 +56,29 @@ class ChangeType(enum.Enum):
     NewForumMessage = enum.auto()
 
     @classmethod
-    def localization_dict(cls) -> typing.Dict[ChangeType, typing.Dict[Language, str]]:
-        di = {
-            v: MENU_LOCALIZATION[getattr(MenuItem, n)]
-            for n, v in cls.__members__.items()
-        }
-        return di
+    def localization_dict(cls) -> typing.Mapping[ChangeType, typing.Mapping[Language, str]]:
+        return _CHANGE_TYPE_LOCALIZATION
 
     @classmethod
-    def to_root_part(cls) -> typing.Dict[ChangeType, str]:
-        di = {
-            cls.NameChanged: "name",
-            cls.PassingSequenceChanged: "passing_sequence",
-            cls.StartTimeChanged: "start_time",
-            cls.EndTimeChanged: "end_time",
-        }
-        return di
+    def to_root_part(cls) -> typing.Mapping[ChangeType, str]:
+        return _CHANGE_TYPE_ROOT_PART
 
     def __str__(self) -> str:
         return self.localization_dict()[self][Language.English]
 
 
+_CHANGE_TYPE_LOCALIZATION = MappingProxyType({
+    v: MENU_LOCALIZATION[getattr(MenuItem, n)]
+    for n, v in ChangeType.__members__.items()
+})
+_CHANGE_TYPE_ROOT_PART = MappingProxyType({
+    ChangeType.NameChanged: "name",
+    ChangeType.PassingSequenceChanged: "passing_sequence",
+    ChangeType.StartTimeChanged: "start_time",
+    ChangeType.EndTimeChanged: "end_time",
+})
+
+
 @dataclass
 class Change:
     game_new: bool
@@ -145,11 +157,101 @@ class Change:
             "new_start_time", "old_start_time", "new_end_time", "old_end_time",
         ]:
             if isinstance(init_dict[time], str):
-                init_dict[time] = datetime.datetime.strptime(init_dict[time], '%Y-%m-%d %H:%M:%S')
+                init_dict[time] = datetime.datetime.strptime(init_dict[time], TIME_FORMAT)
 
         inst = cls(**init_dict)
         return inst
 
+    @staticmethod
+    def _enum_column(
+            col: pd.Series,
+            enum_cls: typing.Type[enum.Enum],
+            default: typing.Optional[enum.Enum] = None,
+    ) -> typing.List[enum.Enum]:
+        by_value = {
+            v.value: v
+            for v in enum_cls.__members__.values()
+        }
+        res = [
+            by_value[int(v)] if v and not pd.isna(v) else default
+            for v in col.tolist()
+        ]
+        return res
+
+    @staticmethod
+    def _time_column(col: pd.Series) -> typing.List[typing.Optional[datetime.datetime]]:
+        parsed = pd.to_datetime(col, format=TIME_FORMAT)
+        res = [
+            None if pd.isna(v) else v.to_pydatetime()
+            for v in parsed.tolist()
+        ]
+        return res
+
+    @staticmethod
+    def _parsed_column(
+            col: pd.Series,
+            parser: typing.Callable[[str], typing.Any],
+            default: typing.Callable[[], typing.Any],
+    ) -> typing.List[typing.Any]:
+        # Values repeat a lot between rows, so every distinct one is parsed only once
+        parsed = {}
+        res = []
+        for v in col.tolist():
+            if not v or pd.isna(v):
+                res.append(default())
+                continue
+            if v not in parsed:
+                parsed[v] = parser(v)
+            res.append(parsed[v])
+        return res
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> typing.Dict[typing.Tuple[str, int], Change]:
+        """
+        Decodes one Change per distinct (DOMAIN, ID) of the frame, converting column by column
+        """
+        if df.empty:
+            return {}
+        df = df.drop_duplicates(["DOMAIN", "ID"])
+
+        cols = {
+            attr.name: df[attr.name.upper()].tolist()
+            for attr in fields(cls)
+        }
+        cols["old_passing_sequence"] = cls._enum_column(
+            df["OLD_PASSING_SEQUENCE"], PassingSequence, PassingSequence.Linear,
+        )
+        cols["new_passing_sequence"] = cls._enum_column(
+            df["NEW_PASSING_SEQUENCE"], PassingSequence, PassingSequence.Linear,
+        )
+        cols["game_mode"] = cls._enum_column(df["GAME_MODE"], GameMode)
+        cols["game_format"] = cls._enum_column(df["GAME_FORMAT"], GameFormat)
+        for col_name in ["old_player_ids", "new_player_ids"]:
+            cols[col_name] = cls._parsed_column(df[col_name.upper()], BaseGame.player_ids_from_string, list)
+        cols["domain"] = cls._parsed_column(df["DOMAIN"], Domain.from_url, lambda: None)
+        cols["authors"] = cls._parsed_column(df["AUTHORS"], BaseGame.authors_list_from_str, list)
+        cols["authors_ids"] = cls._parsed_column(
+            df["AUTHORS_IDS"], lambda x: BaseGame.authors_list_from_str(x, True), list,
+        )
+        cols["forum_thread_id"] = [
+            None if pd.isna(v) else int(v)
+            for v in cols["forum_thread_id"]
+        ]
+        cols["new_message_text"] = [
+            None if pd.isna(v) else v
+            for v in cols["new_message_text"]
+        ]
+        for col_name in ["new_start_time", "old_start_time", "new_end_time", "old_end_time"]:
+            cols[col_name] = cls._time_column(df[col_name.upper()])
+
+        names = list(cols)
+        changes = [
+            cls(**dict(zip(names, vals)))
+            for vals in zip(*cols.values())
+        ]
+        res = dict(zip(zip(df["DOMAIN"].tolist(), df["ID"].tolist()), changes))
+        return res
+
     def change_delta_word(self, time_type: str, language: Language) -> str:
         delta = getattr(self, f"new_{time_type}") - getattr(self, f"old_{time_type}")
         seconds = delta.total_seconds()
@@ -171,7 +273,9 @@ class Change:
         res = "({})".format(" ".join(pts))
         return res
 
-    def _to_str_content(self, change_type: ChangeType, language: Language) -> str:
+    def _to_str_content(
+            self, change_type: ChangeType, language: Language, diff_mode: DiffMode = DiffMode.Picture,
+    ) -> str:
         if change_type is ChangeType.NewGame:
             game_cls = self.domain.upper_level_domain.game_class
             inst = game_cls(
@@ -214,7 +318,11 @@ class Change:
             res = " ".join(map(str, interlaced))
             return res
         elif change_type is ChangeType.DescriptionChanged:
-            return ""
+            if diff_mode is DiffMode.Picture:
+                # Sent separately, as a photo
+                return ""
+            diff = telegram_diff(self.old_description_truncated or "", self.new_description_truncated or "")
+            return f"\n{diff}"
         elif change_type is ChangeType.PlayersListChanged:
             new_players = sorted(set(self.new_player_ids).difference(self.old_player_ids))
             url_templ_func = RuleType.from_game_format(self.game_format)
@@ -245,12 +353,14 @@ class Change:
             return res
         else:
             assert change_type is ChangeType.NewForumMessage, "Wrong change type"
-            res = str(BeautifulSoup(self.new_message_text or '', 'lxml').text)
+            res = str(bs4.BeautifulSoup(self.new_message_text or '', 'lxml').text)
             return res
 
-    def change_type_to_msg(self, change_type: ChangeType, language: Language) -> str:
+    def change_type_to_msg(
+            self, change_type: ChangeType, language: Language, diff_mode: DiffMode = DiffMode.Picture,
+    ) -> str:
         prefix = change_type.localization_dict()[change_type][language]
-        cont = self._to_str_content(change_type, language)
+        cont = self._to_str_content(change_type, language, diff_mode)
         msg = f"<u>{prefix}</u>: {cont}"
         return msg
 
@@ -268,7 +378,7 @@ class Change:
         ch = [ct for b, ct in change_to_type if b]
         return ch
 
-    def _to_str_parts(self, language: Language) -> typing.List[str]:
+    def _to_str_parts(self, language: Language, diff_mode: DiffMode = DiffMode.Picture) -> typing.List[str]:
         update_word = MENU_LOCALIZATION[MenuItem.UpdateText][language]
         forum_word = MENU_LOCALIZATION[MenuItem.ForumText][language]
         game_cls = self.domain.upper_level_domain.game_class
@@ -294,16 +404,21 @@ class Change:
             return res
 
         for change_type in self.current_changes:
-            msg = self.change_type_to_msg(change_type, language)
+            msg = self.change_type_to_msg(change_type, language, diff_mode)
             res.append(msg)
 
         return res
 
-    def to_str(self, language: Language) -> str:
-        pts = self._to_str_parts(language)
+    def to_str(self, language: Language, diff_mode: DiffMode = DiffMode.Picture) -> str:
+        pts = self._to_str_parts(language, diff_mode)
         res = "\n".join(pts)
         return res
 
+    @property
+    def fingerprint(self) -> str:
+        res = hashlib.sha1(repr(self).encode()).hexdigest()
+        return res
+
     def to_json(self) -> typing.Dict[str, typing.Any]:
         chng = str(list(map(str, self.current_changes)))
         res = {
@@ -315,3 +430,33 @@ class Change:
 
     def __str__(self):
         return self.to_str(Language.English)
+
+
+@dataclass
+class RenderCache:
+    """
+    Rendered change messages of a single batch of updates, keyed by (change fingerprint, language, diff mode)
+    """
+    _rendered: typing.Dict[typing.Tuple[str, Language, DiffMode], str] = field(default_factory=dict)
+    # Keeps the Change referenced, so that its id is not reused within the batch
+    _fingerprints: typing.Dict[int, typing.Tuple[Change, str]] = field(default_factory=dict)
+
+    def fingerprint(self, change: Change) -> str:
+        key = id(change)
+        if key not in self._fingerprints:
+            self._fingerprints[key] = (change, change.fingerprint)
+        return self._fingerprints[key][1]
+
+    def render(self, change: Change, language: Language, diff_mode: DiffMode = DiffMode.Picture) -> str:
+        key = (self.fingerprint(change), language, diff_mode)
+        if key in self._rendered:
+            RENDER_CACHE_LOOKUPS.inc(result="hit")
+        else:
+            RENDER_CACHE_LOOKUPS.inc(result="miss")
+            self._rendered[key] = change.to_str(language, diff_mode)
+        return self._rendered[key]
+
+    def clear(self) -> None:
+        self._rendered.clear()
+        self._fingerprints.clear()
+        return None
@@ -5,13 +5,11 @@ import abc
 from dataclasses import dataclass
 import re
 import typing
-import socket
 from urllib.parse import urlsplit, parse_qs
-import datetime
-
-from cachier import cachier
 
 from entities.domain_meta import UpperLevelDomain, WHITELISTED_IP_TO_ENGINE
+from dns_cache import DNS_CACHE, DNSLookupTimeoutError
+from meta_constants import DNS_LOOKUP_TIMEOUT_SECONDS, DomainLookupTimeoutError
 from translations import Language
 
 if typing.TYPE_CHECKING:
@@ -86,6 +84,8 @@ class Domain(abc.ABC):
             # noinspection PyBroadException
             try:
                 domain_ip = cls.get_ip(sp.netloc)
+            except DNSLookupTimeoutError:
+                raise DomainLookupTimeoutError(url)
             except Exception:
                 domain_ip = set()
             inters = domain_ip.intersection(WHITELISTED_IP_TO_ENGINE)
@@ -132,19 +132,18 @@ class Domain(abc.ABC):
         raise NotImplementedError()
 
     @staticmethod
-    @cachier(stale_after=datetime.timedelta(days=14))
     def get_ip(site: str) -> typing.Set[str]:
+        """
+        Served from DNS_CACHE; a host that was never resolved waits for at most DNS_LOOKUP_TIMEOUT_SECONDS,
+        and raises DNSLookupTimeoutError after that
+        """
         site = site.lower()
         sp = urlsplit(site)
         if sp.netloc:
             site = sp.netloc
         else:
             site = sp.path
-        ip_list = []
-        ais = socket.getaddrinfo(site, 0, 0, 0, 0)
-        for result in ais:
-            ip_list.append(result[-1][0])
-        ip_list = set(ip_list)
+        ip_list = set(DNS_CACHE.resolve(site, DNS_LOOKUP_TIMEOUT_SECONDS))
         return ip_list
 
 
@@ -159,3 +158,4 @@ if __name__ == '__main__':
         print(dom_inst_, str(dom_inst_))
         # games_ = dom_inst_.get_games()
         # print(games_)
+
@@ -8,11 +8,12 @@ from dataclasses import dataclass
 import typing
 from urllib.parse import urlsplit, parse_qs
 
-# noinspection PyProtectedMember
-from bs4 import BeautifulSoup
-import feedparser
+from lazy_imports import lazy_module
 
-from entities.constants import USER_AGENTS_FACTORY
+from entities.constants import USER_AGENTS
+
+bs4 = lazy_module("bs4")
+feedparser = lazy_module("feedparser")
 
 __all__ = [
     "FeedEntry", "Forum",
@@ -34,7 +35,7 @@ class FeedEntry:
         msg_id = int(sp[-1])
         # noinspection PyTypeChecker
         tid = int(params["topic"][0])
-        summ = BeautifulSoup(j["summary"] or '', 'lxml').text
+        summ = bs4.BeautifulSoup(j["summary"] or '', 'lxml').text
         inst = cls(
             tid, msg_id,
             j["author"],
@@ -64,7 +65,7 @@ class Forum:
     @classmethod
     def from_url(cls, forum_url: typing.Optional[str]) -> Forum:
         if forum_url is not None:
-            feed = feedparser.parse(forum_url, agent=USER_AGENTS_FACTORY.random)
+            feed = feedparser.parse(forum_url, agent=USER_AGENTS.for_host(forum_url))
             entries = [FeedEntry.from_json(e) for e in feed.entries]
         else:
             entries = []
@@ -10,15 +10,15 @@ from dataclasses import dataclass
 import re
 import typing
 
-import pandas as pd
-# noinspection PyProtectedMember
-from bs4 import Tag
+from lazy_imports import lazy_module
 
 from meta_constants import MAX_DESCRIPTION_LENGTH, MAX_DESCRIPTION_LENGTH_TG, MAX_LAST_MESSAGE_LENGTH
 from translations import Language, MenuItem, MENU_LOCALIZATION
 from entities.domain import Domain
 from entities.game_attrs import GameMode, GameFormat, PassingSequence
 
+pd = lazy_module("pandas")
+
 __all__ = [
     "BaseGame",
 ]
@@ -2,7 +2,9 @@
 from __future__ import annotations
 
 import enum
+import functools
 import typing
+from types import MappingProxyType
 
 from translations import Language, MenuItem, MENU_LOCALIZATION
 
@@ -24,21 +26,34 @@ class CustomNamedEnum(enum.Enum):
 
     @classmethod
     def from_str(cls, s: str) -> CustomNamedEnum:
-        localized_name_to_inst = {
-            loc_name: type_
-            for type_, loc_ in cls.localization_dict().items()
-            for lang, loc_name in loc_.items()
-        }
-        inst = localized_name_to_inst.get(s, cls._default_value())
+        inst = _localization_index(cls)[1].get(s, cls._default_value())
         return inst
 
     @classmethod
-    def localization_dict(cls) -> typing.Dict[CustomNamedEnum, typing.Dict[Language, str]]:
-        di = {
-            v: MENU_LOCALIZATION[getattr(MenuItem, f"{cls.__name__}{k}")]
-            for k, v in cls.__members__.items()
-        }
-        return di
+    def localization_dict(cls) -> typing.Mapping[CustomNamedEnum, typing.Mapping[Language, str]]:
+        return _localization_index(cls)[0]
+
+
+@functools.lru_cache(maxsize=None)
+def _localization_index(
+        enum_cls: typing.Type[CustomNamedEnum],
+) -> typing.Tuple[
+    typing.Mapping[CustomNamedEnum, typing.Mapping[Language, str]],
+    typing.Mapping[str, CustomNamedEnum],
+]:
+    """
+    Localized names of the members and the reverse map, in any language, built once per enum
+    """
+    di = {
+        v: MENU_LOCALIZATION[getattr(MenuItem, f"{enum_cls.__name__}{k}")]
+        for k, v in enum_cls.__members__.items()
+    }
+    localized_name_to_inst = {
+        loc_name: type_
+        for type_, loc_ in di.items()
+        for lang, loc_name in loc_.items()
+    }
+    return MappingProxyType(di), MappingProxyType(localized_name_to_inst)
 
 
 class GameMode(CustomNamedEnum):
@@ -67,12 +82,7 @@ class GameFormat(CustomNamedEnum):
         return cls.Single
 
     def members_text(self, lang: Language) -> str:
-        cls = self.__class__
-        di = {
-            v: MENU_LOCALIZATION[getattr(MenuItem, f"GameFormatMembers{k}")]
-            for k, v in cls.__members__.items()
-        }
-        return di[self][lang]
+        return _GAME_FORMAT_MEMBERS_TEXT[self][lang]
 
 
 class PassingSequence(CustomNamedEnum):
@@ -85,3 +95,12 @@ class PassingSequence(CustomNamedEnum):
     @classmethod
     def _default_value(cls) -> PassingSequence:
         return cls.Linear
+
+
+_GAME_FORMAT_MEMBERS_TEXT = MappingProxyType({
+    v: MENU_LOCALIZATION[getattr(MenuItem, f"GameFormatMembers{k}")]
+    for k, v in GameFormat.__members__.items()
+})
+
+for enum_cls_ in (GameMode, GameFormat, PassingSequence):
+    _localization_index(enum_cls_)
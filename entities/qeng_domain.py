@@ -8,13 +8,16 @@ import datetime
 import typing
 
 import requests
-import feedparser
-from bs4 import BeautifulSoup
 
 from entities.domain import Domain
 from entities.game import BaseGame
-from entities.constants import USER_AGENTS_FACTORY
+from entities.constants import USER_AGENTS
 from entities.game_attrs import GameMode, GameFormat, PassingSequence
+from metrics import timed
+from lazy_imports import lazy_module
+
+bs4 = lazy_module("bs4")
+feedparser = lazy_module("feedparser")
 
 __all__ = [
     "QEngDomain",
@@ -43,13 +46,15 @@ class QEngDomain(Domain):
         return None
 
     def get_games(self) -> typing.List[BaseGame]:
-        ua = USER_AGENTS_FACTORY.random
+        ua = USER_AGENTS.for_host(self.full_url)
         hdrs = {"User-Agent": ua}
-        games_page = requests.get(self.full_url_to_parse, headers=hdrs).json()
-        games = [
-            QEngGame.from_api(self, fe)
-            for fe in games_page
-        ]
+        with timed("domain_fetch", domain=self.full_url):
+            games_page = requests.get(self.full_url_to_parse, headers=hdrs).json()
+        with timed("domain_parse", domain=self.full_url):
+            games = [
+                QEngGame.from_api(self, fe)
+                for fe in games_page
+            ]
         return games
 
     @property
@@ -70,7 +75,7 @@ class QEngGame(BaseGame):
     @classmethod
     def from_feed(cls, domain: Domain, fe: feedparser.FeedParserDict) -> QEngGame:
         descr = fe.summary
-        descr_soup = BeautifulSoup(descr or '', 'lxml')
+        descr_soup = bs4.BeautifulSoup(descr or '', 'lxml')
         descr_text = descr_soup.text
         descr_text = cls.strip_description_text(descr_text)
         if not fe.authors:
@@ -97,8 +102,8 @@ class QEngGame(BaseGame):
     @classmethod
     def from_api(cls, domain: Domain, g: typing.Dict[str, typing.Any]) -> QEngGame:
         descr = g["description"]
-        descr_soup = BeautifulSoup(descr or '', 'lxml').text
-        descr_soup = BeautifulSoup(descr_soup or '', 'lxml').text
+        descr_soup = bs4.BeautifulSoup(descr or '', 'lxml').text
+        descr_soup = bs4.BeautifulSoup(descr_soup or '', 'lxml').text
         descr_text = cls.strip_description_text(descr_soup)
         authors_ids = [int(a["uid"]) for a in g["authors"]]
         authors_names = [a["username"] for a in g["authors"]]
@@ -107,7 +112,7 @@ class QEngGame(BaseGame):
             for t in g["teams"]
             if int(t["status"]) in {0, 1}
         ]
-        name = BeautifulSoup(g["name"] or '', "lxml").text
+        name = bs4.BeautifulSoup(g["name"] or '', "lxml").text
 
         g = cls(
             domain, int(g["id"]),
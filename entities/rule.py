@@ -5,14 +5,17 @@ from dataclasses import dataclass
 import enum
 import typing
 import hashlib
+from types import MappingProxyType
 
-import pandas as pd
+from lazy_imports import lazy_module
 
 from meta_constants import SALT, RULE_ID_LENGTH
 from translations import Language, MenuItem, MENU_LOCALIZATION
 from entities.domain import Domain
 from entities.game_attrs import GameFormat
 
+pd = lazy_module("pandas")
+
 
 __all__ = [
     "Rule", "RuleType",
@@ -129,15 +132,8 @@ class Rule:
         return inst
 
     @staticmethod
-    def _str_di() -> typing.Dict[str, typing.Dict[Language, str]]:
-        di = {
-            "player_id": MENU_LOCALIZATION[MenuItem.PlayerIDText],
-            "team_id": MENU_LOCALIZATION[MenuItem.TeamIDText],
-            "game_id": MENU_LOCALIZATION[MenuItem.GameIDText],
-            "author_id": MENU_LOCALIZATION[MenuItem.AuthorIDText],
-            "game_ignore_id": MENU_LOCALIZATION[MenuItem.GameIgnoreIDText],
-        }
-        return di
+    def _str_di() -> typing.Mapping[str, typing.Mapping[Language, str]]:
+        return _RULE_ATTR_TEXT
 
     def to_str(
         self,
@@ -187,3 +183,12 @@ class Rule:
 
     def __str__(self):
         return self.to_str(Language.Russian)
+
+
+_RULE_ATTR_TEXT = MappingProxyType({
+    "player_id": MENU_LOCALIZATION[MenuItem.PlayerIDText],
+    "team_id": MENU_LOCALIZATION[MenuItem.TeamIDText],
+    "game_id": MENU_LOCALIZATION[MenuItem.GameIDText],
+    "author_id": MENU_LOCALIZATION[MenuItem.AuthorIDText],
+    "game_ignore_id": MENU_LOCALIZATION[MenuItem.GameIgnoreIDText],
+})
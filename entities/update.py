@@ -2,21 +2,24 @@
 from __future__ import annotations
 
 import datetime
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import typing
 import os
 import time
 from io import BytesIO
 import tempfile
-from contextlib import contextmanager
 
-import pandas as pd
-from selenium import webdriver
-from PIL import Image
+from lazy_imports import lazy_module
 
 from translations import Language, MenuItem, MENU_LOCALIZATION
-from description_diff import html_diffs
-from entities.change import Change, ChangeType
+from description_diff import html_diffs, DiffMode
+from diff_image import diff_pages
+from entities.change import Change, ChangeType, RenderCache
+from metrics import timed
+
+pd = lazy_module("pandas")
+webdriver = lazy_module("selenium.webdriver")
+Image = lazy_module("PIL.Image")
 
 __all__ = [
     "Update",
@@ -30,13 +33,15 @@ class Update:
     change: Change
     sent_ts: datetime.datetime = None
     is_delivered: bool = False
+    is_digest: bool = False
+    diff_mode: DiffMode = DiffMode.Picture
+    render_cache: typing.Optional[RenderCache] = field(default=None, repr=False, compare=False)
 
     @staticmethod
-    def test_fullpage_screenshot(
+    def fullpage_screenshot(
             file: str,
-            path: str,
             driver: webdriver.Chrome
-    ) -> None:
+    ) -> Image.Image:
         driver.get(file)
         time.sleep(0.25)
         element = driver.find_element_by_id('main')  # find part of the page you want image of
@@ -60,52 +65,60 @@ class Update:
         bottom = location['y'] + size['height']
 
         im = im.crop((left, top, right, bottom))  # defines crop points
-        im.save(path)  # saves new cropped image
-        return None
+        return im
 
     @classmethod
     def create_diff(
             cls,
             old_description: str, new_description: str, lang: Language,
             driver: webdriver.Chrome,
-    ) -> typing.Tuple[typing.Any, str]:
+    ) -> typing.List[bytes]:
         names = MENU_LOCALIZATION[MenuItem.DescriptionBeforeAfter][lang]
         res = html_diffs(old_description, new_description, *names)
         html_fd, html_path = tempfile.mkstemp(suffix=".html")
-        pic_fd, pic_path = tempfile.mkstemp(suffix=".png")
         with open(html_path, 'w', encoding='utf-8') as tmp:
             tmp.write(res)
         try:
-            cls.test_fullpage_screenshot(f"file://{html_path}", pic_path, driver)
+            im = cls.fullpage_screenshot(f"file://{html_path}", driver)
         finally:
             os.close(html_fd)
             os.remove(html_path)
-        return pic_fd, pic_path
+        return diff_pages(im)
 
     @property
     def msg(self) -> str:
-        msg_ = self.change.to_str(self.language)
+        if self.render_cache is not None:
+            msg_ = self.render_cache.render(self.change, self.language, self.diff_mode)
+        else:
+            msg_ = self.change.to_str(self.language, self.diff_mode)
         return msg_
 
     @property
     def has_diffpic(self) -> bool:
+        if self.diff_mode is not DiffMode.Picture:
+            return False
         return ChangeType.DescriptionChanged in self.change.current_changes
 
-    @contextmanager
-    def diffpic(self, driver: webdriver.Chrome):
-        pic_fd, pic_path = self.create_diff(
-            self.change.old_description_truncated or "",
-            self.change.new_description_truncated or "",
-            lang=self.language,
-            driver=driver,
-        )
-        try:
-            with open(pic_path, "rb") as pic:
-                yield pic
-        finally:
-            os.close(pic_fd)
-            os.remove(pic_path)
-        return None
+    @property
+    def diffpic_caption(self) -> str:
+        """
+        Names the game, for the diff pictures of a digest, which come apart from the text about it
+        """
+        name = self.change.new_name or str(self.change.id)
+        return f"{name} ({self.change.domain.pretty_name})"
+
+    def diffpic_pages(self, driver: webdriver.Chrome) -> typing.List[bytes]:
+        """
+        The description diff as encoded PNG pages, each one small enough to be sent as a photo
+        """
+        with timed("diffpic_render"):
+            pages = self.create_diff(
+                self.change.old_description_truncated or "",
+                self.change.new_description_truncated or "",
+                lang=self.language,
+                driver=driver,
+            )
+        return pages
 
     @classmethod
     def from_row(
@@ -117,10 +130,46 @@ class Update:
         # noinspection PyTypeChecker
         change = Change.from_json(row.to_dict())
         inst = cls(
-            user_id, lang, change
+            user_id, lang, change,
+            is_digest=bool(row.get("IS_DIGEST", 0)),
+            diff_mode=DiffMode(row.get("DIFF_MODE") or DiffMode.Picture.value),
         )
         return inst
 
+    @classmethod
+    def from_frame(
+            cls,
+            df: pd.DataFrame,
+            render_cache: RenderCache = None,
+    ) -> typing.List[Update]:
+        if df.empty:
+            return []
+        changes = Change.from_frame(df)
+        if render_cache is None:
+            render_cache = RenderCache()
+        # All the users notified about the same game share one Change instance and one render cache,
+        # so each message is rendered once per language
+        if "IS_DIGEST" in df.columns:
+            is_digest = df["IS_DIGEST"].tolist()
+        else:
+            is_digest = [0] * len(df)
+        if "DIFF_MODE" in df.columns:
+            diff_modes = df["DIFF_MODE"].tolist()
+        else:
+            diff_modes = [None] * len(df)
+        res = [
+            cls(
+                user_id, Language(lang), changes[(domain, game_id)],
+                is_digest=bool(digest), diff_mode=DiffMode(diff_mode or DiffMode.Picture.value),
+                render_cache=render_cache,
+            )
+            for user_id, lang, domain, game_id, digest, diff_mode in zip(
+                df["USER_ID"].tolist(), df["LANGUAGE"].tolist(),
+                df["DOMAIN"].tolist(), df["ID"].tolist(), is_digest, diff_modes,
+            )
+        ]
+        return res
+
     def to_json(self) -> typing.Dict[str, typing.Any]:
         res = {
             "USER_ID": self.user_id,
@@ -0,0 +1,53 @@
+"""
+Rotation pool of User-Agent strings, bundled with the code instead of fetched at runtime
+"""
+
+from __future__ import annotations
+
+import threading
+import typing
+import zlib
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+__all__ = [
+    "UserAgentPool",
+]
+
+
+@dataclass
+class UserAgentPool:
+    """
+    User-Agents are read from the bundled file on first use. Each host gets the same one on every call
+    (and in every process), so that a changing User-Agent doesn't break its keep-alive connections
+    or server-side caches
+    """
+    path: str
+    _agents: typing.Optional[typing.Tuple[str, ...]] = field(init=False, repr=False, default=None)
+    _lock: threading.Lock = field(init=False, repr=False, default_factory=threading.Lock)
+
+    @property
+    def agents(self) -> typing.Tuple[str, ...]:
+        if self._agents is None:
+            with self._lock:
+                if self._agents is None:
+                    with open(self.path, encoding="utf-8") as f:
+                        agents = tuple(
+                            line.strip()
+                            for line in f
+                            if line.strip() and not line.startswith("#")
+                        )
+                    assert agents, f"No User-Agents in {self.path}"
+                    self._agents = agents
+        return self._agents
+
+    def for_host(self, url: str) -> str:
+        """
+        Sticky User-Agent of the URL's host; a URL without a scheme works too
+        """
+        url = url.lower()
+        if not url.startswith("http"):
+            url = f"http://{url}"
+        host = urlsplit(url).netloc
+        agents = self.agents
+        return agents[zlib.crc32(host.encode()) % len(agents)]
@@ -0,0 +1,36 @@
+"""
+Deferred imports of heavy third-party modules, so that every entry point only loads what it uses
+"""
+
+from __future__ import annotations
+
+import importlib
+import types
+
+__all__ = [
+    "lazy_module",
+]
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stands in for a module until one of its attributes is looked up, then imports it.
+    The import itself goes through importlib, so it is as thread-safe as a plain import statement
+    """
+
+    def __getattr__(self, item: str):
+        module = importlib.import_module(self.__name__)
+        # Later lookups hit the copied attributes and never get here
+        self.__dict__.update(module.__dict__)
+        return getattr(module, item)
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self.__name__!r}>"
+
+
+def lazy_module(name: str) -> types.ModuleType:
+    """
+    Use as `pd = lazy_module("pandas")`. Only attribute access imports the module, so annotations
+    mentioning it must not be evaluated at import time (`from __future__ import annotations`)
+    """
+    return LazyModule(name)
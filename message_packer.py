@@ -0,0 +1,118 @@
+"""
+Packing of message parts into Telegram-sized messages
+"""
+
+from __future__ import annotations
+
+import bisect
+import re
+import typing
+
+from meta_constants import GAME_JOINER, MAX_MESSAGE_LENGTH_TELEGRAM
+
+__all__ = [
+    "pack_messages", "split_html_safe",
+]
+
+_tag = re.compile(r"<(/?)([a-zA-Z][a-zA-Z0-9]*)[^>]*?(/?)>")
+# Holds no "<", so that skipping over one never skips the start of a tag
+_entity = re.compile(r"&(?:[a-zA-Z][a-zA-Z0-9]{1,30}|#[0-9]{1,7}|#[xX][0-9a-fA-F]{1,6});")
+
+
+def _safe_boundaries(
+        text: str,
+) -> typing.Tuple[typing.List[int], typing.List[int], typing.List[int], typing.List[int]]:
+    """
+    Positions where the text may be cut without breaking a tag, an entity or an open element:
+    after a newline, after a space, and anywhere else, respectively. Then the positions that only
+    break an open element, for the elements longer than a message
+    """
+    newlines, spaces, anywhere, inside = [], [], [], []
+    depth = 0
+    pos = 0
+    tags = list(_tag.finditer(text))
+    tag_idx = 0
+    n = len(text)
+    while pos < n:
+        if tag_idx < len(tags) and tags[tag_idx].start() == pos:
+            m = tags[tag_idx]
+            is_closing, is_self_closing = bool(m.group(1)), bool(m.group(3))
+            if is_closing:
+                depth = max(depth - 1, 0)
+            elif not is_self_closing:
+                depth += 1
+            pos = m.end()
+            tag_idx += 1
+        else:
+            entity = _entity.match(text, pos) if text[pos] == "&" else None
+            pos = entity.end() if entity is not None else pos + 1
+        if depth == 0:
+            anywhere.append(pos)
+            prev = text[pos - 1]
+            if prev == "\n":
+                newlines.append(pos)
+            elif prev == " ":
+                spaces.append(pos)
+        else:
+            inside.append(pos)
+    return newlines, spaces, anywhere, inside
+
+
+def split_html_safe(text: str, limit: int = MAX_MESSAGE_LENGTH_TELEGRAM) -> typing.Iterator[str]:
+    """
+    Splits a text longer than the limit into pieces, preferring line breaks, then spaces.
+    Never cuts inside an HTML element unless it is longer than the limit itself,
+    and never inside a tag or an entity unless that one is
+    """
+    if len(text) <= limit:
+        yield text
+        return
+    boundaries = _safe_boundaries(text)
+    start = 0
+    while len(text) - start > limit:
+        end = None
+        for positions in boundaries:
+            idx = bisect.bisect_right(positions, start + limit) - 1
+            if idx >= 0 and positions[idx] > start:
+                end = positions[idx]
+                break
+        if end is None:
+            end = start + limit
+        yield text[start:end]
+        start = end
+    if start < len(text):
+        yield text[start:]
+
+
+def pack_messages(
+        texts: typing.Iterable[str],
+        joiner: str = GAME_JOINER,
+        limit: int = MAX_MESSAGE_LENGTH_TELEGRAM,
+) -> typing.Iterator[str]:
+    """
+    Lazily packs the texts into as few messages of at most `limit` characters as possible,
+    keeping their order. A text that does not fit into a message on its own is split
+    """
+    current_chunk = []
+    current_length = 0
+    for text in texts:
+        if len(text) > limit:
+            if current_chunk:
+                yield joiner.join(current_chunk)
+                current_chunk, current_length = [], 0
+            yield from split_html_safe(text, limit)
+            continue
+
+        new_length = current_length + len(text)
+        if current_chunk:
+            new_length += len(joiner)
+        if new_length > limit:
+            yield joiner.join(current_chunk)
+            current_chunk, current_length = [text], len(text)
+        else:
+            current_chunk.append(text)
+            current_length = new_length
+
+    if current_chunk:
+        yield joiner.join(current_chunk)
+    return None
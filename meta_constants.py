@@ -12,15 +12,36 @@ __all__ = [
     "GAME_RULE_DOMAIN_KEY",
     "MAX_LAST_MESSAGE_LENGTH",
     "SALT", "RULE_ID_LENGTH",
-    "InvalidDomainError",
+    "InvalidDomainError", "DomainLookupTimeoutError",
     "DEFAULT_DAYS_IN_FUTURE",
     "MAX_USER_RULES_ALLOWED",
     "MIN_HOURS_GAME_CHANGE_NOTIFY",
     "PERCENTAGE_CHANGE_TO_TRIGGER",
     "ADMIN_ID",
+    "METRICS_LOCATION",
+    "SLOW_QUERY_THRESHOLD_SECONDS", "QUERY_REPORT_TOP_N",
+    "USER_CACHE_TTL_SECONDS", "USER_CACHE_MAX_SIZE",
+    "BOT_WORKERS", "DB_FAST_WORKERS", "DB_SLOW_WORKERS", "DOMAIN_WARMUP_WORKERS",
+    "WEBHOOK_LISTEN", "WEBHOOK_PORT", "WEBHOOK_PATH",
+    "PERSISTENCE_FLUSH_BATCH", "PERSISTENCE_FLUSH_INTERVAL_SECONDS",
+    "JOB_LEASE_SECONDS", "JOB_MAX_ATTEMPTS", "JOB_RETRY_BACKOFF_SECONDS", "JOB_RETENTION_SECONDS",
+    "JOB_PRUNE_INTERVAL_SECONDS", "WORKER_POLL_INTERVAL_SECONDS",
+    "DNS_CACHE_TTL_SECONDS", "DNS_NEGATIVE_TTL_SECONDS", "DNS_REFRESH_AHEAD_SECONDS",
+    "DNS_CACHE_MAX_SIZE", "DNS_LOOKUP_TIMEOUT_SECONDS", "DNS_RESOLVER_WORKERS",
+    "DIFF_MAX_STEPS", "DIFF_TIME_BUDGET_SECONDS", "DIFF_CACHE_MAX_SIZE",
+    "DIFF_TEXT_CONTEXT_WORDS", "DIFF_TEXT_MAX_LENGTH",
+    "DIFF_PAGE_MAX_HEIGHT", "DIFF_PAGE_MAX_BYTES", "DIFF_PAGE_COLORS",
+    "TELEGRAM_PHOTO_MAX_BYTES", "TELEGRAM_PHOTO_MAX_SIDES", "TELEGRAM_PHOTO_MAX_ASPECT_RATIO",
+    "TELEGRAM_MEDIA_GROUP_MAX_SIZE",
+    "SEARCH_MAX_RESULTS", "SEARCH_MAX_TERMS", "SEARCH_SNIPPET_WORDS", "SEARCH_MIN_PREFIX_LENGTH",
+    "AUTOCOMPLETE_MAX_RESULTS", "AUTOCOMPLETE_MAX_TERMS", "AUTOCOMPLETE_REFRESH_SECONDS",
+    "AUTOCOMPLETE_CACHE_SECONDS",
+    "REMINDER_LEAD_SECONDS", "REMINDER_HORIZON_SECONDS", "REMINDER_SYNC_SECONDS", "REMINDER_RETENTION_SECONDS",
+    "REMINDER_RETRY_SECONDS",
 ]
 
 DB_LOCATION = os.path.abspath(os.path.join(__file__, "..", "data", "bot_db.sqlite"))
+METRICS_LOCATION = os.path.abspath(os.path.join(__file__, "..", "data", "update_db.prom"))
 # UPDATE_FREQUENCY_SECONDS = 6 * 60 * 60
 UPDATE_FREQUENCY_SECONDS = 1
 MAX_DESCRIPTION_LENGTH = 10_000
@@ -38,7 +59,74 @@ DEFAULT_DAYS_IN_FUTURE = 14
 MAX_USER_RULES_ALLOWED = 10
 MIN_HOURS_GAME_CHANGE_NOTIFY = 2.5
 ADMIN_ID = 476001386
+SLOW_QUERY_THRESHOLD_SECONDS = 0.1
+QUERY_REPORT_TOP_N = 5
+USER_CACHE_TTL_SECONDS = 15 * 60
+USER_CACHE_MAX_SIZE = 10_000
+BOT_WORKERS = 32
+DB_FAST_WORKERS = 4
+DB_SLOW_WORKERS = 2
+DOMAIN_WARMUP_WORKERS = 2
+WEBHOOK_LISTEN = "127.0.0.1"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "telegram"
+PERSISTENCE_FLUSH_BATCH = 50
+PERSISTENCE_FLUSH_INTERVAL_SECONDS = 5
+JOB_LEASE_SECONDS = 5 * 60
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BACKOFF_SECONDS = 30
+JOB_RETENTION_SECONDS = 7 * 24 * 60 * 60
+# How often the scheduler deletes the jobs past their retention
+JOB_PRUNE_INTERVAL_SECONDS = 60 * 60
+WORKER_POLL_INTERVAL_SECONDS = 1
+DNS_CACHE_TTL_SECONDS = 14 * 24 * 60 * 60
+DNS_NEGATIVE_TTL_SECONDS = 10 * 60
+DNS_REFRESH_AHEAD_SECONDS = 24 * 60 * 60
+DNS_CACHE_MAX_SIZE = 1_000
+DNS_LOOKUP_TIMEOUT_SECONDS = 2
+DNS_RESOLVER_WORKERS = 2
+DIFF_MAX_STEPS = 2_000_000
+DIFF_TIME_BUDGET_SECONDS = 0.5
+DIFF_CACHE_MAX_SIZE = 128
+DIFF_TEXT_CONTEXT_WORDS = 6
+# Several changes share one message, which Telegram caps at MAX_MESSAGE_LENGTH_TELEGRAM
+DIFF_TEXT_MAX_LENGTH = 1_500
+TELEGRAM_PHOTO_MAX_BYTES = 10 * 1024 * 1024
+# Width plus height, in pixels
+TELEGRAM_PHOTO_MAX_SIDES = 10_000
+TELEGRAM_PHOTO_MAX_ASPECT_RATIO = 20
+TELEGRAM_MEDIA_GROUP_MAX_SIZE = 10
+# Screenshots are 800 px wide; taller pages get scaled down to unreadable on phones
+DIFF_PAGE_MAX_HEIGHT = 2_000
+DIFF_PAGE_MAX_BYTES = TELEGRAM_PHOTO_MAX_BYTES // 2
+DIFF_PAGE_COLORS = 64
+SEARCH_MAX_RESULTS = 20
+SEARCH_MAX_TERMS = 8
+SEARCH_SNIPPET_WORDS = 12
+# Shorter words are only searched as whole words: GAMES_FTS indexes prefixes of 2 and 3 letters,
+# and a single letter would be expanded into every word starting with it
+SEARCH_MIN_PREFIX_LENGTH = 2
+# Telegram takes up to 50 inline results, but only a handful fit on a phone screen
+AUTOCOMPLETE_MAX_RESULTS = 20
+AUTOCOMPLETE_MAX_TERMS = 5
+AUTOCOMPLETE_REFRESH_SECONDS = 60
+# How long Telegram may serve the same answer to the same user and query without asking the bot
+AUTOCOMPLETE_CACHE_SECONDS = 30
+REMINDER_LEAD_SECONDS = 60 * 60
+# How far ahead reminders are loaded onto the heap; the heap is reloaded in full every half of that
+REMINDER_HORIZON_SECONDS = 24 * 60 * 60
+REMINDER_SYNC_SECONDS = 60
+REMINDER_RETENTION_SECONDS = 7 * 24 * 60 * 60
+# A reminder that failed to send is tried again after that, until its game starts
+REMINDER_RETRY_SECONDS = 5 * 60
 
 
 class InvalidDomainError(ValueError):
     pass
+
+
+class DomainLookupTimeoutError(InvalidDomainError):
+    """
+    The host of the domain was not resolved in time, so it is unknown whether the domain is valid
+    """
+    pass
@@ -0,0 +1,193 @@
+"""
+Lightweight metrics (counters and histograms) exported in the Prometheus text format
+"""
+
+from __future__ import annotations
+
+import bisect
+import os
+import threading
+import time
+import typing
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+__all__ = [
+    "Counter", "Histogram", "MetricsRegistry",
+    "METRICS", "STAGE_DURATION", "timed",
+]
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = typing.Tuple[typing.Tuple[str, str], ...]
+
+
+def _labels_key(labels: typing.Dict[str, typing.Any]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_str(labels: Labels, extra: typing.Tuple[str, str] = None) -> str:
+    pts = list(labels)
+    if extra is not None:
+        pts.append(extra)
+    if not pts:
+        return ""
+    res = ",".join(f'{k}="{_escape(v)}"' for k, v in pts)
+    return f"{{{res}}}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+@dataclass
+class Counter:
+    name: str
+    description: str
+    _values: typing.Dict[Labels, float] = field(default_factory=dict, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        return None
+
+    def exposition(self) -> typing.List[str]:
+        res = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                res.append(f"{self.name}{_labels_str(key)} {_format_value(value)}")
+        return res
+
+
+@dataclass
+class Histogram:
+    name: str
+    description: str
+    buckets: typing.Tuple[float, ...] = DEFAULT_BUCKETS
+    _counts: typing.Dict[Labels, typing.List[int]] = field(default_factory=dict, repr=False)
+    _sums: typing.Dict[Labels, float] = field(default_factory=dict, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def observe(self, value: float, **labels) -> None:
+        key = _labels_key(labels)
+        # Bucket counts are stored non-cumulatively, the last slot being +Inf
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[idx] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+        return None
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def exposition(self) -> typing.List[str]:
+        res = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        bounds = list(self.buckets) + [float("inf")]
+        with self._lock:
+            for key, counts in sorted(self._counts.items()):
+                cumulative = 0
+                for bound, cnt in zip(bounds, counts):
+                    cumulative += cnt
+                    le = _labels_str(key, ("le", _format_value(bound)))
+                    res.append(f"{self.name}_bucket{le} {cumulative}")
+                res.append(f"{self.name}_sum{_labels_str(key)} {_format_value(self._sums[key])}")
+                res.append(f"{self.name}_count{_labels_str(key)} {cumulative}")
+        return res
+
+
+@dataclass
+class MetricsRegistry:
+    metrics: typing.Dict[str, typing.Union[Counter, Histogram]] = field(default_factory=dict)
+
+    def counter(self, name: str, description: str) -> Counter:
+        if name not in self.metrics:
+            self.metrics[name] = Counter(name, description)
+        return self.metrics[name]
+
+    def histogram(
+            self, name: str, description: str,
+            buckets: typing.Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        if name not in self.metrics:
+            self.metrics[name] = Histogram(name, description, buckets)
+        return self.metrics[name]
+
+    def exposition(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.exposition())
+        res = "\n".join(lines) + "\n"
+        return res
+
+    def write_textfile(self, path: str) -> None:
+        # Written atomically, so that the node exporter never reads a half-written file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.exposition())
+        os.replace(tmp_path, path)
+        return None
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        registry = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            # noinspection PyPep8Naming
+            def do_GET(self) -> None:
+                body = registry.exposition().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return None
+
+            # noinspection PyShadowingBuiltins
+            def log_message(self, format: str, *args: typing.Any) -> None:
+                return None
+
+        server = ThreadingHTTPServer((host, port), _Handler)
+        thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+        thread.start()
+        return server
+
+
+METRICS = MetricsRegistry()
+
+STAGE_DURATION = METRICS.histogram(
+    "qeng_update_stage_seconds",
+    "Time spent in each stage of an update_db run",
+)
+
+
+def timed(stage: str, **labels):
+    return STAGE_DURATION.time(stage=stage, **labels)
+
+
+if __name__ == '__main__':
+    for i_ in range(5):
+        with timed("demo", domain="game.qeng.org"):
+            time.sleep(0.01 * i_)
+    METRICS.counter("qeng_demo_total", "Demo counter").inc(status="ok")
+    print(METRICS.exposition())
@@ -0,0 +1,215 @@
+"""
+SQLite-backed persistence of conversation states and chat data
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+import threading
+import time
+import typing
+from collections import defaultdict
+from sqlite3 import connect, Connection
+
+from telegram.ext import BasePersistence, ConversationHandler
+from telegram.ext.utils.promise import Promise
+
+from db_api import QEngNewsDB
+from meta_constants import PERSISTENCE_FLUSH_BATCH, PERSISTENCE_FLUSH_INTERVAL_SECONDS
+
+__all__ = [
+    "SQLitePersistence",
+]
+
+ConversationKey = typing.Tuple[int, ...]
+
+
+class _LazyChatData(defaultdict):
+    """
+    Chat data that is loaded from the DB the first time a chat is seen
+    """
+
+    def __init__(self, loader: typing.Callable[[int], typing.Dict[str, typing.Any]]):
+        super().__init__(dict)
+        self._loader = loader
+
+    def __missing__(self, chat_id: int) -> typing.Dict[str, typing.Any]:
+        data = self._loader(chat_id)
+        self[chat_id] = data
+        return data
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Keeps ConversationHandler states and chat_data in the bot DB. Writes are buffered and flushed
+    in batches; chat data is read lazily, one chat at a time. With `shared` set, chat data is
+    re-read before every update, so that several bot processes can share the same store
+    """
+
+    def __init__(self, db_location: str, shared: bool = False):
+        super().__init__(store_user_data=False, store_chat_data=True, store_bot_data=False)
+        self.db_location = db_location
+        self.shared = shared
+        self._lock = threading.RLock()
+        self._conn: typing.Optional[Connection] = None
+        self._chat_data: typing.Optional[_LazyChatData] = None
+        self._conversations: typing.Dict[str, typing.Dict[ConversationKey, typing.Optional[object]]] = {}
+        self._dirty_chat_data: typing.Dict[int, str] = {}
+        self._dirty_conversations: typing.Dict[typing.Tuple[str, str], typing.Optional[int]] = {}
+        self._last_flush = time.monotonic()
+
+    @property
+    def conn(self) -> Connection:
+        if self._conn is None:
+            with QEngNewsDB(self.db_location) as db:
+                db.ensure_schema()
+            self._conn = connect(self.db_location, check_same_thread=False)
+        return self._conn
+
+    # Everything stored is plain JSON, so there are no Bot instances to swap in and out -
+    # which also spares a deep copy of the data on every update
+    def insert_bot(self, obj: typing.Any) -> typing.Any:
+        return obj
+
+    def replace_bot(self, obj: typing.Any) -> typing.Any:
+        return obj
+
+    def _load_chat_data(self, chat_id: int) -> typing.Dict[str, typing.Any]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT DATA FROM BOT_CHAT_DATA WHERE CHAT_ID = ?", (chat_id,),
+            ).fetchone()
+        res = json.loads(row[0]) if row else {}
+        return res
+
+    def get_chat_data(self) -> typing.DefaultDict[int, typing.Dict[str, typing.Any]]:
+        if self._chat_data is None:
+            self._chat_data = _LazyChatData(self._load_chat_data)
+        return self._chat_data
+
+    def get_user_data(self) -> typing.DefaultDict[int, typing.Dict[str, typing.Any]]:
+        return defaultdict(dict)
+
+    def get_bot_data(self) -> typing.Dict[str, typing.Any]:
+        return {}
+
+    def _persisted_conversations(self, name: str) -> typing.Dict[ConversationKey, typing.Optional[object]]:
+        if name not in self._conversations:
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT CONV_KEY, STATE FROM BOT_CONVERSATION WHERE NAME = ?", (name,),
+                ).fetchall()
+            self._conversations[name] = {
+                tuple(json.loads(key)): state
+                for key, state in rows
+            }
+        return self._conversations[name]
+
+    def get_conversations(self, name: str) -> typing.Dict[ConversationKey, typing.Optional[object]]:
+        # The handler keeps the dict it gets as its own, pending promises included,
+        # so it gets a copy and the persisted states stay apart
+        return dict(self._persisted_conversations(name))
+
+    def update_conversation(
+            self, name: str, key: ConversationKey, new_state: typing.Optional[object],
+    ) -> None:
+        # A handler that runs asynchronously is reported as ((old_state, promise), promise):
+        # the old state is kept until the promise resolves to the new one
+        promise = None
+        if isinstance(new_state, tuple):
+            promise = new_state[-1]
+            while isinstance(new_state, tuple):
+                new_state = new_state[0]
+        self._store_conversation(name, key, new_state)
+        # After the old state, since a promise that is already done calls back right away
+        if isinstance(promise, Promise):
+            self._on_resolved(promise, functools.partial(self._resolved_conversation, name, key))
+        return None
+
+    @staticmethod
+    def _on_resolved(promise: Promise, callback: typing.Callable[[typing.Any], None]) -> None:
+        # A promise holds a single done callback, and the handler may have set one for its timeout
+        # noinspection PyProtectedMember
+        previous = promise._done_callback
+        if previous is None or promise.done.is_set():
+            promise.add_done_callback(callback)
+            return None
+
+        def both(result: typing.Any) -> None:
+            callback(result)
+            previous(result)
+
+        promise.add_done_callback(both)
+        return None
+
+    def _resolved_conversation(self, name: str, key: ConversationKey, new_state: typing.Optional[object]) -> None:
+        # None means the state did not change; a handler that failed never gets here
+        if new_state is None:
+            return None
+        if new_state == ConversationHandler.END:
+            new_state = None
+        self._store_conversation(name, key, new_state)
+        return None
+
+    def _store_conversation(self, name: str, key: ConversationKey, new_state: typing.Optional[object]) -> None:
+        state = int(new_state) if new_state is not None else None
+        with self._lock:
+            self._persisted_conversations(name)[key] = state
+            self._dirty_conversations[(name, json.dumps(list(key)))] = state
+        self._maybe_flush()
+        return None
+
+    def update_chat_data(self, chat_id: int, data: typing.Dict[str, typing.Any]) -> None:
+        with self._lock:
+            self._dirty_chat_data[chat_id] = json.dumps(data, default=str)
+        self._maybe_flush()
+        return None
+
+    def refresh_chat_data(self, chat_id: int, chat_data: typing.Dict[str, typing.Any]) -> None:
+        if not self.shared:
+            return None
+        with self._lock:
+            if chat_id in self._dirty_chat_data:
+                return None
+        fresh = self._load_chat_data(chat_id)
+        chat_data.clear()
+        chat_data.update(fresh)
+        return None
+
+    def update_user_data(self, user_id: int, data: typing.Dict[str, typing.Any]) -> None:
+        return None
+
+    def update_bot_data(self, data: typing.Dict[str, typing.Any]) -> None:
+        return None
+
+    def _maybe_flush(self) -> None:
+        n_dirty = len(self._dirty_chat_data) + len(self._dirty_conversations)
+        is_stale = time.monotonic() - self._last_flush > PERSISTENCE_FLUSH_INTERVAL_SECONDS
+        if n_dirty >= PERSISTENCE_FLUSH_BATCH or (n_dirty and is_stale):
+            self.flush()
+        return None
+
+    def flush(self) -> None:
+        with self._lock:
+            chat_data, self._dirty_chat_data = self._dirty_chat_data, {}
+            conversations, self._dirty_conversations = self._dirty_conversations, {}
+            self._last_flush = time.monotonic()
+            if not chat_data and not conversations:
+                return None
+            with self.conn:
+                self.conn.executemany(
+                    """
+                    INSERT INTO BOT_CHAT_DATA (CHAT_ID, DATA) VALUES (?, ?)
+                    ON CONFLICT (CHAT_ID) DO UPDATE SET DATA = excluded.DATA
+                    """,
+                    list(chat_data.items()),
+                )
+                self.conn.executemany(
+                    """
+                    INSERT INTO BOT_CONVERSATION (NAME, CONV_KEY, STATE) VALUES (?, ?, ?)
+                    ON CONFLICT (NAME, CONV_KEY) DO UPDATE SET STATE = excluded.STATE
+                    """,
+                    [(name, key, state) for (name, key), state in conversations.items()],
+                )
+        return None
@@ -0,0 +1,134 @@
+"""
+Opt-in profiler for the queries issued through QEngNewsDB.query
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+import typing
+from dataclasses import dataclass, field
+
+__all__ = [
+    "QueryStats", "QueryProfiler",
+    "normalize_query", "params_shape",
+    "REPORT_SORT_KEYS",
+]
+
+_whitespace = re.compile(r"\s+")
+_string_literal = re.compile(r"'(?:[^']|'')*'")
+_number_literal = re.compile(r"\b\d+(?:\.\d+)?\b")
+_in_list = re.compile(r"\bIN\s*\((?:\s*\?\s*,?)+\)", re.IGNORECASE)
+
+REPORT_SORT_KEYS = ("total_time", "max_time", "n_calls", "n_rows")
+
+
+def normalize_query(query_text: str) -> str:
+    res = _string_literal.sub("?", query_text)
+    res = _number_literal.sub("?", res)
+    res = _whitespace.sub(" ", res).strip()
+    res = _in_list.sub("IN (...)", res)
+    return res
+
+
+def params_shape(params: typing.Any) -> str:
+    if params is None:
+        return "-"
+    if isinstance(params, dict):
+        return "{" + ", ".join(sorted(params)) + "}"
+    # noinspection PyBroadException
+    try:
+        return f"[{len(params)}]"
+    except Exception:
+        return type(params).__name__
+
+
+@dataclass
+class QueryStats:
+    normalized_text: str
+    params_shape: str
+    n_calls: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+    n_rows: int = 0
+    n_slow: int = 0
+    plan: typing.Optional[str] = None
+
+    @property
+    def mean_time(self) -> float:
+        return self.total_time / self.n_calls if self.n_calls else 0.0
+
+    def to_str(self, max_query_length: int = 200) -> str:
+        txt = self.normalized_text
+        if len(txt) > max_query_length:
+            txt = txt[:max_query_length] + "..."
+        pts = [
+            f"{self.total_time * 1000:.1f}ms total, {self.n_calls} call(s), "
+            f"{self.mean_time * 1000:.1f}ms mean, {self.max_time * 1000:.1f}ms max, "
+            f"{self.n_rows} row(s), {self.n_slow} slow",
+            f"params: {self.params_shape}",
+            txt,
+        ]
+        if self.plan:
+            pts.append(f"plan:\n{self.plan}")
+        res = "\n".join(pts)
+        return res
+
+
+@dataclass
+class QueryProfiler:
+    slow_threshold_seconds: float
+    stats: typing.Dict[typing.Tuple[str, str], QueryStats] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(
+            self,
+            query_text: str,
+            params: typing.Any,
+            duration: float,
+            n_rows: int,
+    ) -> QueryStats:
+        key = (normalize_query(query_text), params_shape(params))
+        with self._lock:
+            st = self.stats.get(key)
+            if st is None:
+                st = QueryStats(*key)
+                self.stats[key] = st
+            st.n_calls += 1
+            st.total_time += duration
+            st.max_time = max(st.max_time, duration)
+            st.n_rows += max(n_rows, 0)
+            if duration >= self.slow_threshold_seconds:
+                st.n_slow += 1
+        return st
+
+    def is_slow(self, duration: float) -> bool:
+        return duration >= self.slow_threshold_seconds
+
+    @staticmethod
+    def needs_plan(stats: QueryStats) -> bool:
+        if stats.plan is not None:
+            return False
+        first_word = stats.normalized_text.split(" ", 1)[0].upper()
+        return first_word in {"SELECT", "WITH"}
+
+    def top(self, n: int, sort_key: str = "total_time") -> typing.List[QueryStats]:
+        assert sort_key in REPORT_SORT_KEYS, f"Unknown sort key: {sort_key}"
+        with self._lock:
+            stats = list(self.stats.values())
+        res = sorted(stats, key=lambda s: getattr(s, sort_key), reverse=True)[:n]
+        return res
+
+    def report(self, n: int, sort_key: str = "total_time") -> str:
+        top = self.top(n, sort_key)
+        pts = [
+            f"#{i + 1}: {st.to_str()}"
+            for i, st in enumerate(top)
+        ]
+        res = "\n\n".join(pts)
+        return res
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stats.clear()
+        return None
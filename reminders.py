@@ -0,0 +1,282 @@
+"""
+Reminders sent shortly before the subscribed games start, scheduled on a min-heap
+"""
+
+from __future__ import annotations
+
+import calendar
+import datetime
+import heapq
+import html
+import itertools
+import math
+import threading
+import time
+import typing
+from dataclasses import dataclass, field
+
+from db_executor import DBExecutor
+from entities import Domain
+from meta_constants import REMINDER_LEAD_SECONDS, REMINDER_HORIZON_SECONDS, REMINDER_RETENTION_SECONDS, \
+    REMINDER_RETRY_SECONDS
+from metrics import METRICS
+from translations import Language, MenuItem, MENU_LOCALIZATION
+
+if typing.TYPE_CHECKING:
+    from db_api import QEngNewsDB
+
+__all__ = [
+    "Reminder", "ReminderScheduler",
+]
+
+REMINDERS_PROCESSED = METRICS.counter("qeng_reminders_total", "Game reminders by outcome")
+
+ReminderKey = typing.Tuple[int, str, int]
+
+
+@dataclass(frozen=True)
+class Reminder:
+    user_id: int
+    domain: str
+    game_id: int
+    game_name: str
+    # UTC, like everything in DOMAIN_GAMES
+    start_time: datetime.datetime
+    language: Language
+
+    @classmethod
+    def from_row(cls, row: typing.Tuple) -> Reminder:
+        user_id, domain, game_id, game_name, start_time, language = row
+        res = cls(
+            int(user_id), domain, int(game_id), game_name or "",
+            datetime.datetime.fromisoformat(str(start_time)), Language(language),
+        )
+        return res
+
+    @property
+    def key(self) -> ReminderKey:
+        return self.user_id, self.domain, self.game_id
+
+    @property
+    def start_ts(self) -> float:
+        return calendar.timegm(self.start_time.timetuple())
+
+    def to_str(self, now: float) -> str:
+        domain = Domain.from_url(self.domain)
+        # noinspection PyProtectedMember
+        url = domain.upper_level_domain.game_class._game_details_full_url(domain, self.game_id)
+        game = f"<a href='{url}' target='_blank'>{html.escape(self.game_name or str(self.game_id))}</a>"
+        minutes = max(1, math.ceil((self.start_ts - now) / 60))
+        res = MENU_LOCALIZATION[MenuItem.GameReminder][self.language].format(
+            minutes=minutes, game=game, domain=domain.pretty_name,
+        )
+        return res
+
+
+@dataclass
+class ReminderScheduler:
+    """
+    Upcoming reminders are kept on a min-heap by the time they are due: scheduling one costs O(log n),
+    and the sending thread sleeps until exactly the earliest one. A reminder whose game moved is pushed
+    again, and its old heap entry is dropped once it surfaces.
+    The heap holds what is due within the horizon. It is reloaded for a domain once the domain was polled,
+    in full once the rules changed or half of the horizon passed, and never by scanning start times on a timer.
+    Sending is claimed in REMINDER_STATUS first, so that no reminder goes out twice, whatever the number
+    of processes and restarts. A reminder that failed to send is released and tried again a bit later
+    """
+    executor: DBExecutor
+    send: typing.Callable[[Reminder], None]
+    lead_seconds: float = REMINDER_LEAD_SECONDS
+    horizon_seconds: float = REMINDER_HORIZON_SECONDS
+    # (due at, tie breaker, reminder); an entry is stale once its reminder is no longer the scheduled one
+    _heap: typing.List[typing.Tuple[float, int, Reminder]] = field(init=False, repr=False, default_factory=list)
+    _scheduled: typing.Dict[ReminderKey, Reminder] = field(init=False, repr=False, default_factory=dict)
+    # Keys of _scheduled by domain, so that syncing a domain never goes through the other ones
+    _by_domain: typing.Dict[str, typing.Set[ReminderKey]] = field(init=False, repr=False, default_factory=dict)
+    _seq: typing.Iterator[int] = field(init=False, repr=False, default_factory=itertools.count)
+    _cond: threading.Condition = field(init=False, repr=False, default_factory=threading.Condition)
+    _thread: typing.Optional[threading.Thread] = field(init=False, repr=False, default=None)
+    _is_stopped: bool = field(init=False, repr=False, default=False)
+    # What the heap was loaded from, and up to when reminders are loaded
+    _domain_versions: typing.Dict[str, str] = field(init=False, repr=False, default_factory=dict)
+    _rules_version: typing.Optional[str] = field(init=False, repr=False, default=None)
+    _loaded_until: float = field(init=False, repr=False, default=0.0)
+
+    def due_at(self, reminder: Reminder) -> float:
+        return reminder.start_ts - self.lead_seconds
+
+    def __len__(self) -> int:
+        return len(self._scheduled)
+
+    def schedule(self, reminder: Reminder, at: typing.Optional[float] = None) -> None:
+        """
+        Adds the reminder, or moves it if its game moved. It is due at its lead time, unless told otherwise
+        """
+        with self._cond:
+            self._scheduled[reminder.key] = reminder
+            self._by_domain.setdefault(reminder.domain, set()).add(reminder.key)
+            entry = (self.due_at(reminder) if at is None else at, next(self._seq), reminder)
+            heapq.heappush(self._heap, entry)
+            self._compact()
+            if self._heap[0] is entry:
+                self._cond.notify()
+        return None
+
+    def cancel(self, key: ReminderKey) -> None:
+        with self._cond:
+            self._forget(key)
+            self._compact()
+        return None
+
+    def _forget(self, key: ReminderKey) -> None:
+        self._scheduled.pop(key, None)
+        domain_keys = self._by_domain.get(key[1])
+        if domain_keys is not None:
+            domain_keys.discard(key)
+            if not domain_keys:
+                del self._by_domain[key[1]]
+        return None
+
+    def _compact(self) -> None:
+        # Stale entries are only dropped as they surface; rebuild the heap before they outnumber the live ones
+        if len(self._heap) > 2 * len(self._scheduled) + 64:
+            self._heap = [entry for entry in self._heap if self._scheduled.get(entry[2].key) is entry[2]]
+            heapq.heapify(self._heap)
+        return None
+
+    def _sync(self, reminders: typing.List[Reminder], domains: typing.Optional[typing.Collection[str]]) -> None:
+        """
+        Makes the reminders the scheduled ones of the domains, or of all of them
+        """
+        new_keys = {reminder.key for reminder in reminders}
+        with self._cond:
+            if domains is None:
+                domains = list(self._by_domain)
+            gone = [
+                key
+                for domain in domains
+                for key in self._by_domain.get(domain, ())
+                if key not in new_keys
+            ]
+            for key in gone:
+                self.cancel(key)
+            for reminder in reminders:
+                if self._scheduled.get(reminder.key) != reminder:
+                    self.schedule(reminder)
+        return None
+
+    def refresh(self, db: QEngNewsDB) -> typing.Optional[typing.List[str]]:
+        """
+        Reloads what changed since the last refresh. Returns the domains reloaded, None if all of them were
+        """
+        now = time.time()
+        rules_version = db.get_rules_version()
+        versions = db.get_domain_versions()
+        is_full = rules_version != self._rules_version or now + self.horizon_seconds / 2 > self._loaded_until
+        if is_full:
+            domains = None
+            loaded_until = now + self.horizon_seconds
+        else:
+            domains = [
+                domain
+                for domain in set(versions).union(self._domain_versions)
+                if versions.get(domain) != self._domain_versions.get(domain)
+            ]
+            if not domains:
+                return []
+            # Same window as the rest of the heap
+            loaded_until = self._loaded_until
+
+        rows = db.upcoming_reminders(
+            datetime.datetime.utcfromtimestamp(now),
+            datetime.datetime.utcfromtimestamp(loaded_until + self.lead_seconds),
+            domains,
+        )
+        self._sync([Reminder.from_row(row) for row in rows], domains)
+        if is_full:
+            db.prune_reminder_status(datetime.datetime.utcfromtimestamp(now - REMINDER_RETENTION_SECONDS))
+        self._rules_version = rules_version
+        self._domain_versions = versions
+        self._loaded_until = loaded_until
+        return domains
+
+    def _pop_due(self, now: float) -> typing.List[Reminder]:
+        res = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, reminder = heapq.heappop(self._heap)
+            if self._scheduled.get(reminder.key) is reminder:
+                self._forget(reminder.key)
+                res.append(reminder)
+        return res
+
+    def _timeout(self) -> typing.Optional[float]:
+        if not self._heap:
+            return None
+        return max(self._heap[0][0] - time.time(), 0)
+
+    def _fire(self, reminder: Reminder) -> None:
+        now = time.time()
+        if reminder.start_ts <= now:
+            REMINDERS_PROCESSED.inc(status="late")
+            return None
+        claimed = self.executor.run(
+            lambda db: db.claim_reminder(reminder.user_id, reminder.domain, reminder.game_id, reminder.start_time),
+        )
+        if not claimed:
+            REMINDERS_PROCESSED.inc(status="skipped")
+            return None
+        # noinspection PyBroadException
+        try:
+            self.send(reminder)
+        except Exception as e:
+            print("ERROR", reminder, e, sep="\n")
+            REMINDERS_PROCESSED.inc(status="failed")
+            self._retry(reminder)
+            return None
+        REMINDERS_PROCESSED.inc(status="delivered")
+        return None
+
+    def _retry(self, reminder: Reminder) -> None:
+        # noinspection PyBroadException
+        try:
+            self.executor.run(
+                lambda db: db.release_reminder(reminder.user_id, reminder.domain, reminder.game_id, reminder.start_time),
+            )
+        except Exception as e:
+            # Still claimed, so it would never be sent again
+            print("ERROR", reminder, e, sep="\n")
+            return None
+        # Unless a refresh has scheduled it anew meanwhile
+        with self._cond:
+            if reminder.key not in self._scheduled:
+                self.schedule(reminder, at=time.time() + REMINDER_RETRY_SECONDS)
+        return None
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                due = self._pop_due(time.time())
+                while not due and not self._is_stopped:
+                    self._cond.wait(self._timeout())
+                    due = self._pop_due(time.time())
+                if self._is_stopped:
+                    return None
+            for reminder in due:
+                self._fire(reminder)
+
+    def start(self) -> None:
+        with self._cond:
+            self._is_stopped = False
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="reminders", daemon=True)
+                self._thread.start()
+        return None
+
+    def stop(self) -> None:
+        with self._cond:
+            self._is_stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return None
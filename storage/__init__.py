@@ -0,0 +1,9 @@
+from storage.base import UserStore, UserPreferences
+from storage.sqlite import SQLiteUserStore
+from storage.memory import InMemoryUserStore
+
+__all__ = [
+    "UserStore", "UserPreferences",
+    "SQLiteUserStore",
+    "InMemoryUserStore",
+]
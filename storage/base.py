@@ -0,0 +1,150 @@
+"""
+Storage interface for per-user data: preferences, rules and tracked domains
+"""
+
+from __future__ import annotations
+
+import abc
+import typing
+from dataclasses import dataclass
+
+from entities import Rule
+from translations import Language
+from description_diff import DiffMode
+
+__all__ = [
+    "UserStore", "UserPreferences",
+]
+
+
+@dataclass
+class UserPreferences:
+    """
+    A change of a user's preferences; None means "leave as is"
+    """
+    tg_id: int
+    language: typing.Optional[Language] = None
+    is_stopped: typing.Optional[bool] = None
+    is_digest: typing.Optional[bool] = None
+    diff_mode: typing.Optional[DiffMode] = None
+
+
+class UserStore(abc.ABC):
+    """
+    Everything QEngNewsDB needs to know about users, independent of the storage engine.
+    Getters return None (or an empty collection) for unknown users; caching is up to the caller
+    """
+
+    @abc.abstractmethod
+    def get_language(self, tg_id: int) -> typing.Optional[Language]:
+        pass
+
+    @abc.abstractmethod
+    def set_language(self, tg_id: int, language: Language) -> None:
+        pass
+
+    @abc.abstractmethod
+    def is_stopped(self, tg_id: int) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def set_stopped(self, tg_id: int, is_stopped: bool) -> None:
+        pass
+
+    @abc.abstractmethod
+    def get_digest(self, tg_id: int) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def set_digest(self, tg_id: int, is_digest: bool) -> None:
+        pass
+
+    @abc.abstractmethod
+    def get_diff_mode(self, tg_id: int) -> typing.Optional[DiffMode]:
+        """
+        None if the user hasn't chosen one, and gets the global default
+        """
+        pass
+
+    @abc.abstractmethod
+    def set_diff_mode(self, tg_id: int, diff_mode: DiffMode) -> None:
+        pass
+
+    def set_preferences(self, prefs: typing.Iterable[UserPreferences]) -> None:
+        """
+        Applies many changes at once; engines with transactions apply them in a single one
+        """
+        for p in prefs:
+            if p.language is not None:
+                self.set_language(p.tg_id, p.language)
+            if p.is_stopped is not None:
+                self.set_stopped(p.tg_id, p.is_stopped)
+            if p.is_digest is not None:
+                self.set_digest(p.tg_id, p.is_digest)
+            if p.diff_mode is not None:
+                self.set_diff_mode(p.tg_id, p.diff_mode)
+        return None
+
+    @abc.abstractmethod
+    def add_rule(self, tg_id: int, rule: Rule) -> bool:
+        """
+        Subscribes the user to the rule; returns False if they already were
+        """
+        pass
+
+    def add_rules(self, tg_id: int, rules: typing.List[Rule]) -> typing.List[bool]:
+        """
+        Subscribes the user to all the rules at once; engines with transactions use a single one
+        """
+        return [self.add_rule(tg_id, rule) for rule in rules]
+
+    @abc.abstractmethod
+    def delete_rule(self, tg_id: int, rule_id: str) -> None:
+        pass
+
+    def delete_rules(self, tg_id: int, rule_ids: typing.List[str]) -> None:
+        for rule_id in rule_ids:
+            self.delete_rule(tg_id, rule_id)
+        return None
+
+    @abc.abstractmethod
+    def get_rules(self, tg_id: int) -> typing.List[Rule]:
+        """
+        User's rules, oldest first
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_rule(self, tg_id: int, rule_id: str) -> typing.Optional[Rule]:
+        pass
+
+    @abc.abstractmethod
+    def count_rules(self, tg_id: int) -> int:
+        pass
+
+    @abc.abstractmethod
+    def get_domains(self, tg_id: int) -> typing.List[str]:
+        """
+        Distinct domains of the user's rules, sorted
+        """
+        pass
+
+    @abc.abstractmethod
+    def is_domain_tracked(self, domain_url: str) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def track_domain(self, domain_url: str, needs_warmup: bool = False) -> bool:
+        """
+        Starts polling the domain; returns False if it already was polled.
+        A domain that needs a warm-up is not polled until its games are loaded
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_domains_to_warm_up(self) -> typing.List[str]:
+        pass
+
+    @abc.abstractmethod
+    def mark_domain_warmed_up(self, domain_url: str) -> None:
+        pass
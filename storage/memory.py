@@ -0,0 +1,124 @@
+"""
+In-memory user storage, for benchmarks and experiments
+"""
+
+from __future__ import annotations
+
+import threading
+import typing
+from dataclasses import dataclass, field
+
+from entities import Rule
+from translations import Language
+from description_diff import DiffMode
+from storage.base import UserStore
+
+__all__ = [
+    "InMemoryUserStore",
+]
+
+
+@dataclass
+class InMemoryUserStore(UserStore):
+    languages: typing.Dict[int, Language] = field(default_factory=dict)
+    stopped: typing.Set[int] = field(default_factory=set)
+    digest: typing.Set[int] = field(default_factory=set)
+    diff_modes: typing.Dict[int, DiffMode] = field(default_factory=dict)
+    rules: typing.Dict[str, Rule] = field(default_factory=dict)
+    # Insertion-ordered, so that rules come out oldest first
+    subscriptions: typing.Dict[int, typing.Dict[str, None]] = field(default_factory=dict)
+    tracked_domains: typing.Set[str] = field(default_factory=set)
+    domains_to_warm_up: typing.Set[str] = field(default_factory=set)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def get_language(self, tg_id: int) -> typing.Optional[Language]:
+        return self.languages.get(tg_id)
+
+    def set_language(self, tg_id: int, language: Language) -> None:
+        self.languages[tg_id] = language
+        return None
+
+    def is_stopped(self, tg_id: int) -> bool:
+        return tg_id in self.stopped
+
+    def set_stopped(self, tg_id: int, is_stopped: bool) -> None:
+        with self._lock:
+            if is_stopped:
+                self.stopped.add(tg_id)
+            else:
+                self.stopped.discard(tg_id)
+        return None
+
+    def get_digest(self, tg_id: int) -> bool:
+        return tg_id in self.digest
+
+    def set_digest(self, tg_id: int, is_digest: bool) -> None:
+        with self._lock:
+            if is_digest:
+                self.digest.add(tg_id)
+            else:
+                self.digest.discard(tg_id)
+        return None
+
+    def get_diff_mode(self, tg_id: int) -> typing.Optional[DiffMode]:
+        return self.diff_modes.get(tg_id)
+
+    def set_diff_mode(self, tg_id: int, diff_mode: DiffMode) -> None:
+        self.diff_modes[tg_id] = diff_mode
+        return None
+
+    def add_rule(self, tg_id: int, rule: Rule) -> bool:
+        rule_id = rule.rule_id
+        with self._lock:
+            self.rules.setdefault(rule_id, rule)
+            user_rules = self.subscriptions.setdefault(tg_id, {})
+            if rule_id in user_rules:
+                return False
+            user_rules[rule_id] = None
+        return True
+
+    def delete_rule(self, tg_id: int, rule_id: str) -> None:
+        with self._lock:
+            self.subscriptions.get(tg_id, {}).pop(rule_id, None)
+        return None
+
+    def get_rules(self, tg_id: int) -> typing.List[Rule]:
+        with self._lock:
+            rule_ids = list(self.subscriptions.get(tg_id, {}))
+        res = [self.rules[rule_id] for rule_id in rule_ids]
+        return res
+
+    def get_rule(self, tg_id: int, rule_id: str) -> typing.Optional[Rule]:
+        if rule_id not in self.subscriptions.get(tg_id, {}):
+            return None
+        return self.rules[rule_id]
+
+    def count_rules(self, tg_id: int) -> int:
+        return len(self.subscriptions.get(tg_id, {}))
+
+    def get_domains(self, tg_id: int) -> typing.List[str]:
+        domains = {
+            rule.to_json()["DOMAIN"]
+            for rule in self.get_rules(tg_id)
+        }
+        return sorted(domains)
+
+    def is_domain_tracked(self, domain_url: str) -> bool:
+        return domain_url in self.tracked_domains
+
+    def track_domain(self, domain_url: str, needs_warmup: bool = False) -> bool:
+        with self._lock:
+            if domain_url in self.tracked_domains:
+                return False
+            self.tracked_domains.add(domain_url)
+            if needs_warmup:
+                self.domains_to_warm_up.add(domain_url)
+        return True
+
+    def get_domains_to_warm_up(self) -> typing.List[str]:
+        return sorted(self.domains_to_warm_up & self.tracked_domains)
+
+    def mark_domain_warmed_up(self, domain_url: str) -> None:
+        with self._lock:
+            self.domains_to_warm_up.discard(domain_url)
+        return None
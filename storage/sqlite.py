@@ -0,0 +1,280 @@
+"""
+SQLite user storage, in the bot DB
+"""
+
+from __future__ import annotations
+
+import datetime
+import typing
+from dataclasses import dataclass
+
+from entities import Rule
+from translations import Language
+from description_diff import DiffMode
+from storage.base import UserStore, UserPreferences
+
+if typing.TYPE_CHECKING:
+    from db_api import QEngNewsDB
+
+__all__ = [
+    "SQLiteUserStore",
+]
+
+# Kept constant, so that sqlite3 reuses the prepared statements from its cache
+UPSERT_LANGUAGE = """
+INSERT INTO USER_LANGUAGE (USER_ID, LANGUAGE) VALUES (?, ?)
+ON CONFLICT (USER_ID) DO UPDATE SET LANGUAGE = excluded.LANGUAGE
+"""
+UPSERT_STOP = """
+INSERT INTO USER_STOP (USER_ID, IS_STOPPED) VALUES (?, 1)
+ON CONFLICT (USER_ID) DO UPDATE SET IS_STOPPED = 1
+"""
+DELETE_STOP = "DELETE FROM USER_STOP WHERE USER_ID = ?"
+UPSERT_DIGEST = """
+INSERT INTO USER_DIGEST (USER_ID, IS_DIGEST) VALUES (?, ?)
+ON CONFLICT (USER_ID) DO UPDATE SET IS_DIGEST = excluded.IS_DIGEST
+"""
+UPSERT_DIFF_MODE = """
+INSERT INTO USER_DIFF_MODE (USER_ID, DIFF_MODE) VALUES (?, ?)
+ON CONFLICT (USER_ID) DO UPDATE SET DIFF_MODE = excluded.DIFF_MODE
+"""
+INSERT_RULE = """
+INSERT INTO RULE_DESCRIPTION (RULE_ID, DOMAIN, PLAYER_ID, TEAM_ID, GAME_ID, AUTHOR_ID, GAME_IGNORE_ID)
+VALUES (:RULE_ID, :DOMAIN, :PLAYER_ID, :TEAM_ID, :GAME_ID, :AUTHOR_ID, :GAME_IGNORE_ID)
+ON CONFLICT (RULE_ID) DO NOTHING
+"""
+INSERT_SUBSCRIPTION = """
+INSERT INTO USER_SUBSCRIPTION (USER_ID, RULE_ID, RULE_ADDED_DATE) VALUES (:USER_ID, :RULE_ID, :RULE_ADDED_DATE)
+ON CONFLICT (USER_ID, RULE_ID) DO NOTHING
+"""
+DELETE_SUBSCRIPTION = "DELETE FROM USER_SUBSCRIPTION WHERE USER_ID = ? AND RULE_ID = ?"
+INSERT_TRACKED_DOMAIN = """
+INSERT INTO DOMAIN_QUERY_STATUS (DOMAIN, LAST_QUERY_TIME) VALUES (?, ?)
+ON CONFLICT (DOMAIN) DO NOTHING
+"""
+INSERT_WARMUP = """
+INSERT INTO DOMAIN_WARMUP (DOMAIN, REQUESTED_AT) VALUES (?, ?)
+ON CONFLICT (DOMAIN) DO NOTHING
+"""
+
+
+@dataclass
+class SQLiteUserStore(UserStore):
+    db: QEngNewsDB
+
+    def get_language(self, tg_id: int) -> typing.Optional[Language]:
+        query = "SELECT LANGUAGE FROM USER_LANGUAGE WHERE USER_ID = :user_id"
+        res = self.db.query(query, {"user_id": tg_id})
+        if res.empty:
+            return None
+        return Language(res["LANGUAGE"].iloc[0])
+
+    def set_language(self, tg_id: int, language: Language) -> None:
+        self.db.query(UPSERT_LANGUAGE, (tg_id, language.value), safe=True)
+        return None
+
+    def is_stopped(self, tg_id: int) -> bool:
+        query = """
+            SELECT IS_STOPPED
+            FROM USER_STOP
+            WHERE 1=1
+            AND USER_ID = :tg_id
+        """
+        res = self.db.query(query, {"tg_id": tg_id})
+        if res.empty:
+            return False
+        return bool(res.iloc[0]["IS_STOPPED"])
+
+    def set_stopped(self, tg_id: int, is_stopped: bool) -> None:
+        if is_stopped:
+            self.db.query(UPSERT_STOP, (tg_id,), safe=True)
+        else:
+            self.db.query(DELETE_STOP, (tg_id,), safe=True)
+        return None
+
+    def get_digest(self, tg_id: int) -> bool:
+        query = """
+            SELECT IS_DIGEST
+            FROM USER_DIGEST
+            WHERE 1=1
+            AND USER_ID = :tg_id
+        """
+        res = self.db.query(query, {"tg_id": tg_id})
+        if res.empty:
+            return False
+        return bool(res.iloc[0]["IS_DIGEST"])
+
+    def set_digest(self, tg_id: int, is_digest: bool) -> None:
+        self.db.query(UPSERT_DIGEST, (tg_id, int(is_digest)), safe=True)
+        return None
+
+    def get_diff_mode(self, tg_id: int) -> typing.Optional[DiffMode]:
+        query = "SELECT DIFF_MODE FROM USER_DIFF_MODE WHERE USER_ID = :tg_id"
+        res = self.db.query(query, {"tg_id": tg_id})
+        if res.empty:
+            return None
+        return DiffMode(res["DIFF_MODE"].iloc[0])
+
+    def set_diff_mode(self, tg_id: int, diff_mode: DiffMode) -> None:
+        self.db.query(UPSERT_DIFF_MODE, (tg_id, diff_mode.value), safe=True)
+        return None
+
+    def set_preferences(self, prefs: typing.Iterable[UserPreferences]) -> None:
+        prefs = list(prefs)
+        languages = [(p.tg_id, p.language.value) for p in prefs if p.language is not None]
+        stops = [(p.tg_id,) for p in prefs if p.is_stopped is True]
+        resumes = [(p.tg_id,) for p in prefs if p.is_stopped is False]
+        digests = [(p.tg_id, int(p.is_digest)) for p in prefs if p.is_digest is not None]
+        diff_modes = [(p.tg_id, p.diff_mode.value) for p in prefs if p.diff_mode is not None]
+        with self.db.transaction():
+            self.db.execute_many(UPSERT_LANGUAGE, languages)
+            self.db.execute_many(UPSERT_STOP, stops)
+            self.db.execute_many(DELETE_STOP, resumes)
+            self.db.execute_many(UPSERT_DIGEST, digests)
+            self.db.execute_many(UPSERT_DIFF_MODE, diff_modes)
+        return None
+
+    def add_rule(self, tg_id: int, rule: Rule) -> bool:
+        rule_json = rule.to_json()
+        self.db.query(INSERT_RULE, rule_json, safe=True)
+        cur = self.db.query(INSERT_SUBSCRIPTION, {
+            "USER_ID": tg_id,
+            "RULE_ID": rule_json["RULE_ID"],
+            "RULE_ADDED_DATE": datetime.datetime.utcnow().isoformat(sep=" "),
+        }, safe=True)
+        return cur.rowcount == 1
+
+    def add_rules(self, tg_id: int, rules: typing.List[Rule]) -> typing.List[bool]:
+        added_date = datetime.datetime.utcnow().isoformat(sep=" ")
+        res = []
+        with self.db.transaction():
+            self.db.execute_many(INSERT_RULE, [rule.to_json() for rule in rules])
+            for rule in rules:
+                cur = self.db.query(INSERT_SUBSCRIPTION, {
+                    "USER_ID": tg_id,
+                    "RULE_ID": rule.rule_id,
+                    "RULE_ADDED_DATE": added_date,
+                }, safe=True)
+                res.append(cur.rowcount == 1)
+        return res
+
+    def delete_rule(self, tg_id: int, rule_id: str) -> None:
+        self.db.query(DELETE_SUBSCRIPTION, (tg_id, rule_id), safe=True)
+        return None
+
+    def delete_rules(self, tg_id: int, rule_ids: typing.List[str]) -> None:
+        with self.db.transaction():
+            self.db.execute_many(DELETE_SUBSCRIPTION, [(tg_id, rule_id) for rule_id in rule_ids])
+        return None
+
+    def get_rules(self, tg_id: int) -> typing.List[Rule]:
+        res = self.db.query(
+            """
+            SELECT
+            rd.*
+            FROM USER_SUBSCRIPTION as us
+            INNER JOIN RULE_DESCRIPTION as rd
+            ON (us.RULE_ID = rd.RULE_ID)
+            WHERE USER_ID = :tg_id
+            ORDER BY us.RULE_ADDED_DATE
+            """,
+            {"tg_id": tg_id}
+        )
+        rules = []
+        for _, row in res.iterrows():
+            # noinspection PyTypeChecker
+            rule = Rule.from_json(row.to_dict())
+            rules.append(rule)
+
+        return rules
+
+    def get_rule(self, tg_id: int, rule_id: str) -> typing.Optional[Rule]:
+        query = """
+        SELECT *
+        FROM USER_SUBSCRIPTION
+        INNER JOIN RULE_DESCRIPTION
+        USING (RULE_ID)
+        WHERE 1=1
+        AND USER_ID = :user_id
+        AND RULE_ID = :rule_id
+        """
+        rule_df = self.db.query(
+            query, {
+                "user_id": tg_id,
+                "rule_id": rule_id,
+            },
+            raise_on_error=False
+        )
+        if rule_df is None or rule_df.empty or "Exception_text" in rule_df.columns:
+            return None
+        return Rule.from_json(rule_df.iloc[0].to_dict())
+
+    def count_rules(self, tg_id: int) -> int:
+        query = """
+        SELECT COUNT(*) as N_RULES
+        FROM USER_SUBSCRIPTION
+        WHERE 1=1
+        AND USER_ID = :user_id
+        """
+        cnt_rules = self.db.query(query, {"user_id": tg_id})
+        return int(cnt_rules["N_RULES"].iloc[0])
+
+    def get_domains(self, tg_id: int) -> typing.List[str]:
+        res = self.db.query(
+            """
+            SELECT
+            DOMAIN
+            FROM USER_SUBSCRIPTION as us
+            INNER JOIN RULE_DESCRIPTION as rd
+            ON (us.RULE_ID = rd.RULE_ID)
+            WHERE USER_ID = :tg_id
+            GROUP BY 1
+            """,
+            {"tg_id": tg_id}
+        )
+        return res["DOMAIN"].tolist()
+
+    def is_domain_tracked(self, domain_url: str) -> bool:
+        res = self.db.query(
+            """
+            SELECT DOMAIN
+            FROM DOMAIN_QUERY_STATUS
+            WHERE 1=1
+            AND DOMAIN = :domain
+            """,
+            {"domain": domain_url}
+        )
+
+        if res is None or res.empty:
+            return False
+
+        return True
+
+    def track_domain(self, domain_url: str, needs_warmup: bool = False) -> bool:
+        now = datetime.datetime.utcnow().replace(microsecond=0).isoformat(sep=" ")
+        cur = self.db.query(INSERT_TRACKED_DOMAIN, (domain_url, now), safe=True)
+        is_new = cur.rowcount == 1
+        if is_new and needs_warmup:
+            self.db.query(INSERT_WARMUP, (domain_url, now), safe=True)
+        return is_new
+
+    def get_domains_to_warm_up(self) -> typing.List[str]:
+        res = self.db.query(
+            """
+            SELECT
+            w.DOMAIN
+            FROM DOMAIN_WARMUP as w
+            INNER JOIN DOMAIN_QUERY_STATUS as dqs
+            ON (w.DOMAIN = dqs.DOMAIN)
+            ORDER BY w.REQUESTED_AT
+            """
+        )
+        return res["DOMAIN"].tolist()
+
+    def mark_domain_warmed_up(self, domain_url: str) -> None:
+        self.db.query("DELETE FROM DOMAIN_WARMUP WHERE DOMAIN = ?", (domain_url,), safe=True)
+        self.db.query(
+            "UPDATE DOMAIN_QUERY_STATUS SET LAST_QUERY_TIME = CURRENT_TIMESTAMP WHERE DOMAIN = ?",
+            (domain_url,), safe=True,
+        )
+        return None
@@ -0,0 +1,9 @@
+import os
+import sys
+
+cur_dir = os.path.dirname(__file__)
+root_dir = os.path.abspath(os.path.join(cur_dir, ".."))
+if root_dir not in sys.path:
+    sys.path.append(root_dir)
+
+os.environ.setdefault("API_KEY", "test")
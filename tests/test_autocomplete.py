@@ -0,0 +1,48 @@
+"""
+Users' domains and languages kept by the autocomplete index, so that inline queries never read the DB
+"""
+
+import pytest
+
+from autocomplete import AutocompleteIndex
+from db_api import QEngNewsDB
+from translations import Language
+
+USER_ID = 42
+DOMAIN = "http://demo.en.cx"
+
+
+@pytest.fixture
+def db(tmp_path) -> QEngNewsDB:
+    with QEngNewsDB(str(tmp_path / "bot_db.sqlite")) as db:
+        yield db
+
+
+def _subscribe(db: QEngNewsDB, user_id: int, rule_id: str, domain: str) -> None:
+    db.query(
+        "INSERT INTO USER_SUBSCRIPTION (USER_ID, RULE_ID, RULE_ADDED_DATE) VALUES (?, ?, CURRENT_TIMESTAMP)",
+        (user_id, rule_id), safe=True,
+    )
+    db.query("INSERT INTO RULE_DESCRIPTION (RULE_ID, DOMAIN) VALUES (?, ?)", (rule_id, domain), safe=True)
+    db.commit()
+    return None
+
+
+def test_users_reloaded_once_rules_changed(db):
+    index = AutocompleteIndex()
+    index.refresh(db)
+    assert index.user_domains(USER_ID) == []
+    assert index.user_language(USER_ID) is Language.English
+
+    db.set_user_language(USER_ID, Language.Russian)
+    _subscribe(db, USER_ID, "r1", DOMAIN)
+    index.refresh(db)
+    assert index.user_domains(USER_ID) == [DOMAIN]
+    assert index.user_language(USER_ID) is Language.Russian
+
+
+def test_user_language_written_through(db):
+    index = AutocompleteIndex()
+    index.refresh(db)
+    index.set_user_language(USER_ID, Language.Ukrainian)
+    assert index.user_language(USER_ID) is Language.Ukrainian
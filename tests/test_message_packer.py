@@ -0,0 +1,114 @@
+"""
+Packing of game lists into Telegram messages, and splitting of long HTML messages
+"""
+
+import random
+import re
+
+from message_packer import pack_messages, split_html_safe, _safe_boundaries
+from meta_constants import GAME_JOINER, MAX_MESSAGE_LENGTH_TELEGRAM
+
+TAG = re.compile(r"<(/?)([a-zA-Z][a-zA-Z0-9]*)[^>]*?(/?)>")
+ENTITY = re.compile(r"&(?:[a-zA-Z][a-zA-Z0-9]*|#[0-9]+|#[xX][0-9a-fA-F]+);")
+
+
+def _game(rnd: random.Random, i: int) -> str:
+    words = ["quest", "&amp;", "night", "&lt;3", "city", "team"]
+    description = " ".join(rnd.choice(words) for _ in range(rnd.randrange(5, 120)))
+    res = (
+        f"<b>Game {i}</b>\n"
+        f"<a href='https://demo.en.cx/GameDetails.aspx?gid={i}&amp;lang=en'>link</a>\n"
+        f"<i>{description}</i>"
+    )
+    return res
+
+
+def _assert_no_broken_tags(piece: str) -> None:
+    no_tags = TAG.sub("", piece)
+    assert "<" not in no_tags and ">" not in no_tags, piece
+    assert "&" not in ENTITY.sub("", no_tags), piece
+    return None
+
+
+def _assert_whole(piece: str) -> None:
+    """
+    Every tag of the piece is complete and closed within it, and so is every entity
+    """
+    depth = 0
+    for m in TAG.finditer(piece):
+        depth += -1 if m.group(1) else 0 if m.group(3) else 1
+        assert depth >= 0, piece
+    assert depth == 0, piece
+    _assert_no_broken_tags(piece)
+    return None
+
+
+def test_tens_of_thousands_of_games():
+    rnd = random.Random(42)
+    games = [_game(rnd, i) for i in range(30_000)]
+    messages = list(pack_messages(games))
+
+    assert all(len(msg) <= MAX_MESSAGE_LENGTH_TELEGRAM for msg in messages)
+    # Nothing is lost, reordered or split, since every game fits into a message on its own
+    assert GAME_JOINER.join(messages) == GAME_JOINER.join(games)
+    for msg in messages:
+        _assert_whole(msg)
+    # As few messages as possible: the next game never fits into the previous message
+    first_games = [msg.split(GAME_JOINER)[0] for msg in messages[1:]]
+    for msg, next_game in zip(messages, first_games):
+        assert len(msg) + len(GAME_JOINER) + len(next_game) > MAX_MESSAGE_LENGTH_TELEGRAM
+
+
+def test_overflowing_game_is_carried_over():
+    games = ["a" * 40, "b" * 40, "c" * 40, "d" * 10]
+    messages = list(pack_messages(games, joiner="\n", limit=100))
+    assert messages == ["a" * 40 + "\n" + "b" * 40, "c" * 40 + "\n" + "d" * 10]
+
+
+def test_oversized_game_is_split_on_its_own():
+    rnd = random.Random(1)
+    big_game = "\n".join(_game(rnd, i) for i in range(100))
+    games = ["<b>before</b>", big_game, "<b>after</b>"]
+    messages = list(pack_messages(games))
+
+    assert messages[0] == "<b>before</b>"
+    assert messages[-1] == "<b>after</b>"
+    assert "".join(messages[1:-1]) == big_game
+    for msg in messages:
+        assert len(msg) <= MAX_MESSAGE_LENGTH_TELEGRAM
+        _assert_whole(msg)
+
+
+def test_split_never_cuts_a_tag_or_an_entity():
+    rnd = random.Random(7)
+    text = "\n".join(_game(rnd, i) for i in range(50))
+    # Every element fits into these
+    for limit in (1000, 2000, MAX_MESSAGE_LENGTH_TELEGRAM):
+        pieces = list(split_html_safe(text, limit))
+        assert "".join(pieces) == text
+        for piece in pieces:
+            assert len(piece) <= limit
+            _assert_whole(piece)
+    # Only every tag and entity fits into these
+    for limit in (80, 100, 333):
+        pieces = list(split_html_safe(text, limit))
+        assert "".join(pieces) == text
+        for piece in pieces:
+            assert len(piece) <= limit
+            _assert_no_broken_tags(piece)
+
+
+def test_split_prefers_line_breaks():
+    text = "\n".join(["word " * 10] * 10)
+    pieces = list(split_html_safe(text, 120))
+    assert all(piece.endswith("\n") for piece in pieces[:-1])
+
+
+def test_bare_ampersand_before_a_tag():
+    # The ";" after the tag doesn't make "&<b>x</b>;" an entity
+    assert _safe_boundaries("&<b>x</b>;") == ([], [], [1, 9, 10], [4, 5])
+
+    text = "fish &<b>x</b>; chips " + "<i>" + "long text " * 10 + "</i>"
+    for piece in split_html_safe(text, 120):
+        depth = sum(-1 if m.group(1) else 1 for m in TAG.finditer(piece))
+        assert depth == 0, piece
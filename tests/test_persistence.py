@@ -0,0 +1,111 @@
+"""
+Conversation states persisted while the handlers run asynchronously, as they do in the bot
+"""
+
+import threading
+import time
+from queue import Queue
+
+import pytest
+from telegram import Bot, Update, User
+from telegram.ext import CommandHandler, ConversationHandler, Dispatcher, Filters, MessageHandler
+
+from persistence import SQLitePersistence
+
+CHAT_ID = 42
+ASK_NAME, ASK_AGE = range(1, 3)
+
+
+class _OfflineBot(Bot):
+    def get_me(self, *args, **kwargs) -> User:
+        return User(123, "test", True, username="test_bot")
+
+
+def _update(bot: Bot, update_id: int, text: str) -> Update:
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": CHAT_ID, "type": "private"},
+        "from": {"id": CHAT_ID, "is_bot": False, "first_name": "test"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return Update.de_json({"update_id": update_id, "message": message}, bot)
+
+
+def _wait_for_state(persistence: SQLitePersistence, state: int, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while persistence.get_conversations("main").get((CHAT_ID,)) != state:
+        assert time.monotonic() < deadline, persistence.get_conversations("main")
+        time.sleep(0.01)
+    return None
+
+
+@pytest.fixture
+def db_location(tmp_path) -> str:
+    return str(tmp_path / "bot_db.sqlite")
+
+
+def _start_dispatcher(persistence: SQLitePersistence, errors: list) -> Dispatcher:
+    bot = _OfflineBot("123:test")
+    dispatcher = Dispatcher(bot, Queue(), workers=2, persistence=persistence)
+    dispatcher.add_handler(ConversationHandler(
+        entry_points=[CommandHandler("start", lambda u, c: ASK_NAME, run_async=True)],
+        states={
+            ASK_NAME: [MessageHandler(Filters.text, lambda u, c: ASK_AGE, run_async=True)],
+            ASK_AGE: [MessageHandler(Filters.text, lambda u, c: ConversationHandler.END, run_async=True)],
+        },
+        fallbacks=[],
+        per_chat=True,
+        per_user=False,
+        name="main",
+        persistent=True,
+    ))
+    dispatcher.add_error_handler(lambda u, c: errors.append(c.error))
+    threading.Thread(target=dispatcher.start, daemon=True).start()
+    while not dispatcher.running:
+        time.sleep(0.01)
+    return dispatcher
+
+
+def test_async_steps_are_persisted(db_location):
+    persistence = SQLitePersistence(db_location)
+    errors = []
+    dispatcher = _start_dispatcher(persistence, errors)
+    try:
+        dispatcher.update_queue.put(_update(dispatcher.bot, 1, "/start"))
+        _wait_for_state(persistence, ASK_NAME)
+        dispatcher.update_queue.put(_update(dispatcher.bot, 2, "name"))
+        _wait_for_state(persistence, ASK_AGE)
+    finally:
+        dispatcher.stop()
+    persistence.flush()
+    assert errors == []
+
+    # The last step survives a restart
+    restarted = SQLitePersistence(db_location)
+    assert restarted.get_conversations("main") == {(CHAT_ID,): ASK_AGE}
+
+
+def test_conversation_end_is_persisted(db_location):
+    persistence = SQLitePersistence(db_location)
+    errors = []
+    dispatcher = _start_dispatcher(persistence, errors)
+    try:
+        for update_id, text in enumerate(["/start", "name", "age"], 1):
+            dispatcher.update_queue.put(_update(dispatcher.bot, update_id, text))
+            _wait_for_state(persistence, [ASK_NAME, ASK_AGE, None][update_id - 1])
+    finally:
+        dispatcher.stop()
+    persistence.flush()
+    assert errors == []
+    assert SQLitePersistence(db_location).get_conversations("main") == {(CHAT_ID,): None}
+
+
+def test_pending_promise_is_left_to_the_handler(db_location):
+    persistence = SQLitePersistence(db_location)
+    handler_states = persistence.get_conversations("main")
+    persistence.update_conversation("main", (CHAT_ID,), ASK_NAME)
+    assert handler_states == {}
+    assert persistence.get_conversations("main") == {(CHAT_ID,): ASK_NAME}
@@ -0,0 +1,75 @@
+"""
+Preference changes of many users written in one transaction, and through to the user cache
+"""
+
+from unittest import mock
+
+import pytest
+
+from db_api import QEngNewsDB
+from description_diff import DiffMode
+from storage import UserPreferences
+from storage.sqlite import UPSERT_DIFF_MODE
+from translations import Language
+from user_cache import USER_PROFILE_CACHE
+
+PREFS = [
+    UserPreferences(1, language=Language.Russian),
+    UserPreferences(2, is_stopped=True),
+    UserPreferences(3, is_digest=True, diff_mode=DiffMode.Text),
+    UserPreferences(4, language=Language.Ukrainian, is_stopped=False, is_digest=False),
+]
+
+
+@pytest.fixture
+def db(tmp_path) -> QEngNewsDB:
+    USER_PROFILE_CACHE.clear()
+    with QEngNewsDB(str(tmp_path / "bot_db.sqlite")) as db:
+        yield db
+    USER_PROFILE_CACHE.clear()
+
+
+def test_written_through_to_cache(db):
+    db.set_user_preferences(PREFS)
+
+    assert USER_PROFILE_CACHE.get(1, "language") is Language.Russian
+    assert USER_PROFILE_CACHE.get(2, "updates_on") is False
+    assert USER_PROFILE_CACHE.get(3, "is_digest") is True
+    assert USER_PROFILE_CACHE.get(3, "diff_mode") is DiffMode.Text
+    assert USER_PROFILE_CACHE.get(4, "language") is Language.Ukrainian
+    assert USER_PROFILE_CACHE.get(4, "updates_on") is True
+    assert USER_PROFILE_CACHE.get(4, "is_digest") is False
+    # Left as is
+    assert USER_PROFILE_CACHE.get(1, "is_digest") is None
+
+
+def test_stored(db):
+    db.set_user_preferences(PREFS)
+    USER_PROFILE_CACHE.clear()
+
+    assert db.get_user_language(1) is Language.Russian
+    assert db.get_updates_on_off(2) is False
+    assert db.get_user_digest(3) is True
+    assert db.get_user_diff_mode(3) is DiffMode.Text
+    assert db.get_user_language(4) is Language.Ukrainian
+    assert db.get_updates_on_off(4) is True
+    assert db.get_user_digest(4) is False
+
+
+def test_one_transaction(db):
+    execute_many = db.execute_many
+
+    def failing(query_text, seq_of_params):
+        if query_text == UPSERT_DIFF_MODE:
+            raise RuntimeError("disk full")
+        return execute_many(query_text, seq_of_params)
+
+    with mock.patch.object(db, "execute_many", side_effect=failing):
+        with pytest.raises(RuntimeError):
+            db.set_user_preferences(PREFS)
+    USER_PROFILE_CACHE.clear()
+
+    # Written before the failure, and rolled back with it
+    assert db.store.get_language(1) is None
+    assert db.store.is_stopped(2) is False
+    assert db.store.get_digest(3) is False
@@ -5,13 +5,17 @@
 from __future__ import annotations
 
 import enum
+import textwrap
 import typing
+from dataclasses import dataclass
+from types import MappingProxyType
 
 from meta_constants import DEFAULT_DAYS_IN_FUTURE, MAX_USER_RULES_ALLOWED
 
 __all__ = [
     "MenuItem", "MENU_LOCALIZATION",
     "Language",
+    "LocalizationIndex", "LOCALIZATION_INDEX",
 ]
 
 
@@ -23,13 +27,8 @@ class Language(enum.Enum):
     QuestRussian = enum.auto()
 
     @classmethod
-    def _str_dict(cls) -> typing.Dict[Language, str]:
-        res = {
-            cls.English: "en",
-            cls.Russian: "ru",
-            cls.Ukrainian: "uk",
-        }
-        return res
+    def _str_dict(cls) -> typing.Mapping[Language, str]:
+        return _LANGUAGE_CODES
 
     def to_str(self) -> str:
         res = self._str_dict()[self]
@@ -37,30 +36,16 @@ class Language(enum.Enum):
 
     @classmethod
     def from_str(cls, s: str) -> Language:
-        inv_di = {
-            v: k
-            for k, v in cls._str_dict().items()
-        }
-        inv_di[""] = Language.Russian
-        inst = inv_di[s]
+        inst = _LANGUAGE_BY_CODE[s]
         return inst
 
     @classmethod
-    def full_name_dict(cls) -> typing.Dict[Language, str]:
-        di = {
-            cls.English: "English",
-            cls.Ukrainian: "Українська",
-            cls.Russian: "Русский",
-        }
-        return di
+    def full_name_dict(cls) -> typing.Mapping[Language, str]:
+        return _LANGUAGE_FULL_NAMES
 
     @classmethod
     def from_full_name(cls, full_name: str) -> Language:
-        inv_di = {
-            v: k
-            for k, v in cls.full_name_dict().items()
-        }
-        inst = inv_di.get(full_name, cls.English)
+        inst = _LANGUAGE_BY_FULL_NAME.get(full_name, cls.English)
         return inst
 
     @property
@@ -68,6 +53,23 @@ class Language(enum.Enum):
         return self.full_name_dict()[self]
 
 
+_LANGUAGE_CODES = MappingProxyType({
+    Language.English: "en",
+    Language.Russian: "ru",
+    Language.Ukrainian: "uk",
+})
+_LANGUAGE_BY_CODE = MappingProxyType({
+    **{v: k for k, v in _LANGUAGE_CODES.items()},
+    "": Language.Russian,
+})
+_LANGUAGE_FULL_NAMES = MappingProxyType({
+    Language.English: "English",
+    Language.Ukrainian: "Українська",
+    Language.Russian: "Русский",
+})
+_LANGUAGE_BY_FULL_NAME = MappingProxyType({v: k for k, v in _LANGUAGE_FULL_NAMES.items()})
+
+
 class MenuItem(enum.Enum):
     LangSet = enum.auto()
     MainMenu = enum.auto()
@@ -76,6 +78,27 @@ class MenuItem(enum.Enum):
     UpdatesOn = enum.auto()
     UpdatesOff = enum.auto()
     BotStopped = enum.auto()
+    DigestOn = enum.auto()
+    DigestOff = enum.auto()
+    DiffModeText = enum.auto()
+    DiffModePicture = enum.auto()
+    BulkSubscribeUsage = enum.auto()
+    BulkUnsubscribeUsage = enum.auto()
+    BulkRulesAdded = enum.auto()
+    BulkRulesExisting = enum.auto()
+    BulkRulesInvalid = enum.auto()
+    BulkRulesLookupTimeout = enum.auto()
+    BulkRulesDeleted = enum.auto()
+    BulkRulesNoneDeleted = enum.auto()
+    SearchUsage = enum.auto()
+    SearchNoResults = enum.auto()
+    AutocompleteHint = enum.auto()
+    AutocompleteGame = enum.auto()
+    AutocompleteTeam = enum.auto()
+    AutocompletePlayer = enum.auto()
+    AutocompleteAuthor = enum.auto()
+    GameReminder = enum.auto()
+    DomainLookupTimeout = enum.auto()
     Help = enum.auto()
     AddRule = enum.auto()
     DeleteRule = enum.auto()
@@ -168,6 +191,7 @@ class MenuItem(enum.Enum):
     DescriptionBeforeAfter = enum.auto()
     BotStatusReportAllowed = enum.auto()
     BotStatusReportNotAllowed = enum.auto()
+    QueryProfileReport = enum.auto()
 
     DontUnderstand = enum.auto()
     TUYears = enum.auto()
@@ -221,6 +245,147 @@ MENU_LOCALIZATION = {
         Language.Ukrainian: "Я більше не буду надсилати вам сповіщення. Якщо ви захочете відновити оновлення - "
                           "надішліть мені команду /start",
     },
+    MenuItem.DigestOn: {
+        Language.Russian: "Теперь я буду собирать все обновления за один цикл в как можно меньшее число сообщений. "
+                          "Чтобы снова получать каждое обновление отдельно - пришлите команду /digest ещё раз",
+        Language.English: "From now on I'll group all the updates of a single cycle into as few messages as possible. "
+                          "To get every update as a separate message again - send the /digest command once more",
+        Language.Ukrainian: "Тепер я збиратиму всі оновлення за один цикл в якомога меншу кількість повідомлень. "
+                            "Щоб знову отримувати кожне оновлення окремо - надішліть команду /digest ще раз",
+    },
+    MenuItem.DigestOff: {
+        Language.Russian: "Теперь я буду присылать каждое обновление отдельным сообщением. "
+                          "Чтобы получать их сводкой - пришлите команду /digest",
+        Language.English: "From now on I'll send every update as a separate message. "
+                          "To get them as a digest - send the /digest command",
+        Language.Ukrainian: "Тепер я надсилатиму кожне оновлення окремим повідомленням. "
+                            "Щоб отримувати їх зведенням - надішліть команду /digest",
+    },
+    MenuItem.DiffModeText: {
+        Language.Russian: "Теперь изменения в описании игры я буду показывать прямо в тексте уведомления: "
+                          "удалённое - зачёркнутым, добавленное - жирным. "
+                          "Чтобы снова получать их картинкой - пришлите команду /diffmode ещё раз",
+        Language.English: "From now on I'll show game description changes right in the update text: "
+                          "removed words struck out, added ones in bold. "
+                          "To get them as a picture again - send the /diffmode command once more",
+        Language.Ukrainian: "Тепер зміни в описі гри я показуватиму прямо в тексті сповіщення: "
+                            "видалене - закресленим, додане - жирним. "
+                            "Щоб знову отримувати їх картинкою - надішліть команду /diffmode ще раз",
+    },
+    MenuItem.DiffModePicture: {
+        Language.Russian: "Теперь изменения в описании игры я буду присылать картинкой. "
+                          "Чтобы видеть их прямо в тексте уведомления - пришлите команду /diffmode",
+        Language.English: "From now on I'll send game description changes as a picture. "
+                          "To see them right in the update text - send the /diffmode command",
+        Language.Ukrainian: "Тепер зміни в описі гри я надсилатиму картинкою. "
+                            "Щоб бачити їх прямо в тексті сповіщення - надішліть команду /diffmode",
+    },
+    MenuItem.BulkSubscribeUsage: {
+        Language.Russian: "Чтобы добавить несколько правил сразу, перечислите домены, "
+                          "а после домена - при желании ID команд, игроков, игр или авторов на нём:\n"
+                          "/subscribe game.qeng.org team=123 game=456 author=7 other.qeng.org\n"
+                          "Домен без ID - это правило на все игры домена. "
+                          "Чтобы игнорировать игру, используйте ignore=ID",
+        Language.English: "To add several rules at once, list the domains, "
+                          "each one optionally followed by IDs of teams, players, games or authors on it:\n"
+                          "/subscribe game.qeng.org team=123 game=456 author=7 other.qeng.org\n"
+                          "A domain without IDs is a rule for all of its games. "
+                          "To ignore a game, use ignore=ID",
+        Language.Ukrainian: "Щоб додати кілька правил одразу, перелічіть домени, "
+                            "а після домену - за бажанням ID команд, гравців, ігор чи авторів на ньому:\n"
+                            "/subscribe game.qeng.org team=123 game=456 author=7 other.qeng.org\n"
+                            "Домен без ID - це правило на всі ігри домену. "
+                            "Щоб ігнорувати гру, використайте ignore=ID",
+    },
+    MenuItem.BulkUnsubscribeUsage: {
+        Language.Russian: "Чтобы удалить несколько правил сразу, перечислите их ID (указаны в квадратных скобках "
+                          "в списке правил):\n/unsubscribe 0123456789 abcdef0123",
+        Language.English: "To delete several rules at once, list their IDs (shown in square brackets "
+                          "in the rule list):\n/unsubscribe 0123456789 abcdef0123",
+        Language.Ukrainian: "Щоб видалити кілька правил одразу, перелічіть їх ID (вказані у квадратних дужках "
+                            "у списку правил):\n/unsubscribe 0123456789 abcdef0123",
+    },
+    MenuItem.BulkRulesAdded: {
+        Language.Russian: "Добавлены правила:\n{}",
+        Language.English: "Rules added:\n{}",
+        Language.Ukrainian: "Додано правила:\n{}",
+    },
+    MenuItem.BulkRulesExisting: {
+        Language.Russian: "Уже есть в вашем списке правил:\n{}",
+        Language.English: "Already in your rule list:\n{}",
+        Language.Ukrainian: "Вже є у вашому списку правил:\n{}",
+    },
+    MenuItem.BulkRulesInvalid: {
+        Language.Russian: "Не удалось разобрать: {}",
+        Language.English: "Couldn't make sense of: {}",
+        Language.Ukrainian: "Не вдалося розібрати: {}",
+    },
+    MenuItem.BulkRulesLookupTimeout: {
+        Language.Russian: "Не удалось вовремя проверить домены, попробуйте их ещё раз чуть позже: {}",
+        Language.English: "Couldn't check these domains in time, please try them again in a bit: {}",
+        Language.Ukrainian: "Не вдалося вчасно перевірити домени, спробуйте їх ще раз трохи пізніше: {}",
+    },
+    MenuItem.SearchUsage: {
+        Language.Russian: "Чтобы найти игру по названию или описанию среди игр ваших доменов, "
+                          "пришлите слова из них после команды:\n/search ночной марафон",
+        Language.English: "To find a game of your domains by its name or description, "
+                          "send words from them after the command:\n/search night marathon",
+        Language.Ukrainian: "Щоб знайти гру за назвою чи описом серед ігор ваших доменів, "
+                            "надішліть слова з них після команди:\n/search нічний марафон",
+    },
+    MenuItem.SearchNoResults: {
+        Language.Russian: "Не нашёл игр по запросу: {}",
+        Language.English: "No games found for: {}",
+        Language.Ukrainian: "Не знайшов ігор за запитом: {}",
+    },
+    MenuItem.AutocompleteHint: {
+        Language.Russian: "Не помните ID? Наберите в этом чате @{} и начало названия игры, ника автора "
+                          "или ID команды, и выберите из списка",
+        Language.English: "Don't remember the ID? Type @{} in this chat followed by the beginning of a game name, "
+                          "an author's nickname or a team ID, and pick from the list",
+        Language.Ukrainian: "Не пам'ятаєте ID? Наберіть у цьому чаті @{} і початок назви гри, ніку автора "
+                            "або ID команди, і виберіть зі списку",
+    },
+    MenuItem.AutocompleteGame: {
+        Language.Russian: "Игра",
+        Language.English: "Game",
+        Language.Ukrainian: "Гра",
+    },
+    MenuItem.AutocompleteTeam: {
+        Language.Russian: "Команда",
+        Language.English: "Team",
+        Language.Ukrainian: "Команда",
+    },
+    MenuItem.AutocompletePlayer: {
+        Language.Russian: "Игрок",
+        Language.English: "Player",
+        Language.Ukrainian: "Гравець",
+    },
+    MenuItem.AutocompleteAuthor: {
+        Language.Russian: "Автор",
+        Language.English: "Author",
+        Language.Ukrainian: "Автор",
+    },
+    MenuItem.GameReminder: {
+        Language.Russian: "⏰ Через {minutes} мин. начинается игра {game} ({domain})",
+        Language.English: "⏰ The game {game} ({domain}) starts in {minutes} min",
+        Language.Ukrainian: "⏰ За {minutes} хв. починається гра {game} ({domain})",
+    },
+    MenuItem.DomainLookupTimeout: {
+        Language.Russian: "Не удалось вовремя проверить домен. Попробуйте ещё раз чуть позже.",
+        Language.English: "Couldn't check the domain in time. Please try again in a bit.",
+        Language.Ukrainian: "Не вдалося вчасно перевірити домен. Спробуйте ще раз трохи пізніше.",
+    },
+    MenuItem.BulkRulesDeleted: {
+        Language.Russian: "Удалены правила:\n{}",
+        Language.English: "Rules deleted:\n{}",
+        Language.Ukrainian: "Видалено правила:\n{}",
+    },
+    MenuItem.BulkRulesNoneDeleted: {
+        Language.Russian: "В вашем списке нет правил с такими ID",
+        Language.English: "There are no rules with such IDs in your rule list",
+        Language.Ukrainian: "У вашому списку немає правил з такими ID",
+    },
     MenuItem.Help: {
         Language.Russian: "Прочитать информацию о боте можно "
                           "<a href='https://telegra.ph/Encounter-News---Bot-09-20' target='_blank'>тут</a>",
@@ -749,6 +914,11 @@ MENU_LOCALIZATION = {
         Language.English: "You don't have access to this functionality",
         Language.Ukrainian: "Ви не маєте доступу до цієї функції",
     },
+    MenuItem.QueryProfileReport: {
+        Language.Russian: "Самые затратные запросы к БД:\n\n{}",
+        Language.English: "Most expensive DB queries:\n\n{}",
+        Language.Ukrainian: "Найвитратніші запити до БД:\n\n{}",
+    },
     MenuItem.DontUnderstand: {
         Language.Russian: "Я не понял вас. Если вы использовали команду из меню - то, возможно, меня перезапустили, "
                           "и я потерял нить общения. В этом случае попробуйте вызвать /menu ещё раз.",
@@ -804,3 +974,35 @@ MENU_LOCALIZATION = {
         Language.Ukrainian: "пізніше",
     },
 }
+
+
+@dataclass(frozen=True)
+class LocalizationIndex:
+    """
+    Read-only lookups derived from MENU_LOCALIZATION, built once at import,
+    so that the rendering code doesn't re-dedent the texts on every message
+    """
+    # textwrap.dedent-ed, with newlines removed
+    dedented: typing.Mapping[MenuItem, typing.Mapping[Language, str]]
+    dedented_keep_newlines: typing.Mapping[MenuItem, typing.Mapping[Language, str]]
+
+    @classmethod
+    def build(cls, localization: typing.Dict[MenuItem, typing.Dict[Language, typing.Any]]) -> LocalizationIndex:
+        dedented = {}
+        dedented_keep_newlines = {}
+        for item, texts in localization.items():
+            for lang, txt in texts.items():
+                if not isinstance(txt, str):
+                    continue
+                kept = textwrap.dedent(txt)
+                dedented_keep_newlines.setdefault(item, {})[lang] = kept
+                dedented.setdefault(item, {})[lang] = kept.replace("\n", "")
+
+        def freeze(di: typing.Dict) -> typing.Mapping:
+            return MappingProxyType({k: MappingProxyType(v) for k, v in di.items()})
+
+        inst = cls(freeze(dedented), freeze(dedented_keep_newlines))
+        return inst
+
+
+LOCALIZATION_INDEX = LocalizationIndex.build(MENU_LOCALIZATION)
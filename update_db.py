@@ -1,28 +1,37 @@
 """
 DB Updater process
 """
+from __future__ import annotations
+
 import datetime
 import os
 import sys
 import time
 import re
+from collections import defaultdict
 
 import typing
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
 
 cur_dir = os.path.dirname(__file__)
 if cur_dir not in sys.path:
     sys.path.append(cur_dir)
 
 from telegram.ext import Updater
-from telegram import Bot
+from telegram import Bot, InputMediaPhoto, InputMediaDocument
+from telegram.error import BadRequest
 
 from db_api import QEngNewsDB
 from bot_secrets import API_KEY, SEND_ONLY_TO_ADMIN
-from meta_constants import DB_LOCATION, ADMIN_ID
+from meta_constants import DB_LOCATION, ADMIN_ID, METRICS_LOCATION
+from metrics import METRICS, timed
 from entities import Update
+from reminders import Reminder
 from entities.domain_meta import UpperLevelDomain
+from message_packer import pack_messages
+from diff_image import media_groups
+from lazy_imports import lazy_module
+
+webdriver = lazy_module("selenium.webdriver")
 
 # CHROME_DRIVER_PATH = os.path.join(__file__, "..", "data", "chromedriver.exe")
 CHROME_DRIVER_PATH = "chromedriver"
@@ -36,6 +45,8 @@ UPDATE_BLOCKLIST = {
     (UpperLevelDomain.QENG, 431),             # Training games QENG
 }
 
+UPDATES_PROCESSED = METRICS.counter("qeng_updates_total", "Updates processed by outcome")
+
 
 def is_blocked(update: Update) -> bool:
     for dom, gid in UPDATE_BLOCKLIST:
@@ -53,7 +64,7 @@ def is_blocked(update: Update) -> bool:
 
 
 def get_driver(executable_path: str):
-    chrome_options = Options()
+    chrome_options = webdriver.ChromeOptions()
     chrome_options.add_argument('--headless')
     chrome_options.add_argument('--start-maximized')
     driver = webdriver.Chrome(options=chrome_options, executable_path=executable_path)
@@ -62,6 +73,7 @@ def get_driver(executable_path: str):
 
 def send_update(upd: Update, bot: Bot, driver: typing.Optional[webdriver.Chrome]) -> typing.Optional[Update]:
     if is_blocked(upd):
+        UPDATES_PROCESSED.inc(status="blocked")
         return None
     if not SEND_UPDATES:
         return None
@@ -71,49 +83,159 @@ def send_update(upd: Update, bot: Bot, driver: typing.Optional[webdriver.Chrome]
     upd.sent_ts = datetime.datetime.utcnow()
     # noinspection PyBroadException
     try:
-        bot.send_message(
-            upd.user_id, upd.msg, parse_mode="HTML",
-        )
-        if upd.has_diffpic:
-            with upd.diffpic(driver) as dp:
-                # noinspection PyBroadException
-                try:
-                    bot.send_photo(upd.user_id, dp)
-                except Exception:
-                    with open(dp.name, "rb") as pic:
-                        bot.send_document(upd.user_id, pic)
+        with timed("render"):
+            msg = upd.msg
+        with timed("telegram_send", method="send_message"):
+            bot.send_message(
+                upd.user_id, msg, parse_mode="HTML",
+            )
+        send_diffpic(upd, bot, driver)
 
         upd.is_delivered = True
+        UPDATES_PROCESSED.inc(status="delivered")
     except Exception as e:
         print("ERROR", upd, e, sep="\n")
         upd.is_delivered = False
+        UPDATES_PROCESSED.inc(status="failed")
 
     return upd
 
 
+def send_diffpic(
+        upd: Update, bot: Bot, driver: typing.Optional[webdriver.Chrome], caption: typing.Optional[str] = None,
+) -> None:
+    """
+    The caption goes under the first page
+    """
+    if not upd.has_diffpic:
+        return None
+    # Pages are already within the photo limits, so every one of them is normally uploaded exactly once
+    for group in media_groups(upd.diffpic_pages(driver)):
+        try:
+            if len(group) == 1:
+                with timed("telegram_send", method="send_photo"):
+                    bot.send_photo(upd.user_id, group[0], caption=caption)
+            else:
+                with timed("telegram_send", method="send_media_group"):
+                    bot.send_media_group(upd.user_id, [
+                        InputMediaPhoto(page, caption=caption if i == 0 else None)
+                        for i, page in enumerate(group)
+                    ])
+        except BadRequest:
+            # Telegram still refused them as photos; files are sent as they are
+            send_diffpic_documents(upd.user_id, group, bot, caption)
+        caption = None
+        time.sleep(2 / 30)
+    return None
+
+
+def send_diffpic_documents(
+        user_id: int, group: typing.List[bytes], bot: Bot, caption: typing.Optional[str] = None,
+) -> None:
+    if len(group) == 1:
+        with timed("telegram_send", method="send_document"):
+            bot.send_document(user_id, group[0], filename="diff.png", caption=caption)
+        return None
+    with timed("telegram_send", method="send_media_group"):
+        bot.send_media_group(user_id, [
+            InputMediaDocument(page, filename=f"diff_{i}.png", caption=caption if i == 1 else None)
+            for i, page in enumerate(group, 1)
+        ])
+    return None
+
+
+def send_reminder(reminder: Reminder, bot: Bot) -> None:
+    user_id = ADMIN_ID if SEND_ONLY_TO_ADMIN else reminder.user_id
+    with timed("render"):
+        msg = reminder.to_str(time.time())
+    with timed("telegram_send", method="send_message"):
+        bot.send_message(user_id, msg, parse_mode="HTML", disable_web_page_preview=True)
+    time.sleep(2 / 30)
+    return None
+
+
+def send_digest(
+        upds: typing.List[Update], bot: Bot, driver: typing.Optional[webdriver.Chrome],
+) -> typing.List[Update]:
+    blocked = [upd for upd in upds if is_blocked(upd)]
+    UPDATES_PROCESSED.inc(len(blocked), status="blocked")
+    upds = [upd for upd in upds if not is_blocked(upd)]
+    if not upds or not SEND_UPDATES:
+        return []
+
+    sent_ts = datetime.datetime.utcnow()
+    for upd in upds:
+        if SEND_ONLY_TO_ADMIN:
+            upd.user_id = ADMIN_ID
+        upd.sent_ts = sent_ts
+    user_id = upds[0].user_id
+
+    # noinspection PyBroadException
+    try:
+        with timed("render"):
+            msgs = list(pack_messages(upd.msg for upd in upds))
+        for msg in msgs:
+            with timed("telegram_send", method="send_message"):
+                bot.send_message(
+                    user_id, msg, parse_mode="HTML",
+                )
+            time.sleep(2 / 30)
+        is_sent = True
+    except Exception as e:
+        print("ERROR", user_id, e, sep="\n")
+        is_sent = False
+
+    # The texts are delivered together, the diff pictures one by one, captioned with their game
+    for upd in upds:
+        upd.is_delivered = is_sent
+        if not is_sent:
+            continue
+        # noinspection PyBroadException
+        try:
+            send_diffpic(upd, bot, driver, caption=upd.diffpic_caption)
+        except Exception as e:
+            print("ERROR", upd, e, sep="\n")
+            upd.is_delivered = False
+    n_delivered = sum(upd.is_delivered for upd in upds)
+    UPDATES_PROCESSED.inc(n_delivered, status="delivered")
+    UPDATES_PROCESSED.inc(len(upds) - n_delivered, status="failed")
+    return upds
+
+
 def update_db() -> None:
     updater = Updater(API_KEY, workers=1)
     bot = updater.bot
-    with QEngNewsDB(DB_LOCATION) as db:
+    with QEngNewsDB(DB_LOCATION) as db, timed("cycle"):
+        with timed("warmup"):
+            db.warm_up_domains()
         updates = db.get_updates()
 
         driver = None
         if any(upd.has_diffpic for upd in updates):
             driver = get_driver(CHROME_DRIVER_PATH)
 
+        digests = defaultdict(list)
         for upd in updates:
+            if upd.is_digest:
+                digests[upd.user_id].append(upd)
+                continue
             upd_sent = send_update(upd, bot, driver)
             if upd_sent is not None:
                 time.sleep(2 / 30)
 
-        db.updates_to_db(updates)
-        db.commit_update()
+        for user_updates in digests.values():
+            send_digest(user_updates, bot, driver)
+
+        with timed("commit"):
+            db.updates_to_db(updates)
+            db.commit_update()
         if driver is not None:
             driver.quit()
 
     succ_deliveries = [u for u in updates if u.is_delivered]
     unsucc_deliveries = [u for u in updates if not u.is_delivered]
     print(f"{len(succ_deliveries)} message(s) sent, {len(unsucc_deliveries)} failed deliveries")
+    METRICS.write_textfile(METRICS_LOCATION)
 
     return None
 
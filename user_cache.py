@@ -0,0 +1,90 @@
+"""
+In-process cache of per-user settings, so that interactive requests rarely touch the DB
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+import typing
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from meta_constants import USER_CACHE_TTL_SECONDS, USER_CACHE_MAX_SIZE
+
+if typing.TYPE_CHECKING:
+    from translations import Language
+    from description_diff import DiffMode
+
+__all__ = [
+    "UserProfile", "UserProfileCache",
+    "USER_PROFILE_CACHE",
+]
+
+
+@dataclass
+class UserProfile:
+    """
+    What is known about a user; None means "not loaded yet"
+    """
+    language: typing.Optional[Language] = None
+    updates_on: typing.Optional[bool] = None
+    is_digest: typing.Optional[bool] = None
+    diff_mode: typing.Optional[DiffMode] = None
+    n_rules: typing.Optional[int] = None
+    domains: typing.Optional[typing.Tuple[str, ...]] = None
+    expires_at: float = 0.0
+
+
+@dataclass
+class UserProfileCache:
+    ttl_seconds: float
+    max_size: int
+    _profiles: typing.OrderedDict[int, UserProfile] = field(default_factory=OrderedDict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def get(self, tg_id: int, attr: str) -> typing.Any:
+        with self._lock:
+            profile = self._profiles.get(tg_id)
+            if profile is None:
+                return None
+            if profile.expires_at < time.monotonic():
+                del self._profiles[tg_id]
+                return None
+            self._profiles.move_to_end(tg_id)
+            return getattr(profile, attr)
+
+    def set(self, tg_id: int, **values: typing.Any) -> None:
+        with self._lock:
+            profile = self._profiles.get(tg_id)
+            if profile is None or profile.expires_at < time.monotonic():
+                profile = UserProfile(expires_at=time.monotonic() + self.ttl_seconds)
+                self._profiles[tg_id] = profile
+            for attr, value in values.items():
+                setattr(profile, attr, value)
+            self._profiles.move_to_end(tg_id)
+            while len(self._profiles) > self.max_size:
+                self._profiles.popitem(last=False)
+        return None
+
+    def invalidate(self, tg_id: int, *attrs: str) -> None:
+        """
+        Forgets the given attributes of a user, or the whole profile if none are given
+        """
+        with self._lock:
+            if not attrs:
+                self._profiles.pop(tg_id, None)
+                return None
+            profile = self._profiles.get(tg_id)
+            if profile is not None:
+                for attr in attrs:
+                    setattr(profile, attr, None)
+        return None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._profiles.clear()
+        return None
+
+
+USER_PROFILE_CACHE = UserProfileCache(USER_CACHE_TTL_SECONDS, USER_CACHE_MAX_SIZE)
@@ -0,0 +1,157 @@
+"""
+Webhook ingestion of Telegram updates, as an alternative to long polling
+"""
+
+from __future__ import annotations
+
+import hmac
+import json
+import threading
+import typing
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Update
+from telegram.ext import Dispatcher, Updater
+
+__all__ = [
+    "SECRET_TOKEN_HEADER",
+    "make_webhook_server", "run_webhook",
+    "replay_updates",
+]
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_BODY_SIZE = 1024 * 1024
+
+
+def make_webhook_server(
+        dispatcher: Dispatcher,
+        secret_token: str,
+        listen: str,
+        port: int,
+        url_path: str,
+) -> ThreadingHTTPServer:
+    """
+    An HTTP server that accepts Telegram updates (a single one or a JSON list of them) on url_path.
+    Updates are acknowledged as soon as they are queued; the dispatcher processes them concurrently
+    """
+    path = f"/{url_path.strip('/')}"
+
+    class _Handler(BaseHTTPRequestHandler):
+
+        def _reply(self, code: int) -> None:
+            self.send_response(code)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+
+        # noinspection PyPep8Naming
+        def do_POST(self) -> None:
+            if self.path != path:
+                return self._reply(404)
+            token = self.headers.get(SECRET_TOKEN_HEADER, "")
+            if not hmac.compare_digest(token, secret_token):
+                return self._reply(403)
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+            except ValueError:
+                return self._reply(400)
+            if not 0 < length <= MAX_BODY_SIZE:
+                return self._reply(413 if length else 400)
+            try:
+                payload = json.loads(self.rfile.read(length))
+            except ValueError:
+                return self._reply(400)
+
+            payloads = payload if isinstance(payload, list) else [payload]
+            if not all(isinstance(p, dict) for p in payloads):
+                return self._reply(400)
+            # A malformed update is refused as a whole batch, before any of it is queued
+            try:
+                updates = [
+                    Update.de_json(p, dispatcher.bot)
+                    for p in payloads
+                ]
+            except (AttributeError, KeyError, TypeError, ValueError):
+                return self._reply(400)
+            for upd in updates:
+                if upd is not None:
+                    dispatcher.update_queue.put(upd)
+            return self._reply(200)
+
+        # noinspection PyShadowingBuiltins
+        def log_message(self, format: str, *args: typing.Any) -> None:
+            return None
+
+    server = ThreadingHTTPServer((listen, port), _Handler)
+    return server
+
+
+def run_webhook(
+        updater: Updater,
+        webhook_url: str,
+        secret_token: str,
+        listen: str,
+        port: int,
+        url_path: str,
+) -> None:
+    dispatcher = updater.dispatcher
+    dispatcher_thread = threading.Thread(target=dispatcher.start, name="dispatcher")
+    dispatcher_thread.start()
+    updater.job_queue.start()
+
+    server = make_webhook_server(dispatcher, secret_token, listen, port, url_path)
+    updater.bot.set_webhook(
+        f"{webhook_url.rstrip('/')}/{url_path.strip('/')}",
+        secret_token=secret_token,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        updater.job_queue.stop()
+        dispatcher.stop()
+        dispatcher_thread.join()
+        if dispatcher.persistence is not None:
+            dispatcher.persistence.flush()
+    return None
+
+
+def replay_updates(
+        url: str,
+        secret_token: str,
+        payloads: typing.List[typing.Dict[str, typing.Any]],
+        batch_size: int = 1,
+) -> typing.List[int]:
+    """
+    Local stub of the Telegram side: POSTs recorded update payloads to the webhook
+    """
+    statuses = []
+    for i in range(0, len(payloads), batch_size):
+        batch = payloads[i:i + batch_size]
+        body = batch[0] if batch_size == 1 else batch
+        req = urllib.request.Request(
+            url,
+            data=json.dumps(body).encode("utf-8"),
+            headers={
+                "Content-Type": "application/json",
+                SECRET_TOKEN_HEADER: secret_token,
+            },
+            method="POST",
+        )
+        with urllib.request.urlopen(req) as resp:
+            statuses.append(resp.status)
+    return statuses
+
+
+if __name__ == '__main__':
+    import sys
+
+    # python webhook.py http://127.0.0.1:8443/telegram <secret> recorded_updates.json [batch_size]
+    url_, secret_, file_ = sys.argv[1:4]
+    batch_size_ = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+    with open(file_, encoding="utf-8") as f_:
+        payloads_ = json.load(f_)
+    print(replay_updates(url_, secret_, payloads_, batch_size_))
@@ -0,0 +1,228 @@
+"""
+Durable job queue in the bot DB, with leases, so that any number of worker processes can share it
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+import typing
+import uuid
+from dataclasses import dataclass, field
+from sqlite3 import connect, Connection
+
+from db_api import QEngNewsDB
+from meta_constants import JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_RETRY_BACKOFF_SECONDS
+
+__all__ = [
+    "Job", "JobQueue",
+    "JobStatus",
+]
+
+
+class JobStatus:
+    Queued = "queued"
+    Leased = "leased"
+    Done = "done"
+    Failed = "failed"
+
+
+@dataclass
+class Job:
+    job_id: int
+    kind: str
+    payload: typing.Dict[str, typing.Any]
+    attempts: int
+    generation: int
+    lease_token: str
+
+    @property
+    def is_last_attempt(self) -> bool:
+        return self.attempts >= JOB_MAX_ATTEMPTS
+
+
+@dataclass
+class JobQueue:
+    """
+    A job is identified by its dedup key, so enqueueing is idempotent. A leased job whose lease
+    has expired (e.g. its worker died) is handed out again; completing it requires the token of
+    the current lease, so a worker that lost its lease can't overwrite the result of another one.
+    Kinds listed in `exclusive_kinds` are leased to one worker at a time
+    """
+    db_location: str
+    exclusive_kinds: typing.FrozenSet[str] = frozenset()
+    _conn: typing.Optional[Connection] = field(init=False, default=None, repr=False)
+    _lock: threading.RLock = field(init=False, default_factory=threading.RLock, repr=False)
+
+    @property
+    def conn(self) -> Connection:
+        if self._conn is None:
+            with QEngNewsDB(self.db_location) as db:
+                db.ensure_schema()
+            # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+            self._conn = connect(self.db_location, timeout=30, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        return self._conn
+
+    def enqueue(
+            self,
+            kind: str,
+            payload: typing.Dict[str, typing.Any],
+            dedup_key: str,
+            rearm: bool = False,
+            delay: float = 0,
+    ) -> None:
+        """
+        Adds a job unless one with the same dedup key exists. With `rearm`, a finished job with
+        that key is queued again (for recurring jobs); pending ones are left as they are
+        """
+        now = time.time()
+        query = """
+        INSERT INTO JOB_QUEUE
+        (KIND, DEDUP_KEY, PAYLOAD, STATUS, ATTEMPTS, GENERATION, AVAILABLE_AT, UPDATED_AT)
+        VALUES (:kind, :dedup_key, :payload, :queued, 0, 0, :available_at, :now)
+        ON CONFLICT (DEDUP_KEY) DO
+        """
+        if rearm:
+            query += """
+            UPDATE SET
+            PAYLOAD = excluded.PAYLOAD, STATUS = :queued, ATTEMPTS = 0, GENERATION = GENERATION + 1,
+            LEASE_TOKEN = NULL, AVAILABLE_AT = excluded.AVAILABLE_AT, UPDATED_AT = :now, LAST_ERROR = NULL
+            WHERE STATUS IN (:done, :failed)
+            """
+        else:
+            query += " NOTHING"
+        with self._lock:
+            self.conn.execute(query, {
+                "kind": kind,
+                "dedup_key": dedup_key,
+                "payload": json.dumps(payload, default=str),
+                "queued": JobStatus.Queued,
+                "done": JobStatus.Done,
+                "failed": JobStatus.Failed,
+                "available_at": now + delay,
+                "now": now,
+            })
+        return None
+
+    def lease(self, kinds: typing.Iterable[str], lease_seconds: float = JOB_LEASE_SECONDS) -> typing.Optional[Job]:
+        """
+        Takes the oldest available job of one of the kinds, or returns None if there is none
+        """
+        kinds = list(kinds)
+        now = time.time()
+        placeholders = ", ".join("?" * len(kinds))
+        exclusive_kinds = [k for k in kinds if k in self.exclusive_kinds]
+        exclusive_placeholders = ", ".join("?" * len(exclusive_kinds)) or "''"
+        select_query = f"""
+        SELECT JOB_ID, KIND, PAYLOAD, ATTEMPTS, GENERATION
+        FROM JOB_QUEUE as jq
+        WHERE 1=1
+        AND KIND IN ({placeholders})
+        AND (
+            (STATUS = ? AND AVAILABLE_AT <= ?)
+            OR (STATUS = ? AND LEASE_UNTIL < ?)
+        )
+        AND (
+            KIND NOT IN ({exclusive_placeholders})
+            OR NOT EXISTS (
+                SELECT 1
+                FROM JOB_QUEUE as other
+                WHERE 1=1
+                AND other.KIND = jq.KIND
+                AND other.STATUS = ?
+                AND other.LEASE_UNTIL >= ?
+            )
+        )
+        ORDER BY JOB_ID
+        LIMIT 1
+        """
+        params = [
+            *kinds, JobStatus.Queued, now, JobStatus.Leased, now,
+            *exclusive_kinds, JobStatus.Leased, now,
+        ]
+        token = uuid.uuid4().hex
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(select_query, params).fetchone()
+                if row is None:
+                    self.conn.execute("COMMIT")
+                    return None
+                job_id, kind, payload, attempts, generation = row
+                self.conn.execute(
+                    """
+                    UPDATE JOB_QUEUE
+                    SET STATUS = ?, ATTEMPTS = ATTEMPTS + 1, LEASE_TOKEN = ?, LEASE_UNTIL = ?, UPDATED_AT = ?
+                    WHERE JOB_ID = ?
+                    """,
+                    (JobStatus.Leased, token, now + lease_seconds, now, job_id),
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        job = Job(job_id, kind, json.loads(payload), attempts + 1, generation, token)
+        return job
+
+    def _finish(self, job: Job, status: str, available_at: float = None, error: str = None) -> bool:
+        with self._lock:
+            cur = self.conn.execute(
+                """
+                UPDATE JOB_QUEUE
+                SET STATUS = ?, AVAILABLE_AT = IFNULL(?, AVAILABLE_AT), LAST_ERROR = ?,
+                LEASE_TOKEN = NULL, UPDATED_AT = ?
+                WHERE 1=1
+                AND JOB_ID = ?
+                AND LEASE_TOKEN = ?
+                """,
+                (status, available_at, error, time.time(), job.job_id, job.lease_token),
+            )
+        return cur.rowcount == 1
+
+    def complete(self, job: Job) -> bool:
+        """
+        Returns False if the lease had been lost, i.e. the job may have been processed twice
+        """
+        return self._finish(job, JobStatus.Done)
+
+    def fail(self, job: Job, error: str) -> bool:
+        """
+        Schedules a retry with a linear backoff, or gives the job up after the last attempt
+        """
+        if job.is_last_attempt:
+            return self._finish(job, JobStatus.Failed, error=error)
+        available_at = time.time() + JOB_RETRY_BACKOFF_SECONDS * job.attempts
+        return self._finish(job, JobStatus.Queued, available_at, error)
+
+    def counts(self) -> typing.Dict[typing.Tuple[str, str], int]:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT KIND, STATUS, COUNT(*) FROM JOB_QUEUE GROUP BY 1, 2"
+            ).fetchall()
+        return {(kind, status): n for kind, status, n in rows}
+
+    def prune(self, older_than_seconds: float, keep_kinds: typing.Iterable[str] = ()) -> None:
+        """
+        Forgets finished jobs, except for the kinds to keep (e.g. recurring ones, whose rows carry the generation)
+        """
+        keep_kinds = list(keep_kinds)
+        with self._lock:
+            self.conn.execute(
+                f"""
+                DELETE FROM JOB_QUEUE
+                WHERE 1=1
+                AND STATUS IN (?, ?)
+                AND UPDATED_AT < ?
+                AND KIND NOT IN ({", ".join("?" * len(keep_kinds)) or "''"})
+                """,
+                (JobStatus.Done, JobStatus.Failed, time.time() - older_than_seconds, *keep_kinds),
+            )
+        return None
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        return None
@@ -0,0 +1,251 @@
+"""
+Queue-driven update pipeline: fetch -> merge -> render -> send, each stage runnable in any number of processes.
+
+    python workers.py schedule warmup fetch merge render send
+"""
+import os
+import sys
+import time
+import datetime
+import socket
+import typing
+from dataclasses import dataclass
+
+from lazy_imports import lazy_module
+
+cur_dir = os.path.dirname(__file__)
+if cur_dir not in sys.path:
+    sys.path.append(cur_dir)
+
+from telegram.ext import Updater
+from telegram import Bot
+
+from db_api import QEngNewsDB, GAMES_FETCHED
+from bot_secrets import API_KEY, SEND_ONLY_TO_ADMIN
+from meta_constants import DB_LOCATION, ADMIN_ID, UPDATE_FREQUENCY_SECONDS, METRICS_LOCATION, \
+    JOB_RETENTION_SECONDS, JOB_PRUNE_INTERVAL_SECONDS, WORKER_POLL_INTERVAL_SECONDS
+from metrics import METRICS, timed
+from entities import Update, Domain
+from message_packer import pack_messages
+from work_queue import Job, JobQueue
+from update_db import is_blocked, send_diffpic, get_driver, CHROME_DRIVER_PATH, UPDATES_PROCESSED
+
+pd = lazy_module("pandas")
+
+__all__ = [
+    "WorkerContext",
+    "schedule", "HANDLERS",
+    "run_worker",
+]
+
+# Merging into DOMAIN_GAMES goes through the shared DOMAIN_GAMES_TEMP table, hence one merge at a time
+EXCLUSIVE_KINDS = frozenset({"merge"})
+RECURRING_KINDS = ("fetch", "warmup")
+
+JOBS_PROCESSED = METRICS.counter("qeng_jobs_total", "Queue jobs processed by kind and outcome")
+
+
+@dataclass
+class WorkerContext:
+    db: QEngNewsDB
+    queue: JobQueue
+    bot: Bot
+    driver: typing.Any = None
+    # Monotonic time of the last prune of the queue; never pruned yet
+    last_prune_at: typing.Optional[float] = None
+
+    def get_driver(self):
+        if self.driver is None:
+            self.driver = get_driver(CHROME_DRIVER_PATH)
+        return self.driver
+
+
+def schedule(ctx: WorkerContext) -> None:
+    """
+    Queues a warm-up for every newly tracked domain and a fetch for every domain that is due.
+    A job still in progress is not queued twice. Old jobs are pruned at most every JOB_PRUNE_INTERVAL_SECONDS
+    """
+    for domain_url in ctx.db.store.get_domains_to_warm_up():
+        ctx.queue.enqueue("warmup", {"domain": domain_url}, f"warmup:{domain_url}", rearm=True)
+    for domain in ctx.db.find_domains_due(UPDATE_FREQUENCY_SECONDS):
+        ctx.queue.enqueue("fetch", {"domain": domain.full_url}, f"fetch:{domain.full_url}", rearm=True)
+    now = time.monotonic()
+    if ctx.last_prune_at is None or now - ctx.last_prune_at >= JOB_PRUNE_INTERVAL_SECONDS:
+        ctx.queue.prune(JOB_RETENTION_SECONDS, keep_kinds=RECURRING_KINDS)
+        ctx.last_prune_at = now
+    return None
+
+
+def handle_warmup(job: Job, ctx: WorkerContext) -> None:
+    ctx.db.warm_up_domain(Domain.from_url(job.payload["domain"]))
+    return None
+
+
+def handle_fetch(job: Job, ctx: WorkerContext) -> None:
+    domain = Domain.from_url(job.payload["domain"])
+    games = domain.get_games()
+    GAMES_FETCHED.inc(len(games), domain=domain.full_url)
+    ctx.queue.enqueue(
+        "merge",
+        {"games": [game.to_json() for game in games]},
+        f"merge:{job.job_id}.{job.generation}",
+    )
+    return None
+
+
+def handle_merge(job: Job, ctx: WorkerContext) -> None:
+    """
+    Diffs the fetched games against the known ones and queues the renders before merging them in.
+    A retry after a crash past the merge finds no differences left, so nothing is queued twice
+    """
+    rows = job.payload["games"]
+    if not rows:
+        return None
+    with timed("staging_insert"):
+        ctx.db.game_rows_to_temp_table(rows)
+    with timed("notify_query"):
+        users_to_notify = ctx.db.users_to_notify()
+
+    key_prefix = f"render:{job.job_id}.{job.generation}"
+    if not users_to_notify.empty:
+        is_digest = users_to_notify["IS_DIGEST"].astype(bool)
+        for (domain, game_id), df in users_to_notify[~is_digest].groupby(["DOMAIN", "ID"]):
+            ctx.queue.enqueue(
+                "render", {"rows": df.to_dict("records"), "digest": False},
+                f"{key_prefix}:{domain}:{game_id}",
+            )
+        for user_id, df in users_to_notify[is_digest].groupby("USER_ID"):
+            ctx.queue.enqueue(
+                "render", {"rows": df.to_dict("records"), "digest": True},
+                f"{key_prefix}:digest:{user_id}",
+            )
+
+    with timed("commit"):
+        ctx.db.commit_update()
+        ctx.db.commit()
+    return None
+
+
+def handle_render(job: Job, ctx: WorkerContext) -> None:
+    upds = Update.from_frame(pd.DataFrame(job.payload["rows"]))
+    blocked = [upd for upd in upds if is_blocked(upd)]
+    UPDATES_PROCESSED.inc(len(blocked), status="blocked")
+    upds = [upd for upd in upds if not is_blocked(upd)]
+
+    with timed("render"):
+        if job.payload["digest"]:
+            sends = [(upds, list(pack_messages(upd.msg for upd in upds)))] if upds else []
+        else:
+            sends = [([upd], [upd.msg]) for upd in upds]
+
+    for send_upds, texts in sends:
+        user_id = send_upds[0].user_id
+        ctx.queue.enqueue(
+            "send",
+            {
+                "user_id": ADMIN_ID if SEND_ONLY_TO_ADMIN else user_id,
+                "texts": texts,
+                "rows": [
+                    row for row in job.payload["rows"]
+                    if row["USER_ID"] == user_id
+                ],
+            },
+            f"send:{job.job_id}:{user_id}",
+        )
+    return None
+
+
+def handle_send(job: Job, ctx: WorkerContext) -> None:
+    """
+    Delivery is at least once: a worker that dies between sending and completing the job
+    leaves it to be sent again once the lease expires
+    """
+    upds = Update.from_frame(pd.DataFrame(job.payload["rows"]))
+    user_id = job.payload["user_id"]
+    sent_ts = datetime.datetime.utcnow()
+    for upd in upds:
+        upd.user_id = user_id
+        upd.sent_ts = sent_ts
+
+    try:
+        for msg in job.payload["texts"]:
+            with timed("telegram_send", method="send_message"):
+                ctx.bot.send_message(user_id, msg, parse_mode="HTML")
+            time.sleep(2 / 30)
+        for upd in upds:
+            if upd.has_diffpic:
+                send_diffpic(upd, ctx.bot, ctx.get_driver(), caption=upd.diffpic_caption if upd.is_digest else None)
+    except Exception:
+        if not job.is_last_attempt:
+            raise
+        ctx.db.updates_to_db(upds)
+        ctx.db.commit()
+        UPDATES_PROCESSED.inc(len(upds), status="failed")
+        raise
+
+    for upd in upds:
+        upd.is_delivered = True
+    ctx.db.updates_to_db(upds)
+    ctx.db.commit()
+    UPDATES_PROCESSED.inc(len(upds), status="delivered")
+    return None
+
+
+HANDLERS: typing.Dict[str, typing.Callable[[Job, WorkerContext], None]] = {
+    "warmup": handle_warmup,
+    "fetch": handle_fetch,
+    "merge": handle_merge,
+    "render": handle_render,
+    "send": handle_send,
+}
+
+
+def run_worker(roles: typing.List[str], once: bool = False) -> None:
+    """
+    Processes jobs of the given kinds until interrupted; the "schedule" role queues the due fetches
+    """
+    kinds = [r for r in roles if r in HANDLERS]
+    queue = JobQueue(DB_LOCATION, exclusive_kinds=EXCLUSIVE_KINDS)
+    updater = Updater(API_KEY, workers=1)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    with QEngNewsDB(DB_LOCATION) as db:
+        ctx = WorkerContext(db, queue, updater.bot)
+        try:
+            while True:
+                if "schedule" in roles:
+                    schedule(ctx)
+                job = queue.lease(kinds) if kinds else None
+                if job is None:
+                    if once:
+                        break
+                    time.sleep(WORKER_POLL_INTERVAL_SECONDS)
+                    continue
+
+                # noinspection PyBroadException
+                try:
+                    with timed("job", kind=job.kind):
+                        HANDLERS[job.kind](job, ctx)
+                except Exception as e:
+                    db.rollback()
+                    print("ERROR", worker_id, job.kind, job.job_id, e, sep="\n")
+                    queue.fail(job, repr(e))
+                    JOBS_PROCESSED.inc(kind=job.kind, status="failed")
+                    continue
+                if not queue.complete(job):
+                    print("WARNING", worker_id, f"lease on job {job.job_id} was lost", sep="\n")
+                JOBS_PROCESSED.inc(kind=job.kind, status="done")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if ctx.driver is not None:
+                ctx.driver.quit()
+            queue.close()
+            METRICS.write_textfile(METRICS_LOCATION)
+    return None
+
+
+if __name__ == '__main__':
+    roles_ = sys.argv[1:] or ["schedule", *HANDLERS]
+    unknown_ = set(roles_) - {"schedule", *HANDLERS}
+    assert not unknown_, f"Unknown roles: {unknown_}"
+    run_worker(roles_)